@@ -1,4 +1,20 @@
 name = "cdoctest"
 
-from .c_doctest import CDocTest
+from .c_doctest import CDocTest, CDocTestConfig
 from .cmake_api import CMakeApi
+from .header_index import HeaderIndex
+from .header_map import HeaderMap
+from .repl_session import AsyncReplSession, ReplSessionError
+from .repl_pool import ReplPool
+from .jit_cache import PreambleCache
+from .aot import AotRunner
+from .precheck import SyntaxPrecheck
+from .stress import StressRunner
+from .pipeline import Pipeline
+from .remote import RemoteRunner, Worker
+from .admission import MemoryAdmission
+from .elf_index import SymbolIndex
+from .file_walker import FileWalker, IgnoreRules
+from .impact import ImpactMap, ChangeSet, CoverageCollector, select_affected
+from .fingerprint import Fingerprinter, FingerprintStore
+from .result_cache import ResultCache
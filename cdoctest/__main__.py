@@ -1,4 +1,6 @@
 import argparse
+import itertools
+import json
 import os
 import sys
 import runpy
@@ -7,6 +9,23 @@ import clang.cindex
 
 from cdoctest import CDocTest
 from cdoctest import CMakeApi
+from cdoctest import FileWalker
+from cdoctest import ImpactMap, ChangeSet, CoverageCollector, select_affected
+from cdoctest import Fingerprinter, FingerprintStore
+from cdoctest import ResultCache
+from cdoctest import ReplPool
+from cdoctest import PreambleCache
+from cdoctest import AotRunner
+from cdoctest import CDocTestConfig
+from cdoctest.proc_stats import metrics_table
+from cdoctest.stress import StressRunner, stress_table
+from cdoctest import MemoryAdmission
+from cdoctest import SymbolIndex
+from cdoctest import RemoteRunner
+from cdoctest import SyntaxPrecheck
+from cdoctest import Pipeline
+from cdoctest import HeaderMap
+from cdoctest.remote import worker_main
 from clang_repl_kernel import ClangReplKernel, Shell
 
 s = '''
@@ -20,8 +39,11 @@ int fac(int n) {
 # TokenKind.PUNCTUATION,  CursorKind.COMPOUND_STMT remove current comment
 # TokenKind.IDENTIFIER CursorKind.FUNCTION_DECL process comment if exists
 # TokenKind.COMMENT CursorKind.INVALID_FILE add comment
-def init_include_path(cdt_include_path):
+def init_include_path(cdt_include_path, header_map=None):
     if cdt_include_path is not None:
+        if header_map is not None:
+            cdt_include_path = header_map.search_path(cdt_include_path)
+            cdoctest.header_maps = [path for path in cdt_include_path if path.endswith('.hmap')]
         cdt_include_path = ';'.join(cdt_include_path)
         # if linux replace ';' to ':'
         if os.name == 'posix':
@@ -30,9 +52,47 @@ def init_include_path(cdt_include_path):
             Shell.env['CPLUS_INCLUDE_PATH'] = cdt_include_path
 
 
+def select_tests(merged_node, target_file, args):
+    if cdt_run_testcase is not None and len(cdt_run_testcase) > 0:
+        merged_node[:] = [node for node in merged_node if node.full_path() in cdt_run_testcase]
+    if changes is not None:
+        merged_node[:] = select_affected(merged_node, impact_map, changes, os.getcwd())
+    if fingerprint_store is not None:
+        fingerprint_store.skip_unchanged(merged_node)
+    if result_cache is not None:
+        header = os.path.basename(target_file).split('.')[0] + '.' + args.cdt_header_extension
+        result_cache.apply(merged_node, ResultCache.tested_files(target_file, header))
+    if syntax_precheck is not None:
+        syntax_precheck.run(merged_node, os.path.basename(target_file).split('.')[0], args.cdt_header_extension)
+
+
 def run_test(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, target_file, args):
     target_file_name = os.path.basename(target_file).split('.')[0]
-    cdoctest.run_verify(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, target_file_name, args.cdt_header_extension)
+    select_tests(merged_node, target_file, args)
+    if remote_runner is not None:
+        remote_runner.run(cdt_target_lib, cdt_target_lib_dir, merged_node, target_file_name, args.cdt_header_extension)
+    elif args.cdt_repeat > 1 or args.cdt_concurrent > 1:
+        StressRunner(cdoctest, args.cdt_repeat, args.cdt_concurrent, admission).run(cdt_target_lib, cdt_target_lib_dir, merged_node, target_file_name, args.cdt_header_extension)
+    else:
+        # a REPL prepared ahead can not get the profile file of its test
+        pool = repl_pool if coverage_collector is None else None
+        cdoctest.run_verify(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, target_file_name, args.cdt_header_extension, pool)
+    report_test(merged_node, target_file, args)
+
+
+def aot_test(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, target_file, args):
+    # only selected here, the tests of every file are compiled into one binary once discovery is done
+    select_tests(merged_node, target_file, args)
+    aot_jobs.append((merged_node, target_file))
+
+
+def report_test(merged_node, target_file, args):
+    run_nodes.extend(merged_node)
+    if fingerprint_store is not None:
+        fingerprint_store.update(merged_node)
+        fingerprint_store.save()
+    if result_cache is not None:
+        result_cache.update(merged_node)
 
     output_file = args.cdt_output_xml
     if output_file is not None:
@@ -45,11 +105,18 @@ def run_test(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node,
             # https://github.com/unittest-cpp/unittest-cpp/blob/master/UnitTest%2B%2B/XmlTestReporter.cpp
             f.write('<unitest-results tests="'+str(num_test)+'" failedtests="'+str(fail_count)+'" >\n')
             for i in range(len(merged_node)):
-                f.write('<test suite="'+merged_node[i].suite()+'" name="'+merged_node[i].name()+'" />\n')
+                reused = '' if merged_node[i].test.reused is None else ' reused="'+merged_node[i].test.reused+'"'
+                crashed = next((test.crashed for test in merged_node[i].test.tests if test.crashed is not None), None)
+                crashed = '' if crashed is None else ' crashed="'+crashed+'"'
+                metrics = merged_node[i].test.metrics
+                measured = ''.join(' '+('time' if key == 'wall' else key)+'="'+('%.6f' % value if isinstance(value, float) else str(value))+'"'
+                                   for key, value in metrics.items())
+                f.write('<test suite="'+merged_node[i].suite()+'" name="'+merged_node[i].name()+'"'+reused+crashed+measured+' />\n')
             f.write('</unitest-results>\n')
 
     for i in range(len(merged_node)):
-        print(merged_node[i].full_path(), 'pass' if merged_node[i].test.is_pass else 'fail')
+        reused = '' if merged_node[i].test.reused is None else ' (' + merged_node[i].test.reused + ')'
+        print(merged_node[i].full_path(), ('pass' if merged_node[i].test.is_pass else 'fail') + reused)
         for test in merged_node[i].test.tests:
             if test.is_pass:
                 print('>', str(test), 'pass')
@@ -57,6 +124,23 @@ def run_test(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node,
                 print('>', str(test), 'fail')
                 print('expected: ', test.outputs)
                 print('actual: ', test.output_result)
+                if test.aborted is not None:
+                    print('aborted: ', test.aborted)
+                if test.crashed is not None:
+                    print('crashed: ', test.crashed)
+                    for line in test.crash_output:
+                        print('| ' + line)
+                if test.directive_failure is not None:
+                    print(test.directive.NAME + ': ', test.directive_failure)
+                for line in test.diagnostics:
+                    print('| ' + line)
+                if test.output_file is not None:
+                    print('full output: ', test.output_file)
+            if test.directive_result is not None:
+                print(test.directive.NAME + ': ', test.directive.format(test.directive_result))
+
+    if coverage_collector is not None:
+        impact_map.save()
 
 # const testCaseInfo = line.split(',');
 #         const fixtureTest = testCaseInfo[0];
@@ -69,20 +153,49 @@ def list_test(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node,
             + str(node.id_token.extent.start.column) + ',' + str(node.id_token.extent.end.line) + ',' \
             + str(node.id_token.extent.end.column))
 
-def do_job(job_function, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path,  cdt_run_testcase, args):
-    for target_file in target_files:
-        abs_target_file = os.path.realpath(target_file)
-        assert os.path.exists(abs_target_file) and os.path.isfile(abs_target_file)
-        relative_path_from_cwd = os.path.relpath(abs_target_file, os.getcwd())
+def discover(target_file, cdt_src_path):
+    abs_target_file = os.path.realpath(target_file)
+    assert os.path.exists(abs_target_file) and os.path.isfile(abs_target_file)
+    relative_path_from_cwd = os.path.relpath(abs_target_file, os.getcwd())
+    # a file shared by several targets is parsed once
+    merged_node = discovery_cache.get(abs_target_file)
+    if merged_node is None:
         with open(abs_target_file, 'r') as f:
             c_tests_nodes = []
             c_file_content = f.read()
             cdoctest.parse_result_test_node(c_file_content, c_tests_nodes, relative_path_from_cwd, cdt_src_path)
             merged_node = cdoctest.merge_comments(c_tests_nodes, None)
-            job_function(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, abs_target_file, args)
+        discovery_cache[abs_target_file] = merged_node
+    else:
+        for node in merged_node:
+            node.test.reset()
+    return abs_target_file, merged_node
+
+
+def do_job(job_function, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path,  cdt_run_testcase, args):
+    for target_file in target_files:
+        abs_target_file, merged_node = discover(target_file, cdt_src_path)
+        job_function(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase, list(merged_node), abs_target_file, args)
+
+
+def pipeline_job(job_function, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path, cdt_run_testcase, args):
+    # like do_job, measured, and with --cdt_pipeline the next files are parsed while the tests run
+    job = lambda abs_target_file, merged_node: job_function(cdt_target_lib, cdt_target_lib_dir, cdt_run_testcase,
+                                                            list(merged_node), abs_target_file, args)
+    if args.cdt_pipeline:
+        if repl_pool is not None and coverage_collector is None and remote_runner is None and not stress:
+            repl_pool.warm(cdt_target_lib, cdt_target_lib_dir)
+        pipeline.run(target_files, job)
+    else:
+        pipeline.run_sequential(target_files, job)
 
 
 if __name__ == '__main__':
+    # 'cdoctest worker --listen PORT' runs the tests of a coordinator started with --cdt_workers
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        worker_main(sys.argv[2:])
+        sys.exit()
+
     # args "target file", "target tc", "target lib"
     parser = argparse.ArgumentParser(
         prog='cdoctest',
@@ -90,6 +203,8 @@ if __name__ == '__main__':
     parser.add_argument('-cdtsrp', '--cdt_src_root_path', help='Source file root path. Default is current directory.', default=os.getcwd())
 
     parser.add_argument('-cdttf', '--cdt_target_file', help='target file')
+    parser.add_argument('-cdttd', '--cdt_target_dir', help='target directory to search recursively, separate by ";"')
+    parser.add_argument('-cdtxp', '--cdt_exclude_path', help='.gitignore style patterns excluded from --cdt_target_dir, separate by ";"', default='')
     parser.add_argument('-cdtl', '--cdt_target_lib', help='target lib, separate by ";"')
     parser.add_argument('-cdtlp', '--cdt_lib_path', help='target lib dir path, separate by ";"')
     parser.add_argument('-cdtip', '--cdt_include_path', help='target include path, separate by ";"')
@@ -100,7 +215,7 @@ if __name__ == '__main__':
 
     parser.add_argument('-v', '--verbose', help='verbose mode', default=False, action='store_true')
 
-    parser.add_argument('-cdtct', '--cdt_cmake_target', help='target to test, current build target will be used if not present.')
+    parser.add_argument('-cdtct', '--cdt_cmake_target', help='target to test, separate by ";". A name which is not a target is a regex matched against target names, "all" selects every library and executable target. Current build target will be used if not present.')
     parser.add_argument('-cdtcbp', '--cdt_cmake_build_path', help='cmake build path to search cmake api.')
 
     parser.add_argument('-cdtsp', '--cdt_src_path', help='Source file root path.')
@@ -108,7 +223,30 @@ if __name__ == '__main__':
     parser.add_argument('-cdtlt', '--cdt_list_testcase', help='list all available test cases. Use "2> error.log" when there is a system message', default=False, action='store_true')
     parser.add_argument('-cdtrt', '--cdt_run_testcase', help='run a or lists of test cases, separate by ";"')
     parser.add_argument('-cdtox', '--cdt_output_xml', help='output xml file', default='output.vsc')
-
+    parser.add_argument('-cdtoj', '--cdt_output_json', help='output json file with the result and resource use of every test')
+    parser.add_argument('-cdttt', '--cdt_top_tests', help='number of tests in the slowest and heaviest tests tables, 0 for none', type=int, default=20)
+
+    parser.add_argument('-cdtcm', '--cdt_coverage_map', help='test impact map file. Coverage of each test is recorded into it when --cdt_affected_by is not given or --cdt_coverage_collect is set. Libraries must be built with "-fprofile-instr-generate -fcoverage-mapping"')
+    parser.add_argument('-cdtcc', '--cdt_coverage_collect', help='record coverage into --cdt_coverage_map even with --cdt_affected_by', default=False, action='store_true')
+    parser.add_argument('-cdtab', '--cdt_affected_by', help='run only tests affected by a unified diff file, "-" for a diff from stdin, or changed files separated by ";". Needs --cdt_coverage_map')
+    parser.add_argument('-cdtfp', '--cdt_fingerprint_file', help='fingerprint file. Tests whose doc comment, declaration, referenced declarations and libraries are unchanged since their last pass are not run again')
+    parser.add_argument('-cdtsfp', '--cdt_single_file_parse', help='discover tests without following #include. Much faster, but declarations using macros of included headers may be missed', default=False, action='store_true')
+    parser.add_argument('-cdtnrc', '--cdt_no_result_cache', help='do not reuse or record cached results of passing tests. A result is reused while the test, the tested file and the headers it includes, the include and library paths, the libraries and clang-repl are unchanged', default=False, action='store_true')
+    parser.add_argument('-cdtrcd', '--cdt_result_cache_dir', help='result cache directory. Default is the user cache directory')
+    parser.add_argument('-cdtrcs', '--cdt_result_cache_size', help='result cache size limit in MB, least recently used results are removed first', type=int, default=64)
+    parser.add_argument('-cdtaot', '--cdt_aot', help='compile the tests into one native test binary linked with the target libraries, tests which can not be compiled run in the REPL', default=False, action='store_true')
+    parser.add_argument('-cdtrp', '--cdt_repeat', help='run every test this many times and report its pass rate and wall time distribution', type=int, default=1)
+    parser.add_argument('-cdtcr', '--cdt_concurrent', help='number of REPL workers running the repeated tests', type=int, default=1)
+    parser.add_argument('-cdtwm', '--cdt_worker_memory', help='memory in MB a REPL worker is expected to use until one was measured. Fewer than --cdt_concurrent workers run when the available memory does not hold them', type=int, default=800)
+    parser.add_argument('-cdtce', '--cdt_check_exports', help='fail a test without starting a REPL when no target library exports a symbol of the tested declaration, read from their ELF dynamic symbols', default=False, action='store_true')
+    parser.add_argument('-cdtwk', '--cdt_workers', help='"host:port" of workers started with "cdoctest worker --listen PORT", separate by ";". Tests run on the workers, which need the build tree at the same path. A worker given twice runs two tests at once')
+    parser.add_argument('-cdtwt', '--cdt_worker_token', help='shared token of the workers, default: $CDOCTEST_WORKER_TOKEN')
+    parser.add_argument('-cdtsc', '--cdt_syntax_check', help='check the commands of every test with libclang before a REPL is started, tests which do not compile are reported with the clang errors and not run', default=False, action='store_true')
+    parser.add_argument('-cdtpl', '--cdt_pipeline', help='parse the next files while the tests of a file run, and start the first REPL while the first file is parsed', default=False, action='store_true')
+    parser.add_argument('-cdthm', '--cdt_header_map', help='look up headers of the include directories in clang header maps instead of searching every directory, built once and cached until a directory changes', default=False, action='store_true')
+    parser.add_argument('-cdtpc', '--cdt_preamble_cache', help='start REPLs with a precompiled header of the standard headers they include, built once per clang-repl version. Needs clang++ of the clang-repl version', default=False, action='store_true')
+    parser.add_argument('-cdtmob', '--cdt_max_output_bytes', help='abort a command printing more bytes than this', type=int, default=CDocTestConfig.MAX_OUTPUT_BYTES)
+    parser.add_argument('-cdtmol', '--cdt_max_output_lines', help='abort a command printing more lines than this', type=int, default=CDocTestConfig.MAX_OUTPUT_LINES)
     parser.add_argument('-cdtit', '--cdt_include_target', help='target test case included regex, \';\' separated. can not be used with --cdt_exclude_target', default='')
     parser.add_argument('-cdtet', '--cdt_exclude_target', help='target test case excluded regex, \';\' separated. can not be used with --cdt_include_target', default='')
 
@@ -121,7 +259,7 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    none_cmake_args = ["cdt_target_file", "cdt_target_lib"]
+    none_cmake_args = ["cdt_target_file", "cdt_target_dir", "cdt_target_lib"]
     cmake_args = ["cdt_cmake_build_path", "cdt_cmake_target"]
     exist_none_cmake_args = any([getattr(args, arg) is not None for arg in none_cmake_args])
     exist_cmake_args = any([getattr(args, arg) is not None for arg in cmake_args])
@@ -133,15 +271,47 @@ if __name__ == '__main__':
         raise Exception("Cannot use --cdt_list_testcase and --cdt_run_testcase together.")
 
 
-    if args.cdt_target_file is None and args.cdt_cmake_build_path is None:
-        raise Exception("Either target file --cdt_target_file or cmake build path --cdt_cmake_build_path should be provided.")
+    if args.cdt_target_file is None and args.cdt_target_dir is None and args.cdt_cmake_build_path is None:
+        raise Exception("Either target file --cdt_target_file, target directory --cdt_target_dir or cmake build path --cdt_cmake_build_path should be provided.")
+
+    if args.cdt_affected_by is not None and args.cdt_coverage_map is None:
+        raise Exception("--cdt_affected_by needs --cdt_coverage_map.")
 
     if len(args.cdt_include_target) > 0 and len(args.cdt_exclude_target) > 0:
         raise Exception("Cannot use --cdt_include_target and --cdt_exclude_target together.")
 
+    if args.cdt_single_file_parse and args.cdt_fingerprint_file is not None:
+        raise Exception("Cannot use --cdt_single_file_parse and --cdt_fingerprint_file together, fingerprints need included declarations.")
+
+    if args.cdt_check_exports and os.name == 'nt':
+        raise Exception("--cdt_check_exports reads ELF shared libraries, it is not supported on Windows.")
+
+    if args.cdt_aot and args.cdt_coverage_map is not None:
+        raise Exception("Cannot use --cdt_aot and --cdt_coverage_map together, coverage is recorded per REPL.")
+
+    if args.cdt_header_map and (args.cdt_aot or args.cdt_workers is not None):
+        raise Exception("Cannot use --cdt_header_map with --cdt_aot or --cdt_workers, header maps are read by clang on this machine only.")
+
+    stress = args.cdt_repeat > 1 or args.cdt_concurrent > 1
+    if args.cdt_workers is not None and (stress or args.cdt_aot or args.cdt_coverage_map is not None):
+        raise Exception("Cannot use --cdt_workers with --cdt_repeat, --cdt_concurrent, --cdt_aot or --cdt_coverage_map.")
+
+    if stress and (args.cdt_aot or args.cdt_coverage_map is not None or args.cdt_fingerprint_file is not None):
+        raise Exception("Cannot use --cdt_repeat or --cdt_concurrent with --cdt_aot, --cdt_coverage_map or --cdt_fingerprint_file.")
+
     verbose = args.verbose
+    # shared by every file and target, so what is learned about worker memory is kept. Without stress runs a
+    # test REPL and the one ReplPool prepares run at once
+    admission = MemoryAdmission(args.cdt_concurrent if stress else 2, args.cdt_worker_memory * 1024 * 1024)
+
+    CDocTestConfig.MAX_OUTPUT_BYTES = args.cdt_max_output_bytes
+    CDocTestConfig.MAX_OUTPUT_LINES = args.cdt_max_output_lines
 
     cdoctest = CDocTest()
+    cdoctest.single_file_parse = args.cdt_single_file_parse
+    cdoctest.admission = admission
+    if args.cdt_preamble_cache and not args.cdt_list_testcase:
+        cdoctest.preamble_cache = PreambleCache(verbose=verbose)
     c_tests_nodes = []
     Shell.env = os.environ.copy()
 
@@ -173,34 +343,184 @@ if __name__ == '__main__':
     cdt_exclude_target = args.cdt_exclude_target.split(';') if len(args.cdt_exclude_target) != 0 else []
 
     cdt_src_path = args.cdt_src_path
-    # cdt_cmake_build_path
+    # cdt_cmake_build_path, the CMake model is configured once and shared by every target
     cdt_cmake_build_path = args.cdt_cmake_build_path
+    cmakeApi = None
+    cmake_targets = [None]
     if cdt_cmake_build_path is not None:
         assert os.path.exists(cdt_cmake_build_path) and os.path.isdir(cdt_cmake_build_path)
         assert cdt_cmake_target is not None
-        cmakeApi = CMakeApi(cdt_cmake_build_path, cdt_cmake_target, cdt_include_target, cdt_exclude_target, verbose)
-        cdt_cmake_target = cmakeApi.get_target()
-        artifact = cmakeApi.get_all_libs_artifact()
-        cdt_target_lib = cdt_target_lib + artifact
-        cdt_include_path = cdt_include_path +list(cmakeApi.get_all_include_path())
-        target_files = list(cmakeApi.get_all_candidate_sources_headers(target_files, args.cdt_c_extension, args.cdt_cpp_extension, args.cdt_header_extension))
+        cmakeApi = CMakeApi(cdt_cmake_build_path, None, cdt_include_target, cdt_exclude_target, verbose)
+        cmake_targets = cmakeApi.match_targets(cdt_cmake_target.split(';'))
+        assert len(cmake_targets) > 0, f"No target matches '{cdt_cmake_target}'."
+        if len(cmake_targets) > 1 and (args.cdt_coverage_map is not None or args.cdt_fingerprint_file is not None):
+            raise Exception("Cannot use --cdt_coverage_map or --cdt_fingerprint_file with several --cdt_cmake_target targets.")
         if cdt_src_path is None:
             cdt_src_path = cmakeApi.source_path
 
     cdt_src_path = os.path.realpath(cdt_src_path)
 
-    # cdt_include_path
-    init_include_path(cdt_include_path)
-
     # cdt_run_testcase
     cdt_run_testcase = [] if args.cdt_run_testcase is None else args.cdt_run_testcase.split(';')
 
-    # cdt_list_testcase
-    if args.cdt_list_testcase:
-        do_job(list_test, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path, cdt_run_testcase, args)
+    # shared by every target: parsed files and REPLs prepared ahead per library set
+    discovery_cache = {}
+    repl_pool = None if args.cdt_list_testcase or args.cdt_workers is not None else ReplPool(cdoctest)
+    header_map = HeaderMap() if args.cdt_header_map else None
+    pipeline = Pipeline(lambda target_file: discover(target_file, cdt_src_path))
+    cdoctest.listeners.append(pipeline)
+    syntax_precheck = None
+    if args.cdt_syntax_check and not args.cdt_list_testcase:
+        syntax_precheck = SyntaxPrecheck(cdoctest, verbose=verbose)
+    remote_runner = None
+    if args.cdt_workers is not None and not args.cdt_list_testcase:
+        remote_runner = RemoteRunner(cdoctest, [address for address in args.cdt_workers.split(';') if address.strip() != ''], verbose, args.cdt_worker_token)
+    target_results = []
+
+    base_target_files = target_files
+    base_target_lib = cdt_target_lib
+    base_include_path = cdt_include_path
+    for cmake_target in cmake_targets:
+        target_files = base_target_files
+        cdt_target_lib = base_target_lib
+        cdt_include_path = base_include_path
+        if cmakeApi is not None:
+            if len(cmake_targets) > 1:
+                print("target:", cmake_target)
+            cmakeApi.set_target_name(cmake_target)
+            artifact = cmakeApi.get_all_libs_artifact()
+            cdt_target_lib = cdt_target_lib + artifact
+            cdt_include_path = cdt_include_path +list(cmakeApi.get_all_include_path())
+            target_files = list(cmakeApi.get_all_candidate_sources_headers(target_files, args.cdt_c_extension, args.cdt_cpp_extension, args.cdt_header_extension))
+
+        # cdt_include_path
+        init_include_path(cdt_include_path, header_map)
+        if header_map is not None and verbose:
+            print("header map:", header_map.headers, "headers,", len(cdoctest.header_maps), "maps")
+
+        # cdt_target_dir, files are streamed to do_job while the walk is still running
+        if args.cdt_target_dir is not None:
+            cdt_exclude_path = args.cdt_exclude_path.split(';') if len(args.cdt_exclude_path) != 0 else []
+            walker = FileWalker(args.cdt_target_dir.split(';'),
+                                [args.cdt_cpp_extension, args.cdt_c_extension, args.cdt_header_extension],
+                                cdt_exclude_path)
+            target_files = itertools.chain(target_files, walker.walk())
+
+        # cdt_check_exports
+        if args.cdt_check_exports and not args.cdt_list_testcase:
+            cdoctest.symbol_index = SymbolIndex([CDocTest.find_lib(lib, cdt_target_lib_dir) for lib in cdt_target_lib])
+
+        # cdt_coverage_map, cdt_affected_by
+        impact_map = None
+        changes = None
+        coverage_collector = None
+        if args.cdt_coverage_map is not None:
+            impact_map = ImpactMap(os.path.abspath(args.cdt_coverage_map))
+            if args.cdt_affected_by is not None:
+                changes = ChangeSet.parse(args.cdt_affected_by)
+            if not args.cdt_list_testcase and (changes is None or args.cdt_coverage_collect):
+                libs = [CDocTest.find_lib(lib, cdt_target_lib_dir) for lib in cdt_target_lib]
+                coverage_collector = CoverageCollector(impact_map, libs,
+                                                       os.path.join(os.path.dirname(impact_map.path), 'cdoctest_profile'),
+                                                       verbose=verbose)
+                cdoctest.listeners.append(coverage_collector)
+
+        # cdt_fingerprint_file
+        fingerprint_store = None
+        if args.cdt_fingerprint_file is not None and not args.cdt_list_testcase:
+            fingerprinter = Fingerprinter([CDocTest.find_lib(lib, cdt_target_lib_dir) for lib in cdt_target_lib])
+            fingerprint_store = FingerprintStore(os.path.abspath(args.cdt_fingerprint_file), fingerprinter)
+
+        # cdt_no_result_cache
+        result_cache = None
+        if not args.cdt_no_result_cache and not args.cdt_list_testcase and not stress:
+            result_cache = ResultCache(args.cdt_result_cache_dir, args.cdt_result_cache_size * 1024 * 1024,
+                                       [CDocTest.find_lib(lib, cdt_target_lib_dir) for lib in cdt_target_lib])
+
+        run_nodes = []
+        # cdt_list_testcase
+        if args.cdt_list_testcase:
+            do_job(list_test, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path, cdt_run_testcase, args)
+
+        elif args.cdt_aot:
+            aot_jobs = []
+            do_job(aot_test, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path, cdt_run_testcase, args)
+            aot_runner = AotRunner(cdoctest, verbose=verbose)
+            aot_runner.run(cdt_target_lib, cdt_target_lib_dir,
+                           [(nodes, os.path.basename(target_file).split('.')[0] + '.' + args.cdt_header_extension)
+                            for nodes, target_file in aot_jobs])
+            fallback = set(id(node) for node in aot_runner.fallback)
+            for merged_node, target_file in aot_jobs:
+                repl_nodes = [node for node in merged_node if id(node) in fallback]
+                if len(repl_nodes) > 0:
+                    cdoctest.run_verify(cdt_target_lib, cdt_target_lib_dir, None, repl_nodes,
+                                        os.path.basename(target_file).split('.')[0], args.cdt_header_extension, repl_pool)
+                report_test(merged_node, target_file, args)
+            print("aot:", len(aot_runner.compiled), "tests compiled,", len(aot_runner.fallback), "run in the REPL,",
+                  aot_runner.not_compiled, "did not compile,", aot_runner.not_linked, "did not link")
 
-    else:
-        do_job(run_test, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path, cdt_run_testcase, args)
+        else:
+            pipeline_job(run_test, target_files, cdt_target_lib, cdt_target_lib_dir, cdt_src_path, cdt_run_testcase, args)
+        target_results.append((cmake_target, run_nodes))
+
+        if result_cache is not None:
+            result_cache.prune()
+            if verbose:
+                print("result cache hits:", result_cache.hits, "misses:", result_cache.misses)
+
+    if repl_pool is not None:
+        repl_pool.close()
+
+    if pipeline.total is not None and (args.cdt_pipeline or verbose):
+        first_result = 'no result' if pipeline.first_result is None else 'first result after %.2f s' % pipeline.first_result
+        print(first_result + ", total %.2f s, %.2f s parsing, %.2f s waiting for parsing"
+              % (pipeline.total, pipeline.discovery, pipeline.waited))
+
+    if syntax_precheck is not None:
+        print("precheck:", syntax_precheck.checked, "tests checked,", syntax_precheck.rejected, "do not compile")
+
+    if remote_runner is not None:
+        remote_runner.close()
+        lost = [worker for worker in remote_runner.workers if worker.lost is not None]
+        print("workers:", remote_runner.completed, "tests run on", len(remote_runner.workers), "workers,",
+              remote_runner.reassigned, "reassigned,", len(lost), "lost")
+
+    if cdoctest.preamble_cache is not None:
+        preamble_cache = cdoctest.preamble_cache
+        print("preamble cache hits:", preamble_cache.hits, "misses:", preamble_cache.misses,
+              "estimated saving: %.1f s (precompiling time per hit)" % preamble_cache.saved)
+
+    if len(target_results) > 1 and not args.cdt_list_testcase:
+        for cmake_target, nodes in target_results:
+            failed = len([node for node in nodes if not node.test.is_pass])
+            reused = len([node for node in nodes if node.test.reused is not None])
+            print("target", cmake_target + ":", len(nodes), "tests,", failed, "failed,", reused, "reused")
+
+    if not args.cdt_list_testcase:
+        for line in stress_table([node for _, nodes in target_results for node in nodes]):
+            print(line)
+        for line in metrics_table([node for _, nodes in target_results for node in nodes], args.cdt_top_tests):
+            print(line)
+
+    if stress:
+        report = admission.report()
+        print("concurrency:", report['effective'], "of", report['max_workers'], "workers,", report['waits'],
+              "waits for memory, %.0f MB per worker" % (report['worker_bytes'] / (1024 * 1024)))
+
+    if args.cdt_output_json is not None and not args.cdt_list_testcase:
+        results = []
+        for cmake_target, nodes in target_results:
+            for node in nodes:
+                crashed = next((test.crashed for test in node.test.tests if test.crashed is not None), None)
+                results.append({'target': cmake_target, 'suite': node.suite(), 'name': node.name(),
+                                'test': node.rel_full_path(), 'pass': node.test.is_pass, 'reused': node.test.reused,
+                                'crashed': crashed, 'metrics': node.test.metrics,
+                                'directives': [dict(test.directive_result, directive=test.directive.NAME, command=str(test),
+                                                    failure=test.directive_failure)
+                                               for test in node.test.tests if test.directive_result is not None]})
+        with open(args.cdt_output_json, 'w') as f:
+            json.dump({'tests': len(results), 'failedtests': len([result for result in results if not result['pass']]),
+                       'concurrency': admission.report() if stress else None, 'results': results}, f, indent=1)
 
     # Don't know why exception yet.
     try:
@@ -0,0 +1,108 @@
+import os
+import threading
+
+# admission of REPL workers by memory. A worker is started when the memory left, from /proc/meminfo and the
+# cgroup limit, holds one more worker of the largest peak RSS seen so far (worker_bytes before the first
+# one finished). Otherwise its test waits for a running worker to finish. One worker is always admitted.
+# CDocTest.new_shell takes a slot for every REPL it starts, ReplPool only prepares a REPL when one is free.
+
+MB = 1024 * 1024
+
+
+def _read_int(path):
+    try:
+        with open(path, 'r') as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def meminfo_available():
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def cgroup_available(root='/sys/fs/cgroup'):
+    # cgroup v2, then v1. None without a limit
+    for limit_file, usage_file in [('memory.max', 'memory.current'),
+                                   ('memory/memory.limit_in_bytes', 'memory/memory.usage_in_bytes')]:
+        limit = _read_int(os.path.join(root, limit_file))
+        usage = _read_int(os.path.join(root, usage_file))
+        # v1 reports no limit as a huge number
+        if limit is not None and usage is not None and limit < 1 << 60:
+            return max(0, limit - usage)
+    return None
+
+
+class MemoryAdmission:
+    RESERVE_BYTES = 512 * MB
+    WAIT_SECONDS = 1
+
+    def __init__(self, max_workers, worker_bytes=800 * MB, reserve_bytes=None, available=None):
+        self.max_workers = max_workers
+        self.worker_bytes = worker_bytes
+        self.reserve_bytes = self.RESERVE_BYTES if reserve_bytes is None else reserve_bytes
+        # callable returning the available bytes, None when unknown
+        self._available = self.available if available is None else available
+        self.observed_bytes = None
+        self.running = 0
+        # most workers running at once, and how often a test waited for memory
+        self.effective = 0
+        self.waits = 0
+        self.lowest_available = None
+        self.idle_available = None
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def available():
+        values = [value for value in [meminfo_available(), cgroup_available()] if value is not None]
+        return min(values) if len(values) > 0 else None
+
+    def estimate(self):
+        return self.worker_bytes if self.observed_bytes is None else self.observed_bytes
+
+    def capacity(self):
+        # workers the memory holds. Running workers count with the estimate, and the memory available
+        # without workers is the upper bound, as a just started worker did not take its memory yet
+        available = self._available()
+        if available is None:
+            return self.max_workers
+        if self.lowest_available is None or available < self.lowest_available:
+            self.lowest_available = available
+        if self.running == 0:
+            self.idle_available = available
+        budget = min(self.idle_available, available + self.running * self.estimate()) - self.reserve_bytes
+        return max(1, min(self.max_workers, int(budget // max(1, self.estimate()))))
+
+    def acquire(self, wait=True):
+        # False without wait when the worker is not admitted now
+        with self._condition:
+            waited = False
+            while self.running >= self.capacity() and self.running > 0:
+                if not wait:
+                    return False
+                waited = True
+                self._condition.wait(self.WAIT_SECONDS)
+            if waited:
+                self.waits += 1
+            self.running += 1
+            self.effective = max(self.effective, self.running)
+            return True
+
+    def release(self, peak_rss=None):
+        with self._condition:
+            self.running -= 1
+            if peak_rss is not None and (self.observed_bytes is None or peak_rss > self.observed_bytes):
+                self.observed_bytes = peak_rss
+            self._condition.notify_all()
+
+    def report(self):
+        return {'max_workers': self.max_workers, 'effective': self.effective, 'waits': self.waits,
+                'worker_bytes': self.estimate(), 'lowest_available_bytes': self.lowest_available}
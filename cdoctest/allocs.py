@@ -0,0 +1,166 @@
+import hashlib
+import itertools
+import os
+import re
+import shutil
+import subprocess
+
+from .result_cache import default_cache_dir
+
+# '>>> %allocs parse(buf) == 0' in a doc comment counts the malloc/new calls and bytes of one evaluation of
+# the expression. The counting allocator is preloaded into the REPL of tests using the directive, the
+# counters are per thread so allocations of the REPL itself are not counted.
+
+ALLOCS_PATTERN = re.compile(r'^%allocs\s+(?P<expr>.+?)\s*;?'
+                            r'(?:\s+(?P<op>==|<=|<)\s*(?P<limit>[0-9]+))?\s*$')
+
+OUTPUT_PREFIX = 'cdoctest_allocs '
+
+SOURCE = ('extern "C" long long cdoctest_alloc_count(); extern "C" long long cdoctest_alloc_bytes(); '
+          'int cdoctest_allocs_{id} = []() {{ '
+          'long long count = cdoctest_alloc_count(), bytes = cdoctest_alloc_bytes(); (void)({expr}); '
+          'count = cdoctest_alloc_count() - count; bytes = cdoctest_alloc_bytes() - bytes; '
+          'std::printf("' + OUTPUT_PREFIX + '%lld %lld\\n", count, bytes); return 0; }}();')
+
+# operator new of libstdc++ and libc++ allocates with malloc
+COUNTER_SOURCE = r'''
+#include <stddef.h>
+#include <string.h>
+
+extern void *__libc_malloc(size_t size);
+extern void *__libc_calloc(size_t count, size_t size);
+extern void *__libc_realloc(void *ptr, size_t size);
+extern void *__libc_memalign(size_t alignment, size_t size);
+
+static __thread long long alloc_count __attribute__((tls_model("initial-exec")));
+static __thread long long alloc_bytes __attribute__((tls_model("initial-exec")));
+
+long long cdoctest_alloc_count(void) { return alloc_count; }
+long long cdoctest_alloc_bytes(void) { return alloc_bytes; }
+
+static void *counted(void *ptr, size_t size) {
+    if (ptr != NULL) {
+        alloc_count++;
+        alloc_bytes += size;
+    }
+    return ptr;
+}
+
+void *malloc(size_t size) { return counted(__libc_malloc(size), size); }
+void *calloc(size_t count, size_t size) { return counted(__libc_calloc(count, size), count * size); }
+void *realloc(void *ptr, size_t size) { return counted(__libc_realloc(ptr, size), size); }
+void *memalign(size_t alignment, size_t size) { return counted(__libc_memalign(alignment, size), size); }
+void *aligned_alloc(size_t alignment, size_t size) { return memalign(alignment, size); }
+int posix_memalign(void **ptr, size_t alignment, size_t size) {
+    *ptr = memalign(alignment, size);
+    return *ptr == NULL ? 12 : 0;
+}
+'''
+
+
+class AllocCounter:
+    # the counting allocator library, compiled once into the cache directory. None where it can not be
+    # preloaded (glibc only)
+    _path = None
+    _error = None
+
+    @classmethod
+    def library(cls):
+        if cls._path is None and cls._error is None:
+            cls._path, cls._error = cls._build()
+        return cls._path
+
+    @classmethod
+    def error(cls):
+        cls.library()
+        return cls._error
+
+    @staticmethod
+    def _build():
+        if os.name == 'nt' or not os.path.exists('/proc'):
+            return None, 'allocation counting needs Linux'
+        compiler = next((shutil.which(cc) for cc in ['cc', 'gcc', 'clang'] if shutil.which(cc) is not None), None)
+        if compiler is None:
+            return None, 'allocation counting needs a C compiler (cc, gcc or clang)'
+        digest = hashlib.sha256(COUNTER_SOURCE.encode('utf-8')).hexdigest()[:16]
+        cache_dir = os.path.join(os.path.dirname(default_cache_dir()), 'alloc_counter')
+        path = os.path.join(cache_dir, 'cdoctest_alloc_counter_' + digest + '.so')
+        if os.path.exists(path):
+            return path, None
+        os.makedirs(cache_dir, exist_ok=True)
+        source = path[:-3] + '.c'
+        with open(source, 'w') as f:
+            f.write(COUNTER_SOURCE)
+        # built under a temporary name, so a REPL never preloads a half written library
+        building = path + '.' + str(os.getpid())
+        result = subprocess.run([compiler, '-shared', '-fPIC', '-O2', '-o', building, source],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        if result.returncode != 0:
+            return None, 'could not build the allocation counter: ' + result.stdout.strip()
+        os.replace(building, path)
+        return path, None
+
+    @classmethod
+    def preload(cls, env):
+        # env with the counter preloaded
+        env = dict(env)
+        env['LD_PRELOAD'] = cls.library() + (' ' + env['LD_PRELOAD'] if env.get('LD_PRELOAD') else '')
+        return env
+
+
+class AllocsDirective:
+    NAME = 'allocs'
+    # the REPL needs AllocCounter preloaded
+    PRELOAD = True
+    _ids = itertools.count()
+
+    def __init__(self, expr, op=None, limit=None):
+        self.expr = expr
+        self.op = op
+        self.limit = limit
+        self.count = None
+        self.bytes = None
+
+    @classmethod
+    def parse(cls, cmd):
+        cmd = cmd.strip()
+        if not cmd.startswith('%allocs'):
+            return None
+        matched = ALLOCS_PATTERN.match(cmd)
+        assert matched is not None, 'expected "%allocs <expression> [==|<=|< <count>]": ' + cmd
+        limit = None if matched.group('limit') is None else int(matched.group('limit'))
+        return cls(matched.group('expr'), matched.group('op'), limit)
+
+    def commands(self):
+        return [SOURCE.format(id=next(self._ids), expr=self.expr)]
+
+    def feed_line(self, line):
+        if not line.startswith(OUTPUT_PREFIX):
+            return False
+        values = line[len(OUTPUT_PREFIX):].split()
+        self.count = int(values[0])
+        self.bytes = int(values[1])
+        return True
+
+    def reset(self):
+        self.count = None
+        self.bytes = None
+
+    def result(self):
+        if self.count is None:
+            return None
+        return {'allocs': self.count, 'bytes': self.bytes, 'limit': self.limit}
+
+    def failure(self):
+        if self.count is None:
+            error = AllocCounter.error()
+            return 'nothing counted' + ('' if error is None else ', ' + error)
+        if self.limit is None:
+            return None
+        if {'==': self.count == self.limit, '<=': self.count <= self.limit, '<': self.count < self.limit}[self.op]:
+            return None
+        return str(self.count) + ' allocations is not ' + self.op + ' ' + str(self.limit)
+
+    @staticmethod
+    def format(result):
+        return str(result['allocs']) + ' allocations, ' + str(result['bytes']) + ' bytes'
@@ -0,0 +1,293 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from clang_repl_kernel import Shell
+
+from .c_doctest import CDocTest, CDocTestConfig, describe_exit
+
+# ahead of time backend: every test case whose commands are plain statements becomes a C++ function, the
+# functions are compiled in parallel and linked with the tested libraries into one executable. Its output
+# is split by marker lines into the output of every command and compared like REPL output. Test cases
+# using REPL only commands (#include, %lib, %bench, definitions, ...) or not compiling run in the REPL.
+# Every test runs in a process forked after the libraries are loaded, so global and static state of one
+# test does not leak into the next, as with a REPL per test. On Windows the tests share one process.
+
+MARK = '\x1ecdoctest'
+# '<mark> test command' before every command, '<mark>_exit position returncode' after a test process
+# which did not end with 0
+MARK_PATTERN = re.compile('\n?' + MARK + r'(_exit)? (-?\d+) (-?\d+)\n')
+
+MAIN_SOURCE = r'''#include <cstdio>
+#include <cstdlib>
+#include <iostream>
+#ifndef _WIN32
+#include <sys/wait.h>
+#include <unistd.h>
+#endif
+
+void cdoctest_aot_mark(int test, int command) {
+    // "\x1e" "cdoctest", the hex escape would swallow the following letters
+    std::printf("\n\x1e" "cdoctest %d %d\n", test, command);
+}
+
+// runs a test in its own process, returns its exit code, minus the signal number when it was killed
+int cdoctest_aot_run(void (*test)()) {
+#ifndef _WIN32
+    pid_t pid = fork();
+    if (pid == 0) {
+        test();
+        std::_Exit(0);
+    }
+    int status = 0;
+    if (pid > 0 && waitpid(pid, &status, 0) == pid) {
+        return WIFSIGNALED(status) ? -WTERMSIG(status) : WEXITSTATUS(status);
+    }
+#endif
+    test();
+    return 0;
+}
+
+TEST_DECLARATIONS
+
+void (*cdoctest_aot_tests[])() = {TEST_TABLE};
+
+int main(int argc, char **argv) {
+    // unbuffered, so output of std::cout, printf and stderr keeps its order and survives a crash
+    std::setvbuf(stdout, nullptr, _IONBF, 0);
+    std::cout << std::unitbuf;
+    int count = sizeof(cdoctest_aot_tests) / sizeof(cdoctest_aot_tests[0]);
+    for (int i = argc > 1 ? std::atoi(argv[1]) : 0; i < count; ++i) {
+        int returncode = cdoctest_aot_run(cdoctest_aot_tests[i]);
+        if (returncode != 0) {
+            std::printf("\n\x1e" "cdoctest_exit %d %d\n", i, returncode);
+        }
+    }
+    cdoctest_aot_mark(-1, 0);
+    return 0;
+}
+'''
+
+def compile_args():
+    # language standard and include directories of the REPL and libclang
+    include_path = (Shell.env.get('CPLUS_INCLUDE_PATH') or '').split(os.pathsep)
+    return ['-std=c++20', '-I' + os.getcwd()] + ['-I' + path for path in include_path if path != '']
+
+
+# 'int f(int n) {', a function definition can not be a statement
+DEFINITION_PATTERN = re.compile(r'^[\w:<>,\s\*&~]+\s+[\w:~]+\s*\([^;]*\)\s*(const\s*)?\{')
+
+
+def statement(cmd):
+    # C++ statement of a REPL command, None when it only works in the REPL
+    cmd = cmd.strip()
+    if cmd.startswith('//') and '\n' not in cmd:
+        # '//name' of a named test, a comment for the REPL too
+        return cmd
+    if cmd.startswith('%<<'):
+        expr = cmd[3:].strip().rstrip(';')
+        return 'std::cout << (' + expr + ') << std::endl;'
+    if cmd.startswith('%') or cmd.startswith('#') or cmd.endswith('\\'):
+        return None
+    if re.match(r'^(template|namespace|extern)\b', cmd) or DEFINITION_PATTERN.match(cmd):
+        return None
+    if cmd.count('{') != cmd.count('}') or cmd.count('(') != cmd.count(')'):
+        return None
+    if not cmd.endswith(';') and not cmd.endswith('}'):
+        # the REPL may print the value of an expression without ';'
+        return None
+    return cmd
+
+
+class AotRunner:
+    def __init__(self, cdoctest, work_dir=None, compiler=None, jobs=None, verbose=False):
+        self.cdoctest = cdoctest
+        self.work_dir = tempfile.mkdtemp(prefix='cdoctest-aot-') if work_dir is None else work_dir
+        self.compiler = compiler
+        self.jobs = jobs if jobs is not None else os.cpu_count() or 1
+        self.verbose = verbose
+        # test nodes run natively, and the ones left for the REPL
+        self.compiled = []
+        self.fallback = []
+        # fallback tests which did not compile, and which compiled but did not link
+        self.not_compiled = 0
+        self.not_linked = 0
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def find_compiler(self):
+        if self.compiler is not None:
+            return self.compiler
+        return next((shutil.which(cxx) for cxx in ['clang++', 'c++', 'g++'] if shutil.which(cxx) is not None), None)
+
+    @staticmethod
+    def find_header(header):
+        if header is None:
+            return None
+        for path in [os.getcwd()] + (Shell.env.get('CPLUS_INCLUDE_PATH') or '').split(os.pathsep):
+            if path != '' and os.path.isfile(os.path.join(path, header)):
+                return header
+        return None
+
+    def source(self, index, node, header):
+        statements = [statement(test.cmd) for test in node.test.tests]
+        if any(line is None for line in statements) or any(test.directive is not None for test in node.test.tests):
+            return None
+        lines = ['#include <cstdio>', '#include <iostream>']
+        if header is not None:
+            lines.append('#include "' + header + '"')
+        lines.append('void cdoctest_aot_mark(int test, int command);')
+        lines.append('// ' + node.full_path())
+        lines.append('void cdoctest_aot_' + str(index) + '() {')
+        for command, line in enumerate(statements):
+            lines.append('    cdoctest_aot_mark(' + str(index) + ', ' + str(command) + ');')
+            lines.append('    ' + line)
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def _compile(self, compiler, source, obj):
+        result = subprocess.run([compiler] + compile_args() + ['-c', source, '-o', obj], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, env=Shell.env)
+        return result.returncode == 0, result.stdout
+
+    def build(self, compiler, local_target_lib, cdt_target_lib_dir, jobs):
+        # jobs: [(nodes, header)], returns the executable and its test table of (function number, node)
+        sources = []
+        for nodes, header in jobs:
+            header = self.find_header(header)
+            for node in nodes:
+                if node.test.reused is None:
+                    sources.append((node, header))
+        generated = []
+        for index, (node, header) in enumerate(sources):
+            source = self.source(index, node, header)
+            if source is None:
+                self.fallback.append(node)
+                continue
+            path = os.path.join(self.work_dir, 'test_' + str(index) + '.cpp')
+            with open(path, 'w') as f:
+                f.write(source)
+            generated.append((index, node, path))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(lambda item: self._compile(compiler, item[2], item[2][:-4] + '.o'), generated))
+        table = []
+        objects = []
+        for (index, node, path), (ok, output) in zip(generated, results):
+            if ok:
+                table.append((index, node))
+                objects.append(path[:-4] + '.o')
+            else:
+                if self.verbose:
+                    print('aot: compiling', node.full_path(), 'failed, running it in the REPL\n' + output)
+                self.not_compiled += 1
+                self.fallback.append(node)
+        if len(table) == 0:
+            return None, []
+        main = os.path.join(self.work_dir, 'main.cpp')
+        with open(main, 'w') as f:
+            f.write(MAIN_SOURCE.replace('TEST_DECLARATIONS', '\n'.join('void cdoctest_aot_' + str(index) + '();'
+                                                                       for index, _ in table))
+                    .replace('TEST_TABLE', ', '.join('cdoctest_aot_' + str(index) for index, _ in table)))
+        libs = []
+        for lib in local_target_lib:
+            path = CDocTest.find_lib(lib, cdt_target_lib_dir)
+            if path is not None:
+                libs.append(path)
+        rpaths = ['-Wl,-rpath,' + directory for directory in dict.fromkeys(os.path.dirname(lib) for lib in libs)]
+        executable = os.path.join(self.work_dir, 'cdoctest_aot')
+        result = subprocess.run([compiler] + compile_args() + [main] + objects + libs + rpaths + ['-o', executable],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                                env=Shell.env)
+        if result.returncode != 0:
+            # ex) a symbol defined by two libraries, every compiled test goes back to the REPL
+            lines = result.stdout.rstrip('\n').split('\n')
+            print('aot: linking failed, running', len(table), 'compiled tests in the REPL')
+            print('\n'.join(lines if self.verbose else lines[:CDocTestConfig.CRASH_TAIL_LINES]))
+            self.not_linked = len(table)
+            self.fallback.extend(node for _, node in table)
+            return None, []
+        return executable, table
+
+    def run(self, local_target_lib, cdt_target_lib_dir, jobs):
+        # runs what compiles, the rest is left in self.fallback for the REPL
+        self.compiled = []
+        self.fallback = []
+        self.not_compiled = 0
+        self.not_linked = 0
+        compiler = self.find_compiler()
+        if compiler is None:
+            for nodes, _ in jobs:
+                self.fallback.extend(node for node in nodes if node.test.reused is None)
+            return
+        executable, table = self.build(compiler, local_target_lib, cdt_target_lib_dir, jobs)
+        if executable is None:
+            return
+        self.compiled = [node for _, node in table]
+        start = 0
+        while start < len(table):
+            result = subprocess.run([executable, str(start)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    env=Shell.env)
+            start = self.apply(table, start, result.stdout.decode('utf-8', errors='replace'), result.returncode)
+
+    @staticmethod
+    def apply(table, start, output, returncode):
+        # results of the run starting at table position 'start', returns where to start again after a crash
+        parts = MARK_PATTERN.split(output)
+        # parts: [before, exit, test, command, output, exit, test, command, output, ...]
+        outputs = {}
+        # table position: returncode of a test process which did not end with 0
+        exits = {}
+        last = None
+        for i in range(1, len(parts), 4):
+            if parts[i] is not None:
+                exits[int(parts[i + 1])] = int(parts[i + 2])
+                continue
+            last = (int(parts[i + 1]), int(parts[i + 2]))
+            outputs[last] = parts[i + 3]
+        ended = last == (-1, 0)
+        if last is None:
+            # died before the first test, ex) a library failed to load
+            reason = 'test binary ' + describe_exit(returncode) + ' before the test started'
+            for _, node in table[start:]:
+                node.test.crash(reason, output.split('\n')[-CDocTestConfig.CRASH_TAIL_LINES:])
+            return len(table)
+        for position in range(start, len(table)):
+            index, node = table[position]
+            test_case = node.test
+            # the command running when a test process died
+            died = None
+            if position in exits:
+                died = max([command for marked, command in outputs if marked == index] or [0])
+            for command, test in enumerate(test_case.tests):
+                key = (index, command)
+                test.verify(AotRunner._lines(outputs.get(key, '')))
+                if command == died:
+                    test.crashed = describe_exit(exits[position])
+                    test.crash_output = AotRunner._lines(outputs.get(key, ''))[-CDocTestConfig.CRASH_TAIL_LINES:]
+                    test.is_pass = False
+                    for rest in test_case.tests[command + 1:]:
+                        rest.aborted = 'not run, test process ' + test.crashed
+                        rest.is_pass = False
+                    break
+                if key == last and not ended:
+                    # the process ended while this command ran
+                    test.crashed = describe_exit(returncode)
+                    test.crash_output = AotRunner._lines(outputs[key])[-CDocTestConfig.CRASH_TAIL_LINES:]
+                    test.is_pass = False
+                    for rest in test_case.tests[command + 1:]:
+                        rest.aborted = 'not run, test binary ' + test.crashed
+                        rest.is_pass = False
+                    test_case.is_pass = False
+                    return position + 1
+            test_case.is_pass = all(test.is_pass for test in test_case.tests)
+        return len(table)
+
+    @staticmethod
+    def _lines(output):
+        if output == '':
+            return []
+        if output.endswith('\n'):
+            output = output[:-1]
+        return output.split('\n')
@@ -0,0 +1,95 @@
+import itertools
+import re
+import statistics
+
+# '>>> %bench fac(20)' or '>>> %bench fac(20) < 50ns' in a doc comment. The expression is timed in a loop
+# compiled by the REPL: the iteration count is doubled until one sample takes SAMPLE_NS, then after a
+# warmup run SAMPLES samples are printed on one line as ns per call.
+
+UNITS = {'ns': 1, 'us': 1000, 'ms': 1000 * 1000, 's': 1000 * 1000 * 1000}
+
+BENCH_PATTERN = re.compile(r'^%bench\s+(?P<expr>.+?)\s*;?'
+                           r'(?:\s+(?P<op><=|<)\s*(?P<limit>[0-9]*\.?[0-9]+)\s*(?P<unit>ns|us|ms|s))?\s*$')
+
+OUTPUT_PREFIX = 'cdoctest_bench '
+
+SOURCE = ('int cdoctest_bench_{id} = []() {{ '
+          'auto cdt_run = [](long long n) {{ auto start = std::chrono::steady_clock::now(); '
+          'for (long long i = 0; i < n; ++i) {{ (void)({expr}); std::atomic_signal_fence(std::memory_order_seq_cst); }} '
+          'return std::chrono::duration<double, std::nano>(std::chrono::steady_clock::now() - start).count(); }}; '
+          'long long n = 1; while (n < {max_iterations}LL && cdt_run(n) < {sample_ns}) n *= 2; cdt_run(n); '
+          'std::printf("' + OUTPUT_PREFIX + '%lld", n); '
+          'for (int s = 0; s < {samples}; ++s) std::printf(" %.3f", cdt_run(n) / n); '
+          'std::printf("\\n"); return 0; }}();')
+
+
+class BenchDirective:
+    NAME = 'bench'
+    PRELOAD = False
+    SAMPLES = 10
+    SAMPLE_NS = 10 * 1000 * 1000
+    MAX_ITERATIONS = 1 << 30
+    _ids = itertools.count()
+
+    def __init__(self, expr, op=None, limit_ns=None):
+        self.expr = expr
+        self.op = op
+        self.limit_ns = limit_ns
+        self.iterations = None
+        self.samples = []
+
+    @classmethod
+    def parse(cls, cmd):
+        # BenchDirective of a '%bench' command, None for other commands
+        cmd = cmd.strip()
+        if not cmd.startswith('%bench'):
+            return None
+        matched = BENCH_PATTERN.match(cmd)
+        assert matched is not None, 'expected "%bench <expression> [< <number>ns|us|ms|s]": ' + cmd
+        limit_ns = None
+        if matched.group('limit') is not None:
+            limit_ns = float(matched.group('limit')) * UNITS[matched.group('unit')]
+        return cls(matched.group('expr'), matched.group('op'), limit_ns)
+
+    def commands(self):
+        return ['#include <chrono>', '#include <atomic>',
+                SOURCE.format(id=next(self._ids), expr=self.expr, max_iterations=self.MAX_ITERATIONS,
+                              sample_ns=self.SAMPLE_NS, samples=self.SAMPLES)]
+
+    def feed_line(self, line):
+        # True when the line is the measurement, which is not output of the doctest
+        if not line.startswith(OUTPUT_PREFIX):
+            return False
+        values = line[len(OUTPUT_PREFIX):].split()
+        self.iterations = int(values[0])
+        self.samples = [float(value) for value in values[1:]]
+        return True
+
+    def reset(self):
+        self.iterations = None
+        self.samples = []
+
+    def result(self):
+        # ns per call, None when nothing was measured
+        if len(self.samples) == 0:
+            return None
+        return {'median_ns': statistics.median(self.samples), 'min_ns': min(self.samples),
+                'stddev_ns': statistics.stdev(self.samples) if len(self.samples) > 1 else 0.0,
+                'iterations': self.iterations, 'samples': len(self.samples), 'limit_ns': self.limit_ns}
+
+    def failure(self):
+        # why the measurement fails its threshold, None when it passes
+        result = self.result()
+        if result is None:
+            return 'nothing measured'
+        if self.limit_ns is None:
+            return None
+        median = result['median_ns']
+        if median < self.limit_ns or (self.op == '<=' and median == self.limit_ns):
+            return None
+        return 'median %.1fns is not %s %.1fns' % (median, self.op, self.limit_ns)
+
+    @staticmethod
+    def format(result):
+        return 'median %.1fns min %.1fns stddev %.1fns, %d samples of %d calls' % (
+            result['median_ns'], result['min_ns'], result['stddev_ns'], result['samples'], result['iterations'])
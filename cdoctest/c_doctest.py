@@ -1,15 +1,29 @@
+import asyncio
+import bisect
+import collections
 import enum
 import os
+import shlex
+import signal
+import subprocess
+import tempfile
+import time
 import clang.cindex
 import sys
 import platform
 
 from IPython.testing.tools import full_path
 
-from clang_repl_kernel import ClangReplKernel, PlatformPath, ClangReplConfig, find_prog, WinShell, BashShell, install_bundles, get_dll_or_download
+from clang_repl_kernel import ClangReplKernel, PlatformPath, ClangReplConfig, find_prog, WinShell, BashShell, Shell, install_bundles, get_dll_or_download
 from clang.cindex import CursorKind, TokenKind
 import enum
 
+from .repl_session import AsyncReplSession, ReplSessionError
+from . import proc_stats
+from .bench import BenchDirective
+from .allocs import AllocCounter, AllocsDirective
+from .elf_index import declared_symbols
+
 
 
 class Special(enum.Enum):
@@ -19,8 +33,112 @@ class Special(enum.Enum):
 
 class CDocTestConfig:
     START_PROMPT = ['>>> ', 'clang-repl> ']
+    # text a file must contain to be parsed for tests
+    FILE_MARKER = '>>>'
     CONT_PROMPT = ['... ', 'clang-repl... ']
     PROMPT = START_PROMPT + CONT_PROMPT
+    # output of one command: kept in memory up to MEMORY_OUTPUT_BYTES, the rest is spilled to a temp file,
+    # and the command is aborted past MAX_OUTPUT_BYTES or MAX_OUTPUT_LINES
+    MEMORY_OUTPUT_BYTES = 1024 * 1024
+    MAX_OUTPUT_BYTES = 64 * 1024 * 1024
+    MAX_OUTPUT_LINES = 1000000
+    # output lines kept to report why a REPL died
+    CRASH_TAIL_LINES = 20
+    # a REPL dying this many times in a row before its test starts is not started again
+    MAX_SETUP_CRASHES = 3
+
+
+class OutputLimitExceeded(Exception):
+    pass
+
+
+def describe_exit(returncode):
+    if returncode is None:
+        return 'pipe closed'
+    signal_number = None
+    if returncode < 0:
+        signal_number = -returncode
+    elif returncode > 128 and os.name != 'nt':
+        # reported by the shell running clang-repl
+        signal_number = returncode - 128
+    if signal_number is None:
+        return 'exited with code ' + str(returncode)
+    try:
+        name = signal.Signals(signal_number).name
+    except ValueError:
+        name = 'unknown'
+    return 'killed by signal ' + str(signal_number) + ' (' + name + ')'
+
+
+def wait_exit(process, timeout=5):
+    # exit code of a REPL whose pipe is closed, None if it still runs
+    try:
+        return process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+class OutputMatcher:
+    # compares output lines with the expected lines while they arrive, so nothing but a bounded
+    # head of the output is kept in memory
+    def __init__(self, expected, max_bytes=None, max_lines=None, memory_bytes=None):
+        self.expected = expected
+        self.max_bytes = CDocTestConfig.MAX_OUTPUT_BYTES if max_bytes is None else max_bytes
+        self.max_lines = CDocTestConfig.MAX_OUTPUT_LINES if max_lines is None else max_lines
+        self.memory_bytes = CDocTestConfig.MEMORY_OUTPUT_BYTES if memory_bytes is None else memory_bytes
+        self.output_result = []
+        self.is_fail = False
+        self.lines = []
+        self.line_count = 0
+        self.byte_count = 0
+        self.spill_path = None
+        self._spill = None
+        self.tail = collections.deque(maxlen=CDocTestConfig.CRASH_TAIL_LINES)
+        self.first_output_time = None
+
+    def feed(self, msg):
+        if self.first_output_time is None:
+            self.first_output_time = time.monotonic()
+        for line in msg.split('\n'):
+            self.feed_line(line)
+
+    def feed_line(self, line):
+        self.line_count += 1
+        self.byte_count += len(line) + 1
+        self.tail.append(line)
+        idx = self.line_count - 1
+        if idx < len(self.expected):
+            matched = self.expected[idx] == line
+            self.output_result.append(matched)
+            if not matched:
+                self.is_fail = True
+        else:
+            # more lines than expected can never match
+            self.is_fail = True
+
+        if self._spill is None and self.byte_count > self.memory_bytes:
+            self._spill = tempfile.NamedTemporaryFile('w', prefix='cdoctest-output-', suffix='.txt',
+                                                      delete=False, encoding='utf-8', errors='replace')
+            self.spill_path = self._spill.name
+            for kept in self.lines:
+                self._spill.write(kept + '\n')
+        if self._spill is None:
+            self.lines.append(line)
+        else:
+            self._spill.write(line + '\n')
+
+        if self.byte_count > self.max_bytes or self.line_count > self.max_lines:
+            raise OutputLimitExceeded('output exceeds ' + str(self.max_lines) + ' lines or '
+                                      + str(self.max_bytes) + ' bytes')
+
+    def finish(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        while len(self.output_result) < len(self.expected):
+            self.output_result.append(False)
+            self.is_fail = True
+        return not self.is_fail
 
 
 class TestAbstract:
@@ -28,6 +146,8 @@ class TestAbstract:
         self.text = text
         self.is_pass = None
         self.path = None
+        # why a result is known without running, ex) 'unchanged' or 'does not compile'. None when it runs
+        self.reused = None
 
     def __str__(self):
         return self.text
@@ -39,54 +159,108 @@ class TestAbstract:
         pass
 
 
+# doctest commands run by cdoctest instead of the REPL, ex) '%bench fac(20)'
+DIRECTIVES = [BenchDirective, AllocsDirective]
+
+
 class Test(TestAbstract):
     def __init__(self, text, cmd, outputs):
         super().__init__(text)
         self.cmd = cmd
         self.outputs = outputs
         self.output_result = []
+        # reason when the command was stopped, and the file holding output beyond the in memory head
+        self.aborted = None
+        self.output_file = None
+        # how the REPL died while running the command, and its last output lines
+        self.crashed = None
+        self.crash_output = []
+        # time.monotonic() of its first output, None when it printed nothing
+        self.first_output_time = None
+        # '%bench' or '%allocs' command, its measurement and why it fails its expectation
+        self.directive = next((directive for directive in (cls.parse(cmd) for cls in DIRECTIVES)
+                               if directive is not None), None)
+        self.directive_result = None
+        self.directive_failure = None
+        # compile errors found by SyntaxPrecheck
+        self.diagnostics = []
+
+    def _commands(self):
+        return [self.cmd] if self.directive is None else self.directive.commands()
+
+    def _feed(self, matcher):
+        if self.directive is None:
+            return matcher.feed
+
+        def feed(msg):
+            lines = [line for line in msg.split('\n') if not self.directive.feed_line(line)]
+            if any(line != '' for line in lines):
+                matcher.feed('\n'.join(lines))
+        return feed
 
     def run(self, shell):
-        outputs = []
-
-        def send(msg):
-            nonlocal outputs
-            outputs += msg.split('\n')
-
-        shell.do_execute(self.cmd, send)
-        if len(outputs) == 0 and len(self.outputs) == 0:
-            self.is_pass = True
-        else:
-            is_fail = False
-            eidx = 0
-            aidx = 0
-            left_match_allowed = False
-            while eidx < len(self.outputs):
-                expected = self.outputs[eidx]
-                eidx += 1
-                if aidx < len(outputs):
-                    actual = outputs[aidx]
-                    aidx += 1
-                    if expected != actual:
-                        is_fail = True
-                        self.output_result.append(False)
-                    else:
-                        self.output_result.append(True)
-                else:
-                    is_fail = True
-                    self.output_result.append(False)
-
-            if not left_match_allowed and aidx < len(outputs):
-                is_fail = True
-            if is_fail:
-                self.actual = outputs;
-            self.is_pass = not is_fail
+        matcher = OutputMatcher(self.outputs)
+        returncode = None
+        try:
+            for cmd in self._commands():
+                shell.do_execute(cmd, self._feed(matcher))
+                returncode = shell.process.poll()
+                if returncode is not None:
+                    break
+        except OutputLimitExceeded as e:
+            # runaway output, stop the command by killing its REPL
+            shell.process.kill()
+            self.aborted = str(e)
+        except (BrokenPipeError, ConnectionResetError):
+            returncode = wait_exit(shell.process)
+            self.crashed = describe_exit(returncode)
+        if returncode is not None and self.crashed is None:
+            self.crashed = describe_exit(returncode)
+        if self.crashed is not None:
+            self.crash_output = list(matcher.tail)
+        self._finish(matcher)
+
+    async def run_async(self, session):
+        matcher = OutputMatcher(self.outputs)
+        try:
+            for cmd in self._commands():
+                await session.execute(cmd, self._feed(matcher))
+        except OutputLimitExceeded as e:
+            session.kill()
+            self.aborted = str(e)
+        except ReplSessionError as e:
+            self.crashed = describe_exit(e.returncode)
+            for line in e.output.split('\n'):
+                matcher.tail.append(line)
+            self.crash_output = list(matcher.tail)
+        self._finish(matcher)
+
+    def verify(self, outputs):
+        matcher = OutputMatcher(self.outputs)
+        for output in outputs:
+            if self.directive is None or not self.directive.feed_line(output):
+                matcher.feed_line(output)
+        self._finish(matcher)
+
+    def _finish(self, matcher):
+        if self.directive is not None and self.aborted is None and self.crashed is None:
+            self.directive_result = self.directive.result()
+            self.directive_failure = self.directive.failure()
+        is_pass = matcher.finish() and self.aborted is None and self.crashed is None and self.directive_failure is None
+        self.output_result = matcher.output_result
+        self.output_file = matcher.spill_path
+        self.first_output_time = matcher.first_output_time
+        if not is_pass:
+            self.actual = matcher.lines
+        self.is_pass = is_pass
 
 
 class TestCase(TestAbstract):
     def __init__(self, text, tests=[]):
         super().__init__(text)
         self.tests = tests
+        # resource use of the last run, see proc_stats.test_metrics
+        self.metrics = {}
 
     def remove_prompt(self, org_line):
         striped_line = org_line.strip()
@@ -124,10 +298,71 @@ class TestCase(TestAbstract):
 
     def run(self, shell):
         for test in self.tests:
+            if self._abort_rest(test):
+                continue
             test.run(shell)
 
         self.is_pass = all([test.is_pass for test in self.tests])
 
+    async def run_async(self, session):
+        for test in self.tests:
+            if self._abort_rest(test):
+                continue
+            await test.run_async(session)
+
+        self.is_pass = all([test.is_pass for test in self.tests])
+
+    def _abort_rest(self, test):
+        # the REPL of an aborted or crashed command is gone, the following commands can not run
+        aborted = next((prev.aborted for prev in self.tests if prev.aborted is not None), None)
+        if aborted is not None:
+            test.aborted = 'not run, previous command aborted: ' + aborted
+            test.is_pass = False
+            return True
+        crashed = next((prev.crashed for prev in self.tests if prev.crashed is not None), None)
+        if crashed is not None:
+            test.aborted = 'not run, REPL ' + crashed
+            test.is_pass = False
+            return True
+        return False
+
+    def crash(self, reason, output=None):
+        # the test could not start, its REPL died while it was prepared
+        self.is_pass = False
+        for test in self.tests:
+            test.crashed = reason
+            test.crash_output = [] if output is None else list(output)
+            test.is_pass = False
+
+    def reuse(self, reason, is_pass=True):
+        self.reused = reason
+        self.is_pass = is_pass
+        for test in self.tests:
+            test.reused = reason
+            test.is_pass = is_pass
+
+    def reset(self):
+        # forget the result of a previous run, so the same discovered test can run again
+        self.reused = None
+        self.is_pass = None
+        self.metrics = {}
+        for test in self.tests:
+            test.reused = None
+            test.is_pass = None
+            test.output_result = []
+            test.aborted = None
+            test.output_file = None
+            test.crashed = None
+            test.crash_output = []
+            test.first_output_time = None
+            test.directive_result = None
+            test.directive_failure = None
+            test.diagnostics = []
+            if test.directive is not None:
+                test.directive.reset()
+            if hasattr(test, 'actual'):
+                del test.actual
+
 class Node:
     node_map = {}
 
@@ -181,6 +416,10 @@ class Node:
     def full_path(self):
         return self.path + self.end_text
 
+    def rel_full_path(self):
+        # same as full_path() but relative to the source root, stable across checkouts
+        return self.relPath + self.end_text
+
     def suite(self):
         full_path = self.full_path()
         if "::" in full_path:
@@ -195,7 +434,7 @@ class Node:
             return full_path[last_index+2:]
         return full_path
 
-    def _build_tree(self, src_path, visited):
+    def _build_tree(self, src_path, visited, main_file=None):
         if os.name == 'nt':
             if not self.path.lower().startswith(src_path.lower()):
                 return
@@ -207,17 +446,25 @@ class Node:
         visited.add(str(self))
 
         for child in self.id_token.get_children():
+            # declarations of included headers are skipped before a Node is allocated for them
+            if main_file is not None and not Node.in_file(child, main_file):
+                continue
             if not child.kind in CDocTest.test_parse:
                 continue
             child_node = Node(child, src_path, self)
-            child_node._build_tree(src_path, visited)
+            child_node._build_tree(src_path, visited, main_file)
             self.children.append(child_node)
 
+    @staticmethod
+    def in_file(cursor, file_name):
+        file = cursor.location.file
+        return file is not None and file.name == file_name
+
     @classmethod
-    def build_tree(cls, cursor, src_path):
+    def build_tree(cls, cursor, src_path, main_file_only=True):
         visited = set()
         root = Node(cursor, src_path)
-        root._build_tree(src_path, visited)
+        root._build_tree(src_path, visited, cursor.translation_unit.spelling if main_file_only else None)
         return root
 
 
@@ -274,6 +521,109 @@ def _find_prog(prog):
         return out, True
     return None, False
 
+class RunListener:
+    # hooks called by CDocTest.run_verify around each test node
+    def before_node(self, node):
+        pass
+
+    def after_node(self, node):
+        # the REPL of the node is already stopped here
+        pass
+
+
+class ReplSupervisor:
+    # runs every test node in its own REPL worker and survives workers dying in the tested code: the test
+    # is marked crashed with the exit signal and the last output lines, the next test gets a new worker.
+    # Workers dying before their test starts are given up after MAX_SETUP_CRASHES in a row, so a library
+    # crashing when it loads costs a few REPL starts instead of one per remaining test.
+    def __init__(self, cdoctest, pool=None, env=None):
+        self.cdoctest = cdoctest
+        self.pool = pool
+        # environment of the REPLs instead of Shell.env, not used for pooled REPLs
+        self.env = env
+        self.crashes = 0
+        self.setup_crashes = 0
+        self.setup_crash = None
+
+    def start(self, local_target_lib, cdt_target_lib_dir, header=None, preload=False):
+        # ready REPL, or None when it died while it was prepared. With preload it counts allocations and
+        # is not taken from the pool
+        shell = None
+        error = None
+        try:
+            if preload:
+                shell = None if self.pool is None else self.cdoctest.new_shell(self.env, preload=True, wait=False)
+                if shell is None and self.pool is not None:
+                    # the prepared REPLs may hold the memory this one waits for
+                    self.pool.clear()
+                if shell is None:
+                    shell = self.cdoctest.new_shell(self.env, preload=True)
+                self.cdoctest.load_libs(local_target_lib, cdt_target_lib_dir, shell)
+            elif self.pool is None:
+                shell = self.cdoctest.new_shell() if self.env is None else self.cdoctest.new_shell(self.env)
+                self.cdoctest.load_libs(local_target_lib, cdt_target_lib_dir, shell)
+            else:
+                shell = self.pool.take_shell(local_target_lib, cdt_target_lib_dir)
+            if header is not None:
+                self.cdoctest.include(header, shell=shell)
+        except (BrokenPipeError, ConnectionResetError, AssertionError) as e:
+            error = e
+        returncode = None if shell is None else shell.process.poll()
+        if returncode is None and error is None:
+            self.setup_crashes = 0
+            return shell
+        if returncode is None and shell is not None:
+            if isinstance(error, AssertionError):
+                # the REPL still runs, not a crash
+                self.cdoctest.stop_shell(shell)
+                raise error
+            returncode = wait_exit(shell.process)
+        self.crashes += 1
+        self.setup_crashes += 1
+        self.setup_crash = 'REPL ' + describe_exit(returncode) + ' before the test started'
+        return None
+
+    @staticmethod
+    def preload(node):
+        # True when the REPL of the node needs AllocCounter. Without the library the directive reports why
+        # nothing was counted
+        if not any(test.directive is not None and test.directive.PRELOAD for test in node.test.tests):
+            return False
+        return AllocCounter.library() is not None
+
+    def run(self, node, local_target_lib, cdt_target_lib_dir, header=None):
+        missing = self.cdoctest.missing_exports(node)
+        if len(missing) > 0:
+            node.test.crash('not run, no library exports ' + ', '.join(missing))
+            return
+        if self.setup_crashes >= CDocTestConfig.MAX_SETUP_CRASHES:
+            node.test.crash('not run, ' + str(self.setup_crashes) + ' REPLs in a row died before their test started: '
+                            + self.setup_crash)
+            return
+        preload = self.preload(node)
+        start = time.monotonic()
+        shell = self.start(local_target_lib, cdt_target_lib_dir, header, preload)
+        startup = time.monotonic() - start
+        if shell is None:
+            node.test.crash(self.setup_crash)
+            return
+        pid = proc_stats.repl_pid(shell.process.pid)
+        before = proc_stats.sample(pid)
+        after = None
+        start = time.monotonic()
+        try:
+            node.test.run(shell)
+            wall = time.monotonic() - start
+            after = proc_stats.sample(pid)
+        finally:
+            self.cdoctest.stop_shell(shell)
+        first_outputs = [test.first_output_time for test in node.test.tests if test.first_output_time is not None]
+        first_output = min(first_outputs) - start if len(first_outputs) > 0 else None
+        node.test.metrics = proc_stats.test_metrics(startup, wall, first_output, before, after)
+        if any(test.crashed is not None for test in node.test.tests):
+            self.crashes += 1
+
+
 class CDocTest:
     # # A C or C++ struct.
     # CursorKind.STRUCT_DECL = CursorKind(2)
@@ -326,6 +676,10 @@ class CDocTest:
     test_grouping_to_text = {CursorKind.STRUCT_DECL: 'struct', CursorKind.UNION_DECL: 'union',
                                     CursorKind.CLASS_DECL: 'class', CursorKind.NAMESPACE: 'namespace'}
 
+    # CXTranslationUnit_SingleFileParse, not exported by the python bindings. #include is not followed,
+    # unknown types and macros are recovered from, declarations keep their namespace/class nesting.
+    PARSE_SINGLE_FILE = 0x400
+
     def __init__(self):
         ClangReplConfig.set_platform(ClangReplConfig.get_default_platform())
         #prog = ClangReplConfig.get_bin_path()
@@ -352,6 +706,22 @@ class CDocTest:
         self.get_idx()
         self.tu = None
         self.verbose = False
+        self.listeners = []
+        self.stop_timeout = 10
+        # clang-repl executable to use instead of the installed one
+        self.repl_binary = None
+        # REPLs which died in the last run_verify
+        self.crashes = 0
+        # discovery parses the main file only, without following #include
+        self.single_file_parse = False
+        # PreambleCache of the REPLs, None to compile the preamble in every REPL
+        self.preamble_cache = None
+        # SymbolIndex of the libraries, a test then fails early when none exports what its declaration needs
+        self.symbol_index = None
+        # MemoryAdmission every started REPL needs a slot of, None to start REPLs without one
+        self.admission = None
+        # clang header maps of the include directories, see HeaderMap
+        self.header_maps = []
 
         if os.name == 'nt':
             self.default_lib = []
@@ -361,16 +731,81 @@ class CDocTest:
 
 
 
-    def run(self):
+    def missing_exports(self, node):
+        # symbols the declaration of the node needs which no target library exports
+        if self.symbol_index is None or getattr(node, 'id_token', None) is None:
+            return []
+        return self.symbol_index.missing(declared_symbols(node.id_token))
+
+    def repl_shell(self, env=None, preload=False):
+        # REPL to start, with the binary, environment and arguments of every REPL run by cdoctest, also the
+        # async ones. env replaces Shell.env for it, preload adds AllocCounter. shell.args are not quoted
         if os.name == 'nt':
-            self.my_shell = WinShell(self.clang_rep)
+            shell = WinShell(self.clang_rep)
         else:
-            self.my_shell = BashShell(self.clang_rep)
-        self.my_shell.run()
+            shell = BashShell(self.clang_rep)
+        if self.repl_binary is not None:
+            shell.binary = self.repl_binary
+        if env is not None:
+            shell.env = env
+        if preload:
+            shell.env = AllocCounter.preload(shell.env)
+        if self.preamble_cache is not None:
+            program, _ = shell.prog()
+            shell.args = shell.args + self.preamble_cache.args(program, shell.env)
+        return shell
+
+    def new_shell(self, env=None, preload=False, wait=True):
+        # started REPL which is not the current shell of this CDocTest. With an admission it holds a slot until
+        # stop_shell, without wait None is returned when there is no slot now
+        admission = self.admission
+        if admission is not None and not admission.acquire(wait):
+            return None
+        try:
+            shell = self.repl_shell(env, preload)
+            # Shell joins its arguments into a shell command line
+            shell.args = [subprocess.list2cmdline([arg]) if os.name == 'nt' else shlex.quote(arg) for arg in shell.args]
+            shell.run()
+        except BaseException:
+            if admission is not None:
+                admission.release()
+            raise
+        shell.admission = admission
+        return shell
+
+    def run(self):
+        self.my_shell = self.new_shell()
 
     def get_shell(self):
         return self.my_shell
 
+    def stop(self):
+        shell = self.my_shell
+        self.my_shell = None
+        self.stop_shell(shell)
+
+    def stop_shell(self, shell):
+        # close stdin so clang-repl exits normally (atexit handlers such as profile writers run)
+        if shell is None or shell.process is None:
+            return
+        admission = getattr(shell, 'admission', None)
+        sample = None
+        if admission is not None:
+            shell.admission = None
+            sample = proc_stats.sample(proc_stats.repl_pid(shell.process.pid))
+        try:
+            shell.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            shell.process.wait(timeout=self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            shell.process.kill()
+            shell.process.wait()
+        finally:
+            if admission is not None:
+                admission.release(None if sample is None else sample.get('peak_rss'))
+
     def check_lib_exist(self, lib_file):
         possible_paths = [
             os.path.abspath(lib_file),
@@ -388,16 +823,19 @@ class CDocTest:
             print("Could not find library file:", lib_file)
             sys.exit()
 
-    def local_load(self, lib_file, paths):
+    @staticmethod
+    def find_lib(lib_file, paths):
         possible_paths = []
         for path in paths:
             possible_paths.append(os.path.join(path, lib_file))
 
-        abs_path = None
         for path in possible_paths:
             if os.path.exists(path) and os.path.isfile(path):
-                abs_path = path
-                break
+                return path
+        return None
+
+    def local_load(self, lib_file, paths, shell=None):
+        abs_path = self.find_lib(lib_file, paths)
 
         if abs_path is None:
             print("Could not find library file:", lib_file)
@@ -409,10 +847,10 @@ class CDocTest:
             nonlocal response
             response = x
 
-        self.get_shell().do_execute('%lib ' + lib_file, resp_handler)
+        (self.get_shell() if shell is None else shell).do_execute('%lib ' + lib_file, resp_handler)
         assert response is None
 
-    def load(self, lib_file):
+    def load(self, lib_file, shell=None):
         #self.check_lib_exist(lib_file)
 
         response = None
@@ -421,22 +859,32 @@ class CDocTest:
             nonlocal response
             response = x
 
-        self.get_shell().do_execute('%lib ' + lib_file, resp_handler)
+        (self.get_shell() if shell is None else shell).do_execute('%lib ' + lib_file, resp_handler)
         if response is None:
             print("Warning! Could not load lib file:", lib_file)
 
-    def include(self, header_file, is_system=False):
+    def include(self, header_file, is_system=False, shell=None):
         response = None
         def resp_handler(x):
             nonlocal response
             response = x
+        shell = self.get_shell() if shell is None else shell
         if is_system:
-            self.get_shell().do_execute('#include <' + header_file + '>', resp_handler)
+            shell.do_execute('#include <' + header_file + '>', resp_handler)
         else:
-            self.get_shell().do_execute('#include "' + header_file + '"', resp_handler)
+            shell.do_execute('#include "' + header_file + '"', resp_handler)
         if response is None:
             print("Warning! Could not include file:", header_file)
 
+    def load_libs(self, local_target_lib, cdt_target_lib_dir, shell=None):
+        # library and standard header part of the REPL setup, shared by every test of the same library set
+        for target_lib in self.default_lib:
+            self.load(target_lib, shell)
+        for target_lib in local_target_lib:
+            self.local_load(target_lib, cdt_target_lib_dir, shell)
+        self.include('cstdio', True, shell)
+        self.include('iostream', True, shell)
+
 
     def get_idx(self):
         if self._idx is None:
@@ -461,10 +909,21 @@ class CDocTest:
             s = f.read()
             self._get_func_class_comment_with_text(self.get_idx(), s, result_comments)
 
+    def parse_args(self):
+        return ['-std=c++20', '-I' + os.getcwd()] + ['-I' + header_map for header_map in self.header_maps]
+
     def parse(self, text, file_name, src_path):
-        self.tu = clang.cindex.TranslationUnit.from_source("dummy.cpp", args=['-std=c++20', '-I' + os.getcwd()],
-                                                      unsaved_files=[("dummy.cpp", text)],
-                                                      options=clang.cindex.TranslationUnit.PARSE_NONE|clang.cindex.TranslationUnit.PARSE_INCOMPLETE |clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
+        options = clang.cindex.TranslationUnit.PARSE_NONE|clang.cindex.TranslationUnit.PARSE_INCOMPLETE |clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+        if self.single_file_parse:
+            self.tu = clang.cindex.TranslationUnit.from_source("dummy.cpp", args=self.parse_args(),
+                                                          unsaved_files=[("dummy.cpp", text)],
+                                                          options=options | CDocTest.PARSE_SINGLE_FILE)
+            if self._has_undeclared_scope():
+                self.tu = None
+        if not self.single_file_parse or self.tu is None:
+            self.tu = clang.cindex.TranslationUnit.from_source("dummy.cpp", args=self.parse_args(),
+                                                          unsaved_files=[("dummy.cpp", text)],
+                                                          options=options)
         assert self.tu is not None
         class ByPass:
             def __init__(self, cursor, file_name, src_path):
@@ -501,6 +960,40 @@ class CDocTest:
         #                               options=clang.cindex.TranslationUnit.PARSE_NONE)
 
 
+    def _has_undeclared_scope(self):
+        # 'Fac::fac(' with an undeclared Fac is an out-of-line definition whose class is declared in an
+        # included header. Without it the definition is not a method, so the file is parsed again with includes.
+        offsets = [diag.location.offset for diag in self.tu.diagnostics
+                   if diag.severity >= clang.cindex.Diagnostic.Error
+                   and diag.spelling.startswith('use of undeclared identifier')]
+        if len(offsets) == 0:
+            return False
+        tokens = [t.spelling for t in self.tu.get_tokens(extent=self.tu.cursor.extent)]
+        starts = [t.location.offset for t in self.tu.get_tokens(extent=self.tu.cursor.extent)]
+        for offset in offsets:
+            idx = bisect.bisect_left(starts, offset)
+            while idx + 2 < len(tokens):
+                if tokens[idx + 1] == '<':
+                    # template arguments of a scope, 'Fac<T>::fac('
+                    depth = 0
+                    idx += 1
+                    while idx < len(tokens):
+                        depth += 1 if tokens[idx] == '<' else -1 if tokens[idx] == '>' else 0
+                        if depth == 0:
+                            break
+                        idx += 1
+                    idx -= 1
+                    if idx + 2 >= len(tokens):
+                        break
+                if tokens[idx + 1] != '::':
+                    break
+                idx += 2
+            if idx < len(tokens) and tokens[idx] in ['~', 'operator']:
+                return True
+            if idx + 1 < len(tokens) and tokens[idx + 1] == '(':
+                return True
+        return False
+
     def unique_name(self, node):
         return node.spelling + '_' + str(node.extent.start.line) + '_' + str(node.extent.start.column) + '_' + str(
             node.extent.end.line) + '_' + str(node.extent.end.column)
@@ -598,8 +1091,7 @@ class CDocTest:
         return result
 
     def parse_result_test_node(self, file_content, tests_nodes, file_name, src_path):
-        # check file_content contains ">>>"
-        if file_content.find('>>>') == -1:
+        if file_content.find(CDocTestConfig.FILE_MARKER) == -1:
             return
         result_comments = []
         self.parse(file_content, file_name, src_path)
@@ -642,7 +1134,7 @@ class CDocTest:
         merged_node = self.merge_comments(c_tests_nodes, h_tests_nodes)
         return merged_node
 
-    def run_verify(self, local_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, name=None, header_extension='.h'):
+    def run_verify(self, local_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, name=None, header_extension='.h', pool=None):
         # if target_lib is string make it list
         if isinstance(local_target_lib, str):
             local_target_lib = [local_target_lib]
@@ -658,17 +1150,81 @@ class CDocTest:
         merged_node.clear()
         merged_node.extend(filtered_node)
 
+        # with a pool, REPLs with the libraries already loaded are prepared while the previous test runs
+        supervisor = ReplSupervisor(self, pool)
+        header = None if name is None else name + '.' + header_extension
         for node in merged_node:
-            self.run()
-            for target_lib in self.default_lib:
-                self.load(target_lib)
-            for target_lib in local_target_lib:
-                self.local_load(target_lib, cdt_target_lib_dir)
-            self.include('cstdio', True)
-            self.include('iostream', True)
-            if name is not None:
-                self.include(name + '.' + header_extension)
-            node.test.run(self.get_shell())
-
-
-
+            if node.test.reused is not None:
+                continue
+            for listener in self.listeners:
+                listener.before_node(node)
+            supervisor.run(node, local_target_lib, cdt_target_lib_dir, header)
+            for listener in self.listeners:
+                listener.after_node(node)
+        self.crashes = supervisor.crashes
+
+    async def start_session(self, local_target_lib, cdt_target_lib_dir, name=None, header_extension='.h', session=None,
+                            preload=False):
+        # async counterpart of the REPL setup in run_verify, the REPL is started as by new_shell
+        if isinstance(local_target_lib, str):
+            local_target_lib = [local_target_lib]
+        if session is None:
+            shell = self.repl_shell(preload=preload)
+            program, _ = shell.prog()
+            session = AsyncReplSession(program, shell.args, shell.env)
+        await session.start()
+        for target_lib in self.default_lib:
+            if len(await session.execute('%lib ' + target_lib)) == 0:
+                print("Warning! Could not load lib file:", target_lib)
+        for target_lib in local_target_lib:
+            if self.find_lib(target_lib, cdt_target_lib_dir) is None:
+                await session.close()
+                raise FileNotFoundError("Could not find library file: " + target_lib)
+            await session.execute('%lib ' + target_lib)
+        await session.execute('#include <cstdio>')
+        await session.execute('#include <iostream>')
+        if name is not None:
+            await session.execute('#include "' + name + '.' + header_extension + '"')
+        return session
+
+    async def run_verify_async(self, local_target_lib, cdt_target_lib_dir, cdt_run_testcase, merged_node, name=None,
+                               header_extension='.h', concurrency=None, session_factory=None, admission=None):
+        # like run_verify but every node gets its own AsyncReplSession and up to 'concurrency' of them run at once,
+        # fewer when a MemoryAdmission finds too little memory
+        if isinstance(local_target_lib, str):
+            local_target_lib = [local_target_lib]
+        admission = self.admission if admission is None else admission
+        if cdt_run_testcase is not None and len(cdt_run_testcase) > 0:
+            merged_node[:] = [node for node in merged_node if node.full_path() in cdt_run_testcase]
+        semaphore = asyncio.Semaphore(concurrency if concurrency is not None else os.cpu_count() or 1)
+        loop = asyncio.get_running_loop()
+
+        async def run_node(node):
+            async with semaphore:
+                if admission is not None:
+                    await loop.run_in_executor(None, admission.acquire)
+                peak_rss = None
+                try:
+                    missing = self.missing_exports(node)
+                    if len(missing) > 0:
+                        node.test.crash('not run, no library exports ' + ', '.join(missing))
+                        return
+                    session = None if session_factory is None else session_factory()
+                    try:
+                        session = await self.start_session(local_target_lib, cdt_target_lib_dir, name, header_extension, session,
+                                                           ReplSupervisor.preload(node))
+                    except ReplSessionError as e:
+                        node.test.crash('REPL ' + describe_exit(e.returncode) + ' before the test started',
+                                        e.output.split('\n')[-CDocTestConfig.CRASH_TAIL_LINES:])
+                        return
+                    try:
+                        await node.test.run_async(session)
+                        sample = None if session.pid is None else proc_stats.sample(session.pid)
+                        peak_rss = None if sample is None else sample['peak_rss']
+                    finally:
+                        await session.close()
+                finally:
+                    if admission is not None:
+                        admission.release(peak_rss)
+
+        await asyncio.gather(*[run_node(node) for node in merged_node if node.test.reused is None])
@@ -6,6 +6,54 @@ from ordered_set import OrderedSet
 from cmake_file_api import CMakeProject, ObjectKind
 from cmake_file_api.reply.v1.api import CMakeFileApiV1
 
+from .header_index import HeaderIndex
+
+
+class TargetGraph:
+    # index of the codemodel built once: shared library closure of every target in load order
+    # (dependencies before their dependents) and owning targets of every source file.
+    def __init__(self, targets, source_path):
+        self._by_id = {target.target.id: target for target in targets}
+        self._by_name = {target.name: target for target in targets}
+        self._shared_libs = {}
+        self._source_owners = {}
+        self._warned = set()
+        for target in targets:
+            for source in target.target.sources:
+                path = Path(source.path)
+                path = str(path) if path.is_absolute() else os.path.join(source_path, path)
+                self._source_owners.setdefault(os.path.normpath(path), []).append(target)
+
+    def get_target(self, name):
+        return self._by_name.get(name)
+
+    def get_targets_of_source(self, path):
+        return self._source_owners.get(os.path.normpath(path), [])
+
+    def get_shared_libs(self, target):
+        # memoized, so a diamond shaped graph is walked once
+        result = self._shared_libs.get(target.target.id)
+        if result is not None:
+            return result
+        self._shared_libs[target.target.id] = []  # a cycle ends here
+        result = {}
+        for dependency in target.target.dependencies:
+            lib = self._by_id.get(dependency.id)
+            if lib is None:
+                continue
+            if lib.target.type.value != "SHARED_LIBRARY":
+                if lib.target.id not in self._warned:
+                    self._warned.add(lib.target.id)
+                    print(f"Warning: '{lib.target.name}' is not a shared library.")
+                continue
+            for shared_lib in self.get_shared_libs(lib):
+                result.setdefault(shared_lib.target.id, shared_lib)
+        if target.target.type.value == "SHARED_LIBRARY":
+            result.setdefault(target.target.id, target)
+        result = list(result.values())
+        self._shared_libs[target.target.id] = result
+        return result
+
 
 class CMakeApi:
     def __init__(self, build_path, target_name, include_target, exclude_target, verbose=False):
@@ -14,12 +62,14 @@ class CMakeApi:
         self.project.configure(quiet=True)
         self._build_path = build_path
         self.source_path = self._get_source_path(self.project)
-        self._include_target = include_target
-        self._exclude_target = exclude_target
+        self._include_target = [re.compile(pattern) for pattern in include_target]
+        self._exclude_target = [re.compile(pattern) for pattern in exclude_target]
+        self._is_testing = {}
         self._all_target_lib_dict = {}
         self._all_target_sources = set()
         self._all_target_includes = set()
-        self._all_libs_artifact_set = set()
+        self._all_libs_artifact_set = OrderedSet()
+        self._header_index = None
         self.verbose = verbose
 
         results = self.project .cmake_file_api.inspect_all()
@@ -35,14 +85,16 @@ class CMakeApi:
         self._source_path = self.project.source_path
 
         self._targets = self.config.targets
+        self.graph = TargetGraph(self._targets, self._source_path)
         if verbose:
             print("targets:", self._targets)
         self._target = None
         self._target_name = target_name
-        self.set_target_name(target_name)
-
         assert os.path.exists(build_path), f"Build path '{build_path}' does not exist."
-        assert self._target is not None , f"Target '{target_name}' not found in the CMake configuration."
+        # None when targets are selected later with match_targets() and set_target_name()
+        if target_name is not None:
+            self.set_target_name(target_name)
+            assert self._target is not None , f"Target '{target_name}' not found in the CMake configuration."
 
     def get_target(self):
         return self._target
@@ -70,20 +122,39 @@ class CMakeApi:
         return list(self._all_libs_artifact_set)
 
     def _get_target_by_name(self, target_name):
-        return next((target for target in  self._targets if target.name == target_name), None)
-
+        return self.graph.get_target(target_name)
+
+
+    def match_targets(self, specs):
+        # each spec is a target name, 'all' for every library and executable target, or else a regex
+        # matched against the whole target name. Targets are returned in codemodel order.
+        selected = set()
+        for spec in specs:
+            if spec == 'all':
+                selected.update(target.name for target in self._targets
+                                if target.target.type.value in ["SHARED_LIBRARY", "MODULE_LIBRARY", "EXECUTABLE"])
+            elif self.graph.get_target(spec) is not None:
+                selected.add(spec)
+            else:
+                pattern = re.compile(spec)
+                matched = [target.name for target in self._targets if pattern.fullmatch(target.name)]
+                if len(matched) == 0:
+                    print(f"Warning: no target matches '{spec}'.")
+                selected.update(matched)
+        return [target.name for target in self._targets if target.name in selected]
 
     def set_target_name(self, target_name):
         self._all_target_includes = []
         self._all_target_sources = []
         self._all_target_lib_dict = {}
+        self._all_libs_artifact_set = OrderedSet()
         self._target = self._get_target_by_name(target_name)
+        assert self._target is not None, f"Target '{target_name}' not found in the CMake configuration."
         self._get_shared_libs(self._all_target_lib_dict, self._target)
         for lib in self._all_target_lib_dict.values():
             self._get_include_paths(self._all_target_includes, lib)
             self._get_target_sources(self._all_target_sources, lib)
             self._get_artifact_path(self._all_libs_artifact_set, lib)
-        assert self._target is not None, f"Target '{target_name}' not found in the CMake configuration."
         if self.verbose:
             print("shared libraries of target:", self._all_target_lib_dict.keys())
             print("include directories of target:", self._all_target_includes)
@@ -111,19 +182,26 @@ class CMakeApi:
         return self._all_target_sources
 
     def is_target_testing(self, target):
+        result = self._is_testing.get(target.target.id)
+        if result is None:
+            result = self._is_target_testing(target)
+            self._is_testing[target.target.id] = result
+        return result
+
+    def _is_target_testing(self, target):
         if target.target.type.value == "STATIC_LIBRARY":
             return False
 
         if len(self._include_target) > 0:
             for include_target in self._include_target:
-                if re.match(include_target, target.target.name)\
-                        or re.match(include_target, target.target.nameOnDisk):
+                if include_target.match(target.target.name)\
+                        or (target.target.nameOnDisk is not None and include_target.match(target.target.nameOnDisk)):
                     return True
             return False
 
         if len(self._exclude_target) > 0:
             for exclude_target in self._exclude_target:
-                if re.match(exclude_target, target.name):
+                if exclude_target.match(target.target.name):
                     return False
             return True
 
@@ -140,42 +218,37 @@ class CMakeApi:
     def get_all_include_path(self):
         return self._all_target_includes
 
+    def get_header_index(self):
+        # cached until the include directories change with another target
+        include_dirs = list(self._all_target_includes)
+        if self._header_index is None or self._header_index.include_dirs != [os.path.abspath(path) for path in include_dirs]:
+            self._header_index = HeaderIndex(include_dirs)
+        return self._header_index
+
     def _get_shared_libs(self, shared_lib_dic, target):
-        # if target is shared library
-        if target.target.type.value == "SHARED_LIBRARY":
-            shared_lib_dic[target.id] = target
-        for lib in target.target.dependencies:
-            if lib.target.type.value != "SHARED_LIBRARY":
-                print(f"Warning: '{lib.target.name}' is not a shared library.")
-                continue
-            self._get_shared_libs(shared_lib_dic, lib)
+        # in load order, dependencies first
+        for lib in self.graph.get_shared_libs(target):
+            shared_lib_dic[lib.target.id] = lib
 
+    def get_targets_of_source(self, path):
+        return self.graph.get_targets_of_source(path)
 
     def get_all_shared_lib(self):
         return self._all_target_lib_dict.values()
 
     def get_all_candidate_sources_headers(self, target_files, c_ext, cpp_ext, h_ext):
         headers = []
-        h_postfix = "." + h_ext
         cpp_postfix = "." + cpp_ext
         c_postfix = "." + c_ext
+        header_index = self.get_header_index()
         for source in self._all_target_sources | set(target_files):
-            src_ext = os.path.splitext(source)
-            src = src_ext[0]
-            ext = src_ext[1]
+            ext = os.path.splitext(source)[1]
             if ext in [c_postfix, cpp_postfix]:
-                header = src + h_postfix
-                if os.path.exists(header):
+                header = header_index.header_of(source, h_ext)
+                if header is not None:
                     headers.append(header)
                 else:
-                    file_name = os.path.basename(header)
-                    for include_dir in self._all_target_includes:
-                        header = os.path.join(include_dir, file_name)
-                        if os.path.exists(header):
-                            headers.append(header)
-                            break
-                    if not os.path.exists(header):
-                        print(f"Warning: Header file '{header}' not found.")
+                    print(f"Warning: Header file '{os.path.splitext(source)[0]}.{h_ext}' not found.")
         return OrderedSet(set(headers) | self._all_target_sources | set(target_files))
 
 
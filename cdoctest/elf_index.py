@@ -0,0 +1,140 @@
+import json
+import mmap
+import os
+import struct
+
+from clang.cindex import CursorKind, SourceLocation, SourceRange, TokenKind
+
+from .fingerprint import file_digest
+from .result_cache import default_cache_dir
+
+# exported dynamic symbols of the tested shared libraries, read from the ELF files without external tools
+# and cached by file digest. A test fails without a REPL when no library exports a symbol its declaration needs.
+
+SHT_DYNSYM = 11
+SHN_UNDEF = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+
+SYMBOL_KINDS = [CursorKind.FUNCTION_DECL, CursorKind.CXX_METHOD, CursorKind.CONSTRUCTOR, CursorKind.DESTRUCTOR,
+                CursorKind.CONVERSION_FUNCTION, CursorKind.VAR_DECL]
+CLASS_KINDS = [CursorKind.CLASS_DECL, CursorKind.STRUCT_DECL, CursorKind.UNION_DECL]
+
+
+def read_dynamic(path):
+    # {'symbols': [...]} of an ELF shared library
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:4] != b'\x7fELF':
+            raise ValueError(path + ' is not an ELF file')
+        is64 = data[4] == 2
+        endian = '<' if data[5] == 1 else '>'
+        if is64:
+            shoff, = struct.unpack_from(endian + 'Q', data, 0x28)
+            shentsize, shnum, _ = struct.unpack_from(endian + 'HHH', data, 0x3A)
+            section_format = endian + 'IIQQQQIIQQ'
+        else:
+            shoff, = struct.unpack_from(endian + 'I', data, 0x20)
+            shentsize, shnum, _ = struct.unpack_from(endian + 'HHH', data, 0x2E)
+            section_format = endian + 'IIIIIIIIII'
+        sections = []
+        for i in range(shnum):
+            _, kind, _, _, offset, size, link, _, _, entsize = struct.unpack_from(section_format, data, shoff + i * shentsize)
+            sections.append((kind, offset, size, link, entsize))
+
+        def string(table, index):
+            start = sections[table][1] + index
+            return data[start:data.find(b'\0', start)].decode('utf-8', errors='replace')
+
+        symbols = set()
+        for kind, offset, size, link, entsize in sections:
+            if kind == SHT_DYNSYM and entsize > 0:
+                # the first symbol is the null symbol
+                for entry in range(offset + entsize, offset + size, entsize):
+                    if is64:
+                        name, info, _, shndx = struct.unpack_from(endian + 'IBBH', data, entry)
+                    else:
+                        name, _, _, info, _, shndx = struct.unpack_from(endian + 'IIIBBH', data, entry)
+                    if name != 0 and shndx != SHN_UNDEF and info >> 4 in [STB_GLOBAL, STB_WEAK]:
+                        symbols.add(string(link, name))
+    return {'symbols': sorted(symbols)}
+
+
+def _has_body(cursor):
+    # function bodies are skipped while parsing and not part of the extent, the token after it tells
+    end = cursor.extent.end
+    if end.file is None:
+        return False
+    tu = cursor.translation_unit
+    last = tu.cursor.extent.end
+    offset = end.offset + 4096
+    if last.file is not None and last.file.name == end.file.name:
+        offset = min(offset, last.offset)
+    stop = SourceLocation.from_offset(tu, end.file, offset)
+    for token in tu.get_tokens(extent=SourceRange.from_locations(end, stop)):
+        if token.kind != TokenKind.COMMENT:
+            return token.spelling in ['{', ':', 'try']
+    return False
+
+
+def _needs_symbol(cursor):
+    # a definition in the tested header is compiled into the test, anything else must come from a library
+    if cursor.kind == CursorKind.VAR_DECL and cursor.semantic_parent is not None \
+            and cursor.semantic_parent.kind == CursorKind.FUNCTION_DECL:
+        return False
+    if cursor.kind == CursorKind.CXX_METHOD and cursor.is_pure_virtual_method():
+        return False
+    if cursor.kind in [CursorKind.CXX_METHOD, CursorKind.CONSTRUCTOR, CursorKind.DESTRUCTOR] \
+            and cursor.is_default_method():
+        return False
+    if cursor.is_definition():
+        return False
+    if cursor.kind == CursorKind.VAR_DECL:
+        return not any(token.spelling in ['constexpr', 'inline'] for token in cursor.get_tokens())
+    return not _has_body(cursor)
+
+
+def declared_symbols(cursor):
+    # mangled names a test of the declaration needs from the libraries
+    if cursor.kind in SYMBOL_KINDS:
+        cursors = [cursor]
+    elif cursor.kind in CLASS_KINDS:
+        cursors = [child for child in cursor.get_children() if child.kind in SYMBOL_KINDS]
+    else:
+        return []
+    symbols = []
+    for declaration in cursors:
+        name = declaration.mangled_name
+        if name and _needs_symbol(declaration):
+            symbols.append(name)
+    return symbols
+
+
+class SymbolIndex:
+    VERSION = 2
+
+    def __init__(self, libs, cache_dir=None):
+        self.cache_dir = os.path.join(os.path.dirname(default_cache_dir()), 'elf') if cache_dir is None else cache_dir
+        self.libs = [lib for lib in libs if lib is not None]
+        self.exports = {}
+        for lib in self.libs:
+            for symbol in self.read(lib)['symbols']:
+                # the first library in load order wins, as for the dynamic linker
+                self.exports.setdefault(symbol, lib)
+
+    def read(self, lib):
+        path = os.path.join(self.cache_dir, 'v' + str(self.VERSION) + '-' + file_digest(lib) + '.json')
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        dynamic = read_dynamic(lib)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(path + '.' + str(os.getpid()), 'w') as f:
+            json.dump(dynamic, f)
+        os.replace(path + '.' + str(os.getpid()), path)
+        return dynamic
+
+    def missing(self, symbols):
+        # the symbols no library exports
+        return [symbol for symbol in symbols if symbol not in self.exports]
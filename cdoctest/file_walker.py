@@ -0,0 +1,235 @@
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .c_doctest import CDocTestConfig
+
+
+class IgnoreRules:
+    # subset of .gitignore syntax: '#' comment, '!' negation, trailing '/' for directory only,
+    # leading or middle '/' anchors to the base directory, '*', '?', '[...]' and '**'
+    def __init__(self, patterns=None, base=''):
+        self.base = base
+        self._rules = []
+        for pattern in patterns or []:
+            self.add(pattern)
+
+    @classmethod
+    def from_file(cls, path, base):
+        try:
+            with open(path, 'r', errors='replace') as f:
+                return cls(f.read().splitlines(), base)
+        except OSError:
+            return None
+
+    @staticmethod
+    def _translate(pattern):
+        regex = ''
+        idx = 0
+        while idx < len(pattern):
+            c = pattern[idx]
+            if c == '*':
+                if pattern[idx:idx + 3] == '**/':
+                    regex += '(?:.*/)?'
+                    idx += 3
+                    continue
+                if pattern[idx:idx + 2] == '**':
+                    regex += '.*'
+                    idx += 2
+                    continue
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[':
+                end = pattern.find(']', idx + 1)
+                if end == -1:
+                    regex += re.escape(c)
+                else:
+                    body = pattern[idx + 1:end]
+                    if body.startswith('!'):
+                        body = '^' + body[1:]
+                    regex += '[' + body.replace('\\', '\\\\') + ']'
+                    idx = end
+            elif c == '\\' and idx + 1 < len(pattern):
+                idx += 1
+                regex += re.escape(pattern[idx])
+            else:
+                regex += re.escape(c)
+            idx += 1
+        return regex
+
+    def add(self, pattern):
+        pattern = pattern.rstrip('\n\r')
+        if pattern.strip() == '' or pattern.startswith('#'):
+            return
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        pattern = pattern.rstrip(' ')
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if pattern == '':
+            return
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        regex = self._translate(pattern)
+        if anchored:
+            regex = '^' + regex + '$'
+        else:
+            regex = '(?:^|/)' + regex + '$'
+        self._rules.append((re.compile(regex), negate, dir_only))
+
+    def match(self, rel_path, is_dir):
+        # None when no rule decides, otherwise True(ignored)/False(re-included)
+        if self.base != '':
+            if rel_path != self.base and not rel_path.startswith(self.base + '/'):
+                return None
+            rel_path = rel_path[len(self.base) + 1:]
+        result = None
+        for regex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.search(rel_path):
+                result = not negate
+        return result
+
+    def __len__(self):
+        return len(self._rules)
+
+
+class FileWalker:
+    IGNORE_FILE = '.gitignore'
+    SKIP_DIRS = {'.git', '.hg', '.svn'}
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, root_dirs, extensions, exclude_patterns=None, use_ignore_file=True, max_workers=None):
+        if isinstance(root_dirs, str):
+            root_dirs = [root_dirs]
+        self.root_dirs = [os.path.realpath(root_dir) for root_dir in root_dirs]
+        self.extensions = set('.' + ext.lstrip('.') for ext in extensions if ext is not None and ext != '')
+        self.exclude = IgnoreRules(exclude_patterns or [])
+        self.use_ignore_file = use_ignore_file
+        self.max_workers = max_workers if max_workers is not None else min(32, (os.cpu_count() or 1) + 4)
+        # the files parse_result_test_node parses
+        self.markers = [CDocTestConfig.FILE_MARKER.encode('utf-8')]
+
+    @staticmethod
+    def _is_ignored(rules, rel_path, is_dir):
+        ignored = False
+        for rule in rules:
+            result = rule.match(rel_path, is_dir)
+            if result is not None:
+                ignored = result
+        return ignored
+
+    def has_marker(self, path):
+        # read in chunks and keep a tail so a marker split across two chunks is still found
+        overlap = max(len(marker) for marker in self.markers) - 1
+        tail = b''
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        return False
+                    data = tail + chunk
+                    if any(marker in data for marker in self.markers):
+                        return True
+                    tail = data[-overlap:] if overlap > 0 else b''
+        except OSError:
+            return False
+
+    def _scan_dir(self, root, rel_dir, rules, submit, found):
+        dir_path = root if rel_dir == '' else os.path.join(root, rel_dir)
+        if self.use_ignore_file:
+            ignore_file = os.path.join(dir_path, self.IGNORE_FILE)
+            if os.path.isfile(ignore_file):
+                rule = IgnoreRules.from_file(ignore_file, rel_dir.replace(os.sep, '/'))
+                if rule is not None and len(rule) > 0:
+                    rules = rules + [rule]
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            return
+        for entry in entries:
+            rel_path = entry.name if rel_dir == '' else rel_dir + '/' + entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_file = not is_dir and entry.is_file()
+            except OSError:
+                continue
+            if is_dir:
+                if entry.name in self.SKIP_DIRS or self._is_ignored(rules, rel_path, True):
+                    continue
+                submit(root, rel_path, rules)
+            elif is_file:
+                if os.path.splitext(entry.name)[1] not in self.extensions:
+                    continue
+                if self._is_ignored(rules, rel_path, False):
+                    continue
+                if self.has_marker(entry.path):
+                    found(entry.path)
+
+    def walk(self):
+        # generator, files are yielded as soon as a worker finds them
+        results = queue.Queue()
+        done = object()
+        pending = 1  # held by the caller until every root is submitted
+        lock = threading.Lock()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        # directories not scanned yet, cancelled when the caller stops early (no cancel_futures before 3.9)
+        futures = set()
+        stopped = False
+
+        def submit(root, rel_dir, rules):
+            nonlocal pending
+            with lock:
+                if stopped:
+                    return
+                pending += 1
+                future = executor.submit(task, root, rel_dir, rules)
+                futures.add(future)
+            future.add_done_callback(discard)
+
+        def discard(future):
+            with lock:
+                futures.discard(future)
+
+        def release():
+            nonlocal pending
+            with lock:
+                pending -= 1
+                if pending == 0:
+                    results.put(done)
+
+        def task(root, rel_dir, rules):
+            try:
+                self._scan_dir(root, rel_dir, rules, submit, results.put)
+            finally:
+                release()
+
+        roots = [root for root in self.root_dirs if os.path.isdir(root)]
+        for root in self.root_dirs:
+            if root not in roots:
+                print(f"Warning: Target directory '{root}' does not exist.")
+        if len(roots) == 0:
+            executor.shutdown()
+            return
+        try:
+            for root in roots:
+                submit(root, '', [self.exclude])
+            release()
+            while True:
+                item = results.get()
+                if item is done:
+                    break
+                yield item
+        finally:
+            with lock:
+                stopped = True
+                waiting = list(futures)
+            for future in waiting:
+                future.cancel()
+            executor.shutdown(wait=False)
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Fingerprinter:
+    # fingerprint of a test node: its doc comment, the tokens of its declaration and the tokens of
+    # every declaration it references (resolved by libclang), plus the bytes of the loaded libraries.
+    # Tokens are hashed instead of raw bytes so whitespace only edits keep the fingerprint.
+    def __init__(self, libs=None):
+        self._lib_digest = None
+        self._libs = [lib for lib in libs or [] if lib is not None]
+
+    def lib_digest(self):
+        if self._lib_digest is None:
+            digest = hashlib.sha256()
+            for lib in sorted(self._libs):
+                digest.update(os.path.basename(lib).encode('utf-8'))
+                digest.update(file_digest(lib).encode('utf-8') if os.path.isfile(lib) else b'missing')
+            self._lib_digest = digest.hexdigest()
+        return self._lib_digest
+
+    @staticmethod
+    def _update_tokens(digest, cursor):
+        for token in cursor.get_tokens():
+            digest.update(token.spelling.encode('utf-8'))
+            digest.update(b'\0')
+
+    @staticmethod
+    def _is_inside(cursor, outer):
+        start = cursor.extent.start
+        end = cursor.extent.end
+        return start.file is not None and outer.extent.start.file is not None \
+            and start.file.name == outer.extent.start.file.name \
+            and outer.extent.start.offset <= start.offset and end.offset <= outer.extent.end.offset
+
+    @classmethod
+    def referenced_declarations(cls, cursor):
+        referenced = {}
+        for child in cursor.walk_preorder():
+            ref = child.referenced
+            if ref is None or ref == child or not ref.kind.is_declaration():
+                continue
+            definition = ref.get_definition()
+            if definition is not None:
+                ref = definition
+            if ref.location.file is None or ref.location.is_in_system_header or cls._is_inside(ref, cursor):
+                continue
+            key = ref.get_usr() or (ref.spelling + '@' + ref.location.file.name + ':' + str(ref.location.offset))
+            referenced[key] = ref
+        return referenced
+
+    def fingerprint(self, node):
+        digest = hashlib.sha256()
+        digest.update(node.comment_token.spelling.encode('utf-8'))
+        digest.update(b'\1')
+        self._update_tokens(digest, node.id_token)
+        for key, ref in sorted(self.referenced_declarations(node.id_token).items()):
+            digest.update(b'\1' + key.encode('utf-8') + b'\1')
+            self._update_tokens(digest, ref)
+        digest.update(b'\1' + self.lib_digest().encode('utf-8'))
+        return digest.hexdigest()
+
+
+class FingerprintStore:
+    # test id -> fingerprint of the last passing run
+    VERSION = 1
+    REUSED = 'unchanged'
+
+    def __init__(self, path, fingerprinter):
+        self.path = path
+        self.fingerprinter = fingerprinter
+        self.tests = {}
+        self._pending = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.tests = data.get('tests', {})
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'tests': self.tests}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def skip_unchanged(self, nodes):
+        # mark nodes whose fingerprint matches their last passing run, they are not run again
+        for node in nodes:
+            test_id = node.rel_full_path()
+            fingerprint = self.fingerprinter.fingerprint(node)
+            self._pending[test_id] = fingerprint
+            if self.tests.get(test_id) == fingerprint:
+                node.test.reuse(self.REUSED)
+
+    def update(self, nodes):
+        for node in nodes:
+            test_id = node.rel_full_path()
+            if node.test.reused is not None or test_id not in self._pending:
+                continue
+            if node.test.is_pass:
+                self.tests[test_id] = self._pending.pop(test_id)
+            else:
+                self._pending.pop(test_id)
+                self.tests.pop(test_id, None)
@@ -0,0 +1,86 @@
+import os
+
+
+class HeaderIndex:
+    # file names of include directories read by one scandir per directory. find() returns the header
+    # of the first include directory holding the name, as the compiler would pick it.
+    SKIP_DIRS = {'.git', '.hg', '.svn'}
+
+    def __init__(self, include_dirs):
+        self.include_dirs = [os.path.abspath(include_dir) for include_dir in include_dirs]
+        self._listings = {}
+        self._by_name = None
+
+    def listing(self, directory):
+        directory = os.path.abspath(directory)
+        names = self._listings.get(directory)
+        if names is None:
+            names = set()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_file():
+                                names.add(entry.name)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+            self._listings[directory] = names
+        return names
+
+    def exists(self, path):
+        return os.path.basename(path) in self.listing(os.path.dirname(path))
+
+    def headers(self):
+        # file name -> path by include precedence
+        if self._by_name is None:
+            self._by_name = {}
+            for include_dir in self.include_dirs:
+                for name in self.listing(include_dir):
+                    self._by_name.setdefault(name, os.path.join(include_dir, name))
+        return self._by_name
+
+    def find(self, file_name):
+        return self.headers().get(file_name)
+
+    def header_of(self, source, h_ext):
+        # header next to the source, else the one found in the include directories
+        header = os.path.splitext(source)[0] + '.' + h_ext
+        if self.exists(header):
+            return header
+        return self.find(os.path.basename(header))
+
+    def tree(self, include_dir, max_files):
+        # ({'sub/name.h': path}, [every directory]) of an include directory and its subdirectories, None when
+        # it holds more than max_files files or a directory is linked twice
+        include_dir = os.path.abspath(include_dir)
+        files = {}
+        dirs = []
+        visited = set()
+        pending = [('', include_dir)]
+        while len(pending) > 0:
+            rel_dir, directory = pending.pop()
+            # reached twice through a symbolic link, maybe a cycle
+            real_dir = os.path.realpath(directory)
+            if real_dir in visited:
+                return None
+            visited.add(real_dir)
+            dirs.append(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        rel_path = entry.name if rel_dir == '' else rel_dir + '/' + entry.name
+                        try:
+                            if entry.is_dir():
+                                if entry.name not in self.SKIP_DIRS:
+                                    pending.append((rel_path, entry.path))
+                            elif entry.is_file():
+                                files[rel_path] = entry.path
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+            if len(files) > max_files:
+                return None
+        return files, dirs
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import struct
+
+from .header_index import HeaderIndex
+from .result_cache import default_cache_dir
+
+# clang header maps of the include directories: a file mapping 'sub/name.h' to its path, given to libclang
+# and clang-repl as an include directory in place of the directories it covers. An #include is then one
+# lookup in the map instead of a stat in every directory, and a standard header is no longer looked for in
+# the project directories. Include directories with more than MAX_FILES files stay in the search path, and
+# the order is kept, so the same header is found. The maps are cached with the modification times of the
+# covered directories, which change when a file is added or removed.
+
+MAGIC = 0x686d6170  # 'hmap'
+VERSION = 1
+HEADER = '<IHHIIII'
+BUCKET = '<III'
+
+
+def _hash(key):
+    # HashHMapKey of clang: ASCII lower case, bytes as signed char
+    result = 0
+    for c in key.encode('utf-8').lower():
+        result += (c - 256 if c >= 128 else c) * 13
+    return result & 0xffffffff
+
+
+def write_header_map(path, entries):
+    # entries: {'sub/name.h': '/include/dir/sub/name.h'}
+    buckets = 8
+    while buckets < len(entries) * 4 // 3 + 1:
+        buckets *= 2
+    strings = bytearray(b'\0')
+    offsets = {}
+
+    def string(value):
+        if value not in offsets:
+            offsets[value] = len(strings)
+            strings.extend(value.encode('utf-8') + b'\0')
+        return offsets[value]
+
+    table = [(0, 0, 0)] * buckets
+    max_value = 0
+    for key, value in entries.items():
+        prefix, suffix = os.path.split(value)
+        prefix = prefix + os.sep
+        max_value = max(max_value, len(prefix) + len(suffix))
+        bucket = _hash(key) & (buckets - 1)
+        while table[bucket][0] != 0:
+            bucket = (bucket + 1) & (buckets - 1)
+        table[bucket] = (string(key), string(prefix), string(suffix))
+    strings_offset = struct.calcsize(HEADER) + buckets * struct.calcsize(BUCKET)
+    with open(path + '.' + str(os.getpid()), 'wb') as f:
+        f.write(struct.pack(HEADER, MAGIC, VERSION, 0, strings_offset, len(entries), buckets, max_value))
+        for bucket in table:
+            f.write(struct.pack(BUCKET, *bucket))
+        f.write(bytes(strings))
+    os.replace(path + '.' + str(os.getpid()), path)
+
+
+def read_header_map(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, _, strings_offset, _, buckets, _ = struct.unpack_from(HEADER, data, 0)
+    assert magic == MAGIC and version == VERSION
+
+    def string(offset):
+        start = strings_offset + offset
+        return data[start:data.index(b'\0', start)].decode('utf-8')
+
+    entries = {}
+    for i in range(buckets):
+        key, prefix, suffix = struct.unpack_from(BUCKET, data, struct.calcsize(HEADER) + i * struct.calcsize(BUCKET))
+        if key != 0:
+            entries[string(key)] = string(prefix) + string(suffix)
+    return entries
+
+
+class HeaderMap:
+    VERSION = 1
+    MAX_FILES = 20000
+
+    def __init__(self, cache_dir=None, max_files=None):
+        self.cache_dir = os.path.join(os.path.dirname(default_cache_dir()), 'hmap') if cache_dir is None else cache_dir
+        self.max_files = self.MAX_FILES if max_files is None else max_files
+        self.built = 0
+        self.reused = 0
+        # headers in the maps of the last search path
+        self.headers = 0
+        # include directories: search path
+        self._maps = {}
+
+    def _valid(self, meta):
+        for directory, mtime in meta['mtimes'].items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                if mtime is not None:
+                    return False
+        return True
+
+    def _build(self, include_dirs, path):
+        # search path with every run of covered include directories replaced by one header map
+        index = HeaderIndex(include_dirs)
+        search_path = []
+        mtimes = {}
+        entries = None
+        lowered = set()
+        headers = 0
+
+        def flush():
+            if entries is not None:
+                map_path = path + '.' + str(len(search_path)) + '.hmap'
+                write_header_map(map_path, entries)
+                search_path.append(map_path)
+
+        for include_dir in index.include_dirs:
+            tree = index.tree(include_dir, self.max_files)
+            if tree is not None:
+                files, dirs = tree
+                # a name found in an earlier directory keeps its header
+                added = {name: file for name, file in files.items() if entries is None or name not in entries}
+                added_lowered = set(name.lower() for name in added)
+                # names differing only in case would hit each other in the map
+                if len(added_lowered) < len(added) or not lowered.isdisjoint(added_lowered):
+                    tree = None
+            if tree is None:
+                flush()
+                entries = None
+                lowered = set()
+                search_path.append(include_dir)
+                continue
+            for directory in dirs:
+                try:
+                    mtimes[directory] = os.stat(directory).st_mtime_ns
+                except OSError:
+                    mtimes[directory] = None
+            entries = {} if entries is None else entries
+            entries.update(added)
+            lowered.update(added_lowered)
+            headers += len(added)
+        flush()
+        return {'include_dirs': index.include_dirs, 'search_path': search_path, 'headers': headers, 'mtimes': mtimes}
+
+    def search_path(self, include_dirs):
+        # include directories with header maps in place of the ones they cover, in the same order
+        include_dirs = [os.path.abspath(include_dir) for include_dir in include_dirs]
+        key = tuple(include_dirs)
+        if key not in self._maps:
+            self._maps[key] = self._search_path(include_dirs)
+        return self._maps[key]
+
+    def _search_path(self, include_dirs):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        digest = hashlib.sha256('\0'.join([str(self.VERSION), str(self.max_files)] + include_dirs).encode('utf-8'))
+        path = os.path.join(self.cache_dir, digest.hexdigest()[:32])
+        meta_path = path + '.json'
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if not all(os.path.exists(entry) for entry in meta['search_path']) or not self._valid(meta):
+                meta = None
+        except (OSError, ValueError, KeyError):
+            meta = None
+        if meta is None:
+            meta = self._build(include_dirs, path)
+            with open(meta_path + '.' + str(os.getpid()), 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.' + str(os.getpid()), meta_path)
+            self.built += 1
+        else:
+            self.reused += 1
+        self.headers = meta['headers']
+        return meta['search_path']
@@ -0,0 +1,244 @@
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+
+from clang_repl_kernel import Shell
+
+from .c_doctest import RunListener
+
+
+class ImpactMap:
+    # test id -> functions of the loaded libraries the test executed
+    # {"version": 1, "tests": {"a.h::ns::fac": {"functions": [{"name":..., "file":..., "start":..., "end":...}]}}}
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.tests = {}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data.get('version') != self.VERSION:
+            print(f"Warning: Impact map '{path}' has unknown version, ignored.")
+            return
+        self.tests = data.get('tests', {})
+
+    def save(self, path=None):
+        path = self.path if path is None else path
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'tests': self.tests}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def record(self, test_id, functions):
+        self.tests[test_id] = {'functions': functions}
+
+    def __contains__(self, test_id):
+        return test_id in self.tests
+
+    def is_affected(self, test_id, changes, base_path=None):
+        # unknown tests are always affected, nothing is known about what they execute
+        if test_id not in self.tests:
+            return True
+        for function in self.tests[test_id]['functions']:
+            if changes.touches(function['file'], function['start'], function['end'], base_path):
+                return True
+        return False
+
+
+class ChangeSet:
+    # changed files and lines, parsed from a unified diff or a plain list of files
+    HUNK = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+    def __init__(self):
+        # path -> list of (start, end), None means the whole file changed
+        self.files = {}
+
+    def add(self, path, start=None, end=None):
+        path = path.replace('\\', '/')
+        if start is None:
+            self.files[path] = None
+        elif path not in self.files:
+            self.files[path] = [(start, end)]
+        elif self.files[path] is not None:
+            self.files[path].append((start, end))
+
+    @classmethod
+    def from_diff(cls, text):
+        changes = cls()
+        old_path = None
+        current = None
+        for line in text.splitlines():
+            if line.startswith('--- '):
+                old_path = cls._diff_path(line, 'a/')
+                current = None
+            elif line.startswith('+++ '):
+                current = cls._diff_path(line, 'b/')
+                # deleted or renamed files affect every test that used them
+                if old_path is not None and old_path != current:
+                    changes.add(old_path)
+                # a new file without hunks still counts as changed
+                if current is not None and current not in changes.files:
+                    changes.files[current] = []
+            elif current is not None and line.startswith('@@'):
+                matched = cls.HUNK.match(line)
+                if matched is None:
+                    continue
+                start = int(matched.group(1))
+                count = 1 if matched.group(2) is None else int(matched.group(2))
+                # pure deletion (count == 0) still touches the line it happened at
+                changes.add(current, start, start + max(count, 1) - 1)
+        return changes
+
+    @staticmethod
+    def _diff_path(line, prefix):
+        path = line[4:].split('\t')[0].strip()
+        if path == '/dev/null':
+            return None
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        return path.replace('\\', '/')
+
+    @classmethod
+    def from_files(cls, files):
+        changes = cls()
+        for file in files:
+            if file.strip() != '':
+                changes.add(file.strip())
+        return changes
+
+    @classmethod
+    def parse(cls, spec):
+        # '-' reads a diff from stdin, an existing diff/patch file is parsed as a diff,
+        # anything else is a ';' separated list of changed files
+        if spec == '-':
+            return cls.from_diff(sys.stdin.read())
+        if os.path.isfile(spec):
+            with open(spec, 'r', errors='replace') as f:
+                text = f.read()
+            if text.startswith('diff ') or '\n+++ ' in text or text.startswith('--- '):
+                return cls.from_diff(text)
+        return cls.from_files(spec.split(';'))
+
+    def _lookup(self, file, base_path):
+        file = file.replace('\\', '/')
+        real_file = os.path.realpath(file).replace('\\', '/')
+        for path, ranges in self.files.items():
+            if os.path.isabs(path):
+                candidate = os.path.realpath(path).replace('\\', '/')
+            elif base_path is not None:
+                candidate = os.path.realpath(os.path.join(base_path, path)).replace('\\', '/')
+            else:
+                candidate = None
+            if candidate == real_file or file == path or file.endswith('/' + path):
+                return True, ranges
+        return False, None
+
+    def touches(self, file, start=None, end=None, base_path=None):
+        found, ranges = self._lookup(file, base_path)
+        if not found:
+            return False
+        if ranges is None or start is None:
+            return True
+        for change_start, change_end in ranges:
+            if change_start <= end and start <= change_end:
+                return True
+        return False
+
+
+class CoverageCollector(RunListener):
+    # needs the shared libraries built with '-fprofile-instr-generate -fcoverage-mapping'.
+    # Every test node runs in its own clang-repl process, so a per node LLVM_PROFILE_FILE gives
+    # a profile context per doctest.
+    PROFILE_ENV = 'LLVM_PROFILE_FILE'
+
+    def __init__(self, impact_map, libs, profile_dir, llvm_profdata='llvm-profdata', llvm_cov='llvm-cov', verbose=False):
+        self.impact_map = impact_map
+        self.libs = [lib for lib in libs if lib is not None]
+        self.profile_dir = profile_dir
+        self.llvm_profdata = llvm_profdata
+        self.llvm_cov = llvm_cov
+        self.verbose = verbose
+        self._count = 0
+        self._prefix = None
+        self._saved_env = None
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def before_node(self, node):
+        self._count += 1
+        self._prefix = os.path.join(self.profile_dir, 'cdoctest-' + str(os.getpid()) + '-' + str(self._count))
+        for old in glob.glob(self._prefix + '-*.profraw'):
+            os.remove(old)
+        self._saved_env = Shell.env.get(self.PROFILE_ENV)
+        Shell.env[self.PROFILE_ENV] = self._prefix + '-%p.profraw'
+
+    def after_node(self, node):
+        if self._saved_env is None:
+            Shell.env.pop(self.PROFILE_ENV, None)
+        else:
+            Shell.env[self.PROFILE_ENV] = self._saved_env
+        raw_files = glob.glob(self._prefix + '-*.profraw')
+        if len(raw_files) == 0:
+            print(f"Warning: No coverage profile for '{node.rel_full_path()}'. "
+                  "Are the libraries built with -fprofile-instr-generate -fcoverage-mapping?")
+            return
+        functions = self.collect(raw_files, self._prefix + '.profdata') if len(self.libs) > 0 else []
+        if functions is not None:
+            self.impact_map.record(node.rel_full_path(), functions)
+        for raw_file in raw_files:
+            os.remove(raw_file)
+
+    def collect(self, raw_files, profdata):
+        try:
+            subprocess.run([self.llvm_profdata, 'merge', '-sparse', '-o', profdata] + raw_files,
+                           check=True, capture_output=True)
+            # first object is positional, the others need '-object'
+            objects = [self.libs[0]]
+            for lib in self.libs[1:]:
+                objects += ['-object', lib]
+            exported = subprocess.run([self.llvm_cov, 'export', '-format=text', '-skip-expansions',
+                                       '-instr-profile', profdata] + objects,
+                                      check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print("Warning: Could not collect coverage:", e)
+            return None
+        finally:
+            if os.path.exists(profdata):
+                os.remove(profdata)
+        return self.covered_functions(json.loads(exported.stdout))
+
+    @staticmethod
+    def covered_functions(export):
+        # llvm-cov export json: data[].functions[] {name, count, regions[[ls, cs, le, ce, count, file_id, ...]], filenames}
+        result = {}
+        for data in export.get('data', []):
+            for function in data.get('functions', []):
+                if function.get('count', 0) == 0 or len(function.get('filenames', [])) == 0:
+                    continue
+                regions = [region for region in function.get('regions', []) if len(region) > 5 and region[5] == 0]
+                if len(regions) == 0:
+                    continue
+                start = min(region[0] for region in regions)
+                end = max(region[2] for region in regions)
+                file = function['filenames'][0]
+                result[(function['name'], file)] = {'name': function['name'], 'file': file, 'start': start, 'end': end}
+        return sorted(result.values(), key=lambda function: (function['file'], function['start'], function['name']))
+
+
+def select_affected(nodes, impact_map, changes, base_path=None):
+    # a test is affected when the code it executed changed or its own doc comment/declaration changed
+    selected = []
+    for node in nodes:
+        file = node.file_node.spelling
+        start = node.comment_token.extent.start.line
+        end = node.id_token.extent.end.line
+        if changes.touches(file, start, end, base_path) \
+                or impact_map.is_affected(node.rel_full_path(), changes, base_path):
+            selected.append(node)
+    return selected
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+
+from clang_repl_kernel import ClangReplConfig
+
+from .result_cache import default_cache_dir
+
+# clang-repl has no option to keep compiled objects between runs, what every REPL compiles again is the
+# preamble: cstdio, iostream and the headers of the kernel. PreambleCache builds a precompiled header of it
+# once per clang-repl version and include path, and starts REPLs with '-Xcc -include-pch'. A precompiled
+# header is only used after a probe REPL accepted it.
+
+
+def _version(program):
+    try:
+        return subprocess.run([program, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              universal_newlines=True, timeout=60).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return ''
+
+
+def _major_version(program):
+    matched = re.search(r'version (\d+)', _version(program))
+    return None if matched is None else matched.group(1)
+
+
+class PreambleCache:
+    VERSION = 1
+    HEADERS = ['cstdio', 'iostream']
+
+    def __init__(self, cache_dir=None, compiler=None, verbose=False):
+        self.cache_dir = os.path.join(os.path.dirname(default_cache_dir()), 'preamble') if cache_dir is None else cache_dir
+        self.compiler = compiler
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        # estimate of the seconds the hits saved: the time clang++ took to build the precompiled header, not
+        # a measured REPL startup
+        self.saved = 0.0
+        self._entries = {}
+        self._keys = {}
+        # REPLs are also started by the background thread of ReplPool
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def headers(self):
+        return list(dict.fromkeys(self.HEADERS + list(ClangReplConfig.HEADERS)))
+
+    def key(self, program, include_path):
+        key = self._keys.get((program, include_path))
+        if key is None:
+            digest = hashlib.sha256()
+            for part in [str(self.VERSION), program, _version(program), include_path or ''] + self.headers():
+                digest.update(part.encode('utf-8'))
+                digest.update(b'\0')
+            key = self._keys[(program, include_path)] = digest.hexdigest()[:32]
+        return key
+
+    def find_compiler(self, program):
+        # clang++ of the same major version as the REPL, preferably installed next to it
+        if self.compiler is not None:
+            return self.compiler
+        version = _major_version(program)
+        for candidate in [os.path.join(os.path.dirname(program), 'clang++'), shutil.which('clang++')]:
+            if candidate is not None and os.path.exists(candidate) and version is not None \
+                    and _major_version(candidate) == version:
+                return candidate
+        return None
+
+    def compile_args(self, compiler, header, pch):
+        # the language options must be those of clang-repl, or the precompiled header is rejected
+        return [compiler, '-x', 'c++-header', '-Xclang', '-fincremental-extensions', header, '-o', pch]
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _build(self, key, program, env):
+        compiler = self.find_compiler(program)
+        if compiler is None:
+            return {'usable': False, 'reason': 'no clang++ of the clang-repl version'}
+        header = os.path.join(self.cache_dir, key + '.h')
+        pch = os.path.join(self.cache_dir, key + '.pch')
+        with open(header, 'w') as f:
+            for name in self.headers():
+                f.write('#include <' + name + '>\n')
+        building = pch + '.' + str(os.getpid())
+        start = time.monotonic()
+        result = subprocess.run(self.compile_args(compiler, header, building), stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True, env=env)
+        build_seconds = time.monotonic() - start
+        if result.returncode != 0:
+            return {'usable': False, 'pch': None, 'reason': 'precompiling failed: ' + result.stdout.strip()[-2000:]}
+        os.replace(building, pch)
+        if not self.probe(program, pch, env):
+            return {'usable': False, 'pch': pch, 'reason': 'clang-repl rejected the precompiled header'}
+        return {'usable': True, 'pch': pch, 'build_seconds': build_seconds}
+
+    def probe(self, program, pch, env):
+        try:
+            result = subprocess.run(' '.join([shlex.quote(program)] + [shlex.quote(arg) for arg in self.repl_args(pch)]),
+                                    shell=True, input='int cdoctest_preamble_probe = 0;\n', stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, universal_newlines=True, env=env, timeout=120)
+        except subprocess.TimeoutExpired:
+            return False
+        return result.returncode == 0 and 'error' not in result.stdout
+
+    @staticmethod
+    def repl_args(pch):
+        return ['-Xcc', '-include-pch', '-Xcc', pch]
+
+    def entry(self, program, env):
+        key = self.key(program, env.get('CPLUS_INCLUDE_PATH'))
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        try:
+            with open(self._meta_path(key), 'r') as f:
+                entry = json.load(f)
+            if entry['usable'] and not os.path.exists(entry['pch']):
+                entry = None
+        except (OSError, ValueError, KeyError):
+            entry = None
+        if entry is None:
+            entry = self._build(key, program, env)
+            # a clang++ installed later is tried again, a rejected precompiled header is not
+            if entry['usable'] or 'pch' in entry:
+                with open(self._meta_path(key), 'w') as f:
+                    json.dump(entry, f)
+            if self.verbose and not entry['usable']:
+                print('preamble cache not used:', entry['reason'])
+        else:
+            entry = dict(entry, cached=True)
+        self._entries[key] = entry
+        return entry
+
+    def args(self, program, env):
+        # extra clang-repl arguments of a REPL starting now, counted as a hit or a miss
+        with self._lock:
+            return self._args(program, env)
+
+    def _args(self, program, env):
+        entry = self.entry(program, env)
+        if not entry['usable']:
+            self.misses += 1
+            return []
+        if entry.get('cached'):
+            self.hits += 1
+            self.saved += entry['build_seconds']
+        else:
+            # built by this REPL start, the following ones use it
+            self.misses += 1
+            entry['cached'] = True
+        return self.repl_args(entry['pch'])
@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+
+from .c_doctest import RunListener
+
+# file walking, discovery and test runs overlap: a thread walks the target files, a second one parses them,
+# and the caller runs the tests of every parsed file while later files are still found and parsed. The stages
+# are connected by bounded queues, so discovery stays only a few files ahead of the runs. The REPL of the
+# first tests is started before discovery, see ReplPool.warm.
+
+
+class Pipeline(RunListener):
+    FILE_QUEUE_SIZE = 64
+    TEST_QUEUE_SIZE = 4
+
+    def __init__(self, discover, file_queue_size=None, test_queue_size=None):
+        # discover(target_file) returns (absolute path, test nodes)
+        self.discover = discover
+        self.file_queue_size = self.FILE_QUEUE_SIZE if file_queue_size is None else file_queue_size
+        self.test_queue_size = self.TEST_QUEUE_SIZE if test_queue_size is None else test_queue_size
+        # seconds since the first run() started
+        self.first_result = None
+        self.total = None
+        # seconds the runs waited for discovery, and spent in discovery
+        self.waited = 0.0
+        self.discovery = 0.0
+        self._start = None
+
+    def _started(self):
+        # the first run starts the clock, the following ones, ex) of other targets, add to it
+        if self._start is None:
+            self._start = time.monotonic()
+
+    def after_node(self, node):
+        if self.first_result is None:
+            self.first_result = time.monotonic() - self._start
+
+    def _walk(self, target_files, files, stop):
+        try:
+            for target_file in target_files:
+                if stop.is_set():
+                    return
+                files.put((target_file, None))
+            files.put((None, None))
+        except BaseException as e:
+            files.put((None, e))
+
+    def _discover(self, files, tests, stop):
+        while not stop.is_set():
+            target_file, error = files.get()
+            if target_file is None:
+                tests.put((None, None, error))
+                return
+            try:
+                start = time.monotonic()
+                abs_target_file, merged_node = self.discover(target_file)
+                self.discovery += time.monotonic() - start
+            except BaseException as e:
+                tests.put((None, None, e))
+                return
+            tests.put((abs_target_file, merged_node, None))
+
+    def _job(self, job, abs_target_file, merged_node):
+        job(abs_target_file, merged_node)
+        if self.first_result is None and any(node.test.is_pass is not None for node in merged_node):
+            # run without listeners, ex) by StressRunner
+            self.first_result = time.monotonic() - self._start
+
+    def run_sequential(self, target_files, job):
+        # every file is parsed when the tests of the previous one are done, measured the same way
+        self._started()
+        for target_file in target_files:
+            start = time.monotonic()
+            abs_target_file, merged_node = self.discover(target_file)
+            self.discovery += time.monotonic() - start
+            self.waited += time.monotonic() - start
+            self._job(job, abs_target_file, merged_node)
+        self.total = time.monotonic() - self._start
+
+    def run(self, target_files, job):
+        # job(absolute path, test nodes) runs and reports the tests of a file, in the order of target_files
+        self._started()
+        files = queue.Queue(self.file_queue_size)
+        tests = queue.Queue(self.test_queue_size)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._walk, args=(target_files, files, stop), daemon=True),
+                   threading.Thread(target=self._discover, args=(files, tests, stop), daemon=True)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                start = time.monotonic()
+                abs_target_file, merged_node, error = tests.get()
+                self.waited += time.monotonic() - start
+                if error is not None:
+                    raise error
+                if abs_target_file is None:
+                    break
+                self._job(job, abs_target_file, merged_node)
+        finally:
+            # the stages blocked on a full queue are daemon threads, they end with the process
+            stop.set()
+        self.total = time.monotonic() - self._start
@@ -0,0 +1,138 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import clang.cindex
+
+from .aot import compile_args, statement
+
+# compile errors found before a REPL is started: the commands of every test case become the body of a
+# function in an in memory file including the tested header, which libclang checks without generating code.
+# A test case with errors is not run and reports the clang diagnostics. Test cases using REPL only commands
+# are not checked, nor are the ones of a header which does not compile without any test.
+
+FILE_NAME = 'cdoctest_precheck.cpp'
+
+
+def expression(cmd):
+    # '(void)(expr);' of an expression without ';' the REPL prints the value of, None for other commands
+    cmd = cmd.strip()
+    if cmd.endswith(';') or cmd.endswith('}') or statement(cmd + ';') is None:
+        return None
+    return '(void)(' + cmd + ');'
+
+
+class SyntaxPrecheck:
+    HEADERS = ['cstdio', 'iostream']
+
+    def __init__(self, cdoctest, jobs=None, verbose=False):
+        self.cdoctest = cdoctest
+        self.jobs = jobs if jobs is not None else os.cpu_count() or 1
+        self.verbose = verbose
+        self.checked = 0
+        self.rejected = 0
+        # header: None when usable, else why it is not checked
+        self._baselines = {}
+        self._lock = threading.Lock()
+        # an Index and the translation units of every header per thread, reparsed for every test case
+        self._local = threading.local()
+        # sets the libclang library
+        cdoctest.get_idx()
+
+    @staticmethod
+    def args():
+        return compile_args()
+
+    def source(self, header, commands):
+        # the source and the line of every command, None when a command only works in the REPL
+        lines = ['#include <' + name + '>' for name in self.HEADERS]
+        if header is not None:
+            lines.append('#include "' + header + '"')
+        body = []
+        command_lines = []
+        for cmd in commands:
+            if cmd.strip().startswith('#include'):
+                command_lines.append(len(lines) + 1)
+                lines.append(cmd.strip())
+                continue
+            line = statement(cmd)
+            if line is None:
+                line = expression(cmd)
+            if line is None:
+                return None, []
+            body.append(line)
+            command_lines.append(-len(body))
+        lines.append('void cdoctest_precheck() {')
+        first = len(lines) + 1
+        lines.extend(body)
+        lines.append('}')
+        return '\n'.join(lines) + '\n', [line if line > 0 else first - line - 1 for line in command_lines]
+
+    def errors(self, header, source):
+        # errors and fatal errors of the source as (line, message), line 0 when not in the source
+        local = self._local
+        if getattr(local, 'index', None) is None:
+            local.index = clang.cindex.Index.create()
+            local.units = {}
+        unsaved_files = [(FILE_NAME, source)]
+        tu = local.units.get(header)
+        if tu is None:
+            tu = local.units[header] = local.index.parse(FILE_NAME, args=self.args(), unsaved_files=unsaved_files,
+                                                         options=clang.cindex.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE)
+        else:
+            # the includes are the same, their precompiled preamble is reused
+            tu.reparse(unsaved_files=unsaved_files)
+        errors = []
+        for diagnostic in tu.diagnostics:
+            if diagnostic.severity < clang.cindex.Diagnostic.Error:
+                continue
+            location = diagnostic.location
+            in_source = location.file is not None and location.file.name == FILE_NAME
+            prefix = '' if in_source or location.file is None else \
+                location.file.name + ':' + str(location.line) + ': '
+            errors.append((location.line if in_source else 0, prefix + 'error: ' + diagnostic.spelling))
+        return errors
+
+    def baseline(self, header):
+        # None when the header compiles without any test
+        with self._lock:
+            if header in self._baselines:
+                return self._baselines[header]
+        source, _ = self.source(header, [])
+        errors = self.errors(header, source)
+        reason = None if len(errors) == 0 else errors[0][1]
+        with self._lock:
+            self._baselines[header] = reason
+        if reason is not None and self.verbose:
+            print('precheck skipped for', (header or 'tests without header') + ':', reason)
+        return reason
+
+    def check(self, node, header):
+        # True when the test case has compile errors, they are set as diagnostics of its commands
+        commands = [test.cmd for test in node.test.tests]
+        source, command_lines = self.source(header, commands)
+        if source is None or len(commands) == 0 or self.baseline(header) is not None:
+            return False
+        errors = self.errors(header, source)
+        with self._lock:
+            self.checked += 1
+        if len(errors) == 0:
+            return False
+        tests = node.test.tests
+        for line, message in errors:
+            # an error outside the commands goes to the first one
+            index = command_lines.index(line) if line in command_lines else 0
+            tests[index].diagnostics.append(message)
+        node.test.reuse('does not compile', is_pass=False)
+        for test in tests:
+            test.aborted = 'not run, ' + str(len(errors)) + ' compile errors'
+        with self._lock:
+            self.rejected += 1
+        return True
+
+    def run(self, merged_node, name=None, header_extension='.h'):
+        header = None if name is None else name + '.' + header_extension
+        nodes = [node for node in merged_node if node.test.reused is None]
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(lambda node: self.check(node, header), nodes))
+        return [node for node, rejected in zip(nodes, results) if rejected]
@@ -0,0 +1,91 @@
+import os
+
+# CPU and memory counters of a REPL process read from /proc. Where there is no /proc only wall times
+# are measured.
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+SHELLS = ['sh', 'bash', 'dash']
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def repl_pid(pid):
+    # Shell starts the REPL with 'sh -c', which either became the REPL or waits as its parent
+    comm = _read('/proc/' + str(pid) + '/comm')
+    if comm is None or comm.strip() not in SHELLS:
+        return pid
+    children = _read('/proc/' + str(pid) + '/task/' + str(pid) + '/children')
+    if children is None or len(children.split()) != 1:
+        return pid
+    return int(children.split()[0])
+
+
+def sample(pid):
+    # {'cpu_user', 'cpu_system'} in seconds and {'peak_rss', 'rss'} in bytes, None when not readable
+    stat = _read('/proc/' + str(pid) + '/stat')
+    status = _read('/proc/' + str(pid) + '/status')
+    if stat is None or status is None:
+        return None
+    # the command name may hold spaces and parentheses, fields are counted after its closing ')'
+    fields = stat[stat.rfind(')') + 2:].split()
+    result = {'cpu_user': int(fields[11]) / CLOCK_TICKS, 'cpu_system': int(fields[12]) / CLOCK_TICKS}
+    for line in status.split('\n'):
+        if line.startswith('VmHWM:'):
+            result['peak_rss'] = int(line.split()[1]) * 1024
+        elif line.startswith('VmRSS:'):
+            result['rss'] = int(line.split()[1]) * 1024
+    if 'peak_rss' not in result or 'rss' not in result:
+        return None
+    return result
+
+
+def test_metrics(startup, wall, first_output, before, after):
+    # metrics of one test node. before/after are samples taken around its commands, after is None
+    # when its REPL died
+    metrics = {'startup': startup, 'wall': wall}
+    if first_output is not None:
+        # mostly the JIT compile of the first command
+        metrics['first_output'] = first_output
+    if before is not None and after is not None:
+        metrics['cpu_user'] = after['cpu_user'] - before['cpu_user']
+        metrics['cpu_system'] = after['cpu_system'] - before['cpu_system']
+        metrics['peak_rss'] = after['peak_rss']
+        metrics['rss_growth'] = max(0, after['peak_rss'] - before['rss'])
+    return metrics
+
+
+def _seconds(metrics, key):
+    return '%.3f' % metrics[key] if key in metrics else '-'
+
+
+def _mb(metrics, key):
+    return '%.1f' % (metrics[key] / (1024 * 1024)) if key in metrics else '-'
+
+
+def metrics_table(nodes, count=20):
+    # 'slowest' and 'heaviest' tables of the nodes that ran, as lines
+    # a node run by several targets is listed once, with its last run
+    nodes = list({id(node): node for node in nodes if len(node.test.metrics) > 0}.values())
+    if len(nodes) == 0 or count <= 0:
+        return []
+    lines = []
+    header = '%10s %10s %10s %10s %10s %10s %10s  %s' % ('wall s', 'startup s', 'first s', 'user s', 'sys s',
+                                                        'peak MB', 'growth MB', 'test')
+    for title, key in [('slowest', 'wall'), ('heaviest', 'rss_growth')]:
+        ranked = sorted(nodes, key=lambda node: node.test.metrics.get(key, 0), reverse=True)[:count]
+        lines.append('top ' + str(len(ranked)) + ' ' + title + ' tests:')
+        lines.append(header)
+        for node in ranked:
+            metrics = node.test.metrics
+            lines.append('%10s %10s %10s %10s %10s %10s %10s  %s' % (
+                _seconds(metrics, 'wall'), _seconds(metrics, 'startup'), _seconds(metrics, 'first_output'),
+                _seconds(metrics, 'cpu_user'), _seconds(metrics, 'cpu_system'), _mb(metrics, 'peak_rss'),
+                _mb(metrics, 'rss_growth'), node.full_path()))
+    return lines
@@ -0,0 +1,156 @@
+import os
+
+import pytest
+from clang_repl_kernel import Shell
+
+from .c_doctest import CDocTest, ReplSupervisor
+from .file_walker import FileWalker
+from .jit_cache import PreambleCache
+from .repl_pool import ReplPool
+
+# pytest plugin, loaded with '-p cdoctest.pytest_plugin' and enabled with --cdoctest. It is not registered as a
+# pytest11 entry point, which would import libclang and the REPL kernel in every pytest run.
+# Every TestNode of a collected .h/.c/.cpp file is one pytest item with a stable node id
+# ('dir/sample.h::test::Fac::fac'), so -k, --lf and pytest-xdist work as for python tests.
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('cdoctest')
+    group.addoption('--cdoctest', action='store_true', default=False, help='collect C/C++ doctests')
+    group.addoption('--cdoctest-lib', default=None, help='target lib, separate by ";"')
+    group.addoption('--cdoctest-lib-path', default=None, help='target lib dir path, separate by ";"')
+    group.addoption('--cdoctest-include-path', default=None, help='target include path, separate by ";"')
+    group.addoption('--cdoctest-src-path', default=None, help='source root path of test names. Default is rootdir')
+    group.addoption('--cdoctest-repl', default=None, help='clang-repl executable to use')
+    parser.addini('cdoctest_extensions', 'C/C++ doctest file extensions', type='args', default=['h', 'c', 'cpp'])
+    parser.addini('cdoctest_header_extension', 'header included for the tests of a file', default='h')
+    parser.addini('cdoctest_single_file_parse', 'discover tests without following #include', type='bool', default=False)
+    parser.addini('cdoctest_preamble_cache', 'start REPLs with a precompiled header of the standard headers', type='bool', default=False)
+    parser.addini('cdoctest_lib', 'target lib, separate by ";"', default='')
+    parser.addini('cdoctest_lib_path', 'target lib dir path, separate by ";"', default='')
+    parser.addini('cdoctest_include_path', 'target include path, separate by ";"', default='')
+
+
+def _split(value):
+    return [item for item in (value or '').split(';') if item != '']
+
+
+class CDocTestRunner:
+    # one per pytest process (so one per xdist worker). Holds the parser and a ReplPool.
+    def __init__(self, config):
+        rootdir = str(config.rootpath) if hasattr(config, 'rootpath') else str(config.rootdir)
+        self.libs = _split(config.getoption('cdoctest_lib') or config.getini('cdoctest_lib'))
+        self.lib_dirs = [os.path.abspath(path) for path in
+                         [os.getcwd()] + _split(config.getoption('cdoctest_lib_path') or config.getini('cdoctest_lib_path'))]
+        self.include_paths = [os.path.abspath(path) for path in
+                              [os.getcwd()] + _split(config.getoption('cdoctest_include_path') or config.getini('cdoctest_include_path'))]
+        self.src_path = os.path.realpath(config.getoption('cdoctest_src_path') or rootdir)
+        self.repl_binary = config.getoption('cdoctest_repl')
+        self.header_extension = config.getini('cdoctest_header_extension')
+        self.single_file_parse = config.getini('cdoctest_single_file_parse')
+        self.preamble_cache = config.getini('cdoctest_preamble_cache')
+        self.walker = FileWalker(self.src_path, config.getini('cdoctest_extensions'))
+        self._cdoctest = None
+        self._pool = None
+
+    def get_cdoctest(self):
+        if self._cdoctest is None:
+            self._cdoctest = CDocTest()
+            self._cdoctest.repl_binary = self.repl_binary
+            self._cdoctest.single_file_parse = self.single_file_parse
+            if self.preamble_cache:
+                self._cdoctest.preamble_cache = PreambleCache()
+            Shell.env['CPLUS_INCLUDE_PATH'] = os.pathsep.join(self.include_paths)
+            self._pool = ReplPool(self._cdoctest)
+        return self._cdoctest
+
+    def collect_nodes(self, path, relative_path):
+        cdoctest = self.get_cdoctest()
+        with open(path, 'r') as f:
+            tests_nodes = []
+            cdoctest.parse_result_test_node(f.read(), tests_nodes, relative_path, self.src_path)
+        return cdoctest.merge_comments(tests_nodes, None)
+
+    def run(self, node, header):
+        # the same REPL setup as run_verify: pooled REPLs, or a new one for tests needing AllocCounter
+        cdoctest = self.get_cdoctest()
+        ReplSupervisor(cdoctest, self._pool).run(node, self.libs, self.lib_dirs, header)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+
+
+def pytest_configure(config):
+    if config.getoption('cdoctest'):
+        config._cdoctest_runner = CDocTestRunner(config)
+
+
+def pytest_unconfigure(config):
+    runner = getattr(config, '_cdoctest_runner', None)
+    if runner is not None:
+        runner.close()
+
+
+def pytest_collect_file(file_path, parent):
+    runner = getattr(parent.config, '_cdoctest_runner', None)
+    if runner is None or file_path.suffix not in runner.walker.extensions:
+        return None
+    if not runner.walker.has_marker(str(file_path)):
+        return None
+    return CDocTestFile.from_parent(parent, path=file_path)
+
+
+class CDocTestFile(pytest.File):
+    def collect(self):
+        runner = self.config._cdoctest_runner
+        relative_path = os.path.relpath(str(self.path), os.getcwd())
+        file_prefix = None
+        for node in runner.collect_nodes(str(self.path), relative_path):
+            if file_prefix is None:
+                file_prefix = node.file_node.relPath + '::'
+            name = node.rel_full_path()
+            if name.startswith(file_prefix):
+                name = name[len(file_prefix):]
+            yield CDocTestItem.from_parent(self, name=name, test_node=node)
+
+
+class CDocTestFailure(Exception):
+    pass
+
+
+class CDocTestItem(pytest.Item):
+    def __init__(self, *, test_node, **kwargs):
+        super().__init__(**kwargs)
+        self.test_node = test_node
+
+    def runtest(self):
+        runner = self.config._cdoctest_runner
+        header = os.path.basename(str(self.path)).split('.')[0] + '.' + runner.header_extension
+        runner.run(self.test_node, header)
+        if not self.test_node.test.is_pass:
+            raise CDocTestFailure(self.test_node)
+
+    def repr_failure(self, excinfo):
+        if not isinstance(excinfo.value, CDocTestFailure):
+            return super().repr_failure(excinfo)
+        lines = [self.test_node.full_path() + ' failed']
+        for test in self.test_node.test.tests:
+            lines.append('>>> ' + str(test) + (' pass' if test.is_pass else ' fail'))
+            if not test.is_pass:
+                lines.append('expected: ' + repr(test.outputs))
+                lines.append('actual:   ' + repr(getattr(test, 'actual', [])))
+                if test.aborted is not None:
+                    lines.append('aborted:  ' + test.aborted)
+                if test.crashed is not None:
+                    lines.append('crashed:  ' + test.crashed)
+                    lines.extend('| ' + line for line in test.crash_output)
+                if test.directive_failure is not None:
+                    lines.append((test.directive.NAME + ':').ljust(10) + test.directive_failure)
+                lines.extend('| ' + line for line in test.diagnostics)
+                if test.output_file is not None:
+                    lines.append('full output: ' + test.output_file)
+        return '\n'.join(lines)
+
+    def reportinfo(self):
+        return self.path, self.test_node.id_token.extent.start.line - 1, 'cdoctest: ' + self.name
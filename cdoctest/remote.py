@@ -0,0 +1,308 @@
+import argparse
+import hmac
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from types import SimpleNamespace
+
+from clang_repl_kernel import Shell
+
+from .admission import MemoryAdmission
+from .c_doctest import CDocTest, CDocTestConfig, ReplSupervisor, Test, TestCase
+
+# test nodes run by 'cdoctest worker' processes on other machines. Coordinator and worker exchange one JSON
+# object per line over TCP: the coordinator sends a test case with its libraries, library directories,
+# include path and header, the worker runs it like run_verify and answers with the result of every command.
+# While a test runs the worker sends heartbeats, a worker silent for longer than LOST_SECONDS or closing its
+# connection is dropped and its test is sent to another worker. Paths are not translated, the workers need
+# the build tree at the same path, ex) on a shared file system.
+# A worker runs any code it is sent, so every connection starts with a shared token the worker checks before
+# it takes a job, and it listens on 127.0.0.1 unless --host is given. Only bind it to another address on a
+# trusted network.
+
+HEARTBEAT_SECONDS = 5
+LOST_SECONDS = 3 * HEARTBEAT_SECONDS
+# environment of the coordinator REPLs sent to the workers
+ENV_KEYS = ['CPLUS_INCLUDE_PATH', 'LD_LIBRARY_PATH']
+
+# shared token of the coordinator and its workers when --token is not given
+TOKEN_ENV = 'CDOCTEST_WORKER_TOKEN'
+# a worker which cannot be reached is tried again, without counting against the attempts of a test
+CONNECT_ATTEMPTS = 3
+CONNECT_RETRY_SECONDS = 1
+
+RESULT_KEYS = ['is_pass', 'output_result', 'aborted', 'output_file', 'crashed', 'crash_output',
+               'directive_result', 'directive_failure']
+
+
+def parse_address(address):
+    host, _, port = address.strip().rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def default_token(token=None):
+    return token if token is not None else os.environ.get(TOKEN_ENV) or None
+
+
+def _send(f, message):
+    f.write((json.dumps(message) + '\n').encode('utf-8'))
+    f.flush()
+
+
+def _receive(f):
+    line = f.readline()
+    if line == b'':
+        raise ConnectionResetError('connection closed')
+    return json.loads(line.decode('utf-8'))
+
+
+def job_message(job_id, node, local_target_lib, cdt_target_lib_dir, header, env):
+    return {'id': job_id, 'name': node.full_path(), 'tests': [[test.cmd, test.outputs] for test in node.test.tests],
+            'libs': list(local_target_lib), 'lib_dirs': list(cdt_target_lib_dir), 'header': header,
+            'env': {key: env[key] for key in ENV_KEYS if key in env}}
+
+
+def result_message(job_id, test_case):
+    tests = []
+    for test in test_case.tests:
+        result = {key: getattr(test, key) for key in RESULT_KEYS}
+        if hasattr(test, 'actual'):
+            result['actual'] = test.actual
+        tests.append(result)
+    return {'id': job_id, 'is_pass': test_case.is_pass, 'metrics': test_case.metrics, 'tests': tests}
+
+
+def apply_result(test_case, message):
+    test_case.is_pass = message['is_pass']
+    test_case.metrics = message['metrics']
+    for test, result in zip(test_case.tests, message['tests']):
+        for key in RESULT_KEYS + ['actual']:
+            if key in result:
+                setattr(test, key, result[key])
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    # one connection of a coordinator, its test cases run one after another
+    def handle(self):
+        try:
+            hello = _receive(self.rfile)
+        except (OSError, ValueError):
+            return
+        token = hello.get('token') if isinstance(hello, dict) else None
+        if not isinstance(token, str) or not hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('utf-8')):
+            try:
+                _send(self.wfile, {'error': 'bad token'})
+            except OSError:
+                pass
+            return
+        try:
+            _send(self.wfile, {'ok': True})
+        except OSError:
+            return
+        while True:
+            try:
+                message = _receive(self.rfile)
+            except (OSError, ValueError):
+                return
+            test_case = TestCase(message['name'], [Test(cmd, cmd, outputs) for cmd, outputs in message['tests']])
+            node = SimpleNamespace(test=test_case, full_path=lambda: message['name'])
+            env = dict(os.environ, **message['env'])
+            thread = threading.Thread(target=self.server.run_job, args=(node, message, env), daemon=True)
+            thread.start()
+            try:
+                while True:
+                    thread.join(HEARTBEAT_SECONDS)
+                    if not thread.is_alive():
+                        break
+                    _send(self.wfile, {'heartbeat': True})
+                _send(self.wfile, result_message(message['id'], test_case))
+            except OSError:
+                # the coordinator is gone, the test finishes on its own
+                return
+
+
+class Worker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, cdoctest, host='127.0.0.1', port=0, verbose=False, token=None):
+        self.token = default_token(token)
+        if self.token is None:
+            raise Exception('A worker needs a shared token, give --token or set ' + TOKEN_ENV + '.')
+        super().__init__((host, port), WorkerHandler)
+        self.cdoctest = cdoctest
+        self.verbose = verbose
+        self.jobs = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def run_job(self, node, message, env):
+        ReplSupervisor(self.cdoctest, env=env).run(node, message['libs'], message['lib_dirs'], message['header'])
+        with self._lock:
+            self.jobs += 1
+        if self.verbose:
+            print(node.full_path(), 'pass' if node.test.is_pass else 'fail')
+
+
+def worker_main(argv):
+    parser = argparse.ArgumentParser(prog='cdoctest worker', description='run doctests sent by a cdoctest coordinator')
+    parser.add_argument('--listen', help='TCP port to listen on', type=int, required=True)
+    parser.add_argument('--host', help='address to listen on. A worker runs any code it is sent, only listen on other addresses than 127.0.0.1 on a trusted network', default='127.0.0.1')
+    parser.add_argument('--token', help='shared token the coordinator has to send, default: $' + TOKEN_ENV)
+    parser.add_argument('-cdtmob', '--cdt_max_output_bytes', help='abort a command printing more bytes than this', type=int, default=CDocTestConfig.MAX_OUTPUT_BYTES)
+    parser.add_argument('-cdtmol', '--cdt_max_output_lines', help='abort a command printing more lines than this', type=int, default=CDocTestConfig.MAX_OUTPUT_LINES)
+    parser.add_argument('-cdtwm', '--cdt_worker_memory', help='memory in MB a REPL is expected to use until one was measured. Tests of several coordinators wait when the available memory does not hold their REPLs', type=int, default=800)
+    parser.add_argument('-v', '--verbose', help='verbose mode', default=False, action='store_true')
+    args = parser.parse_args(argv)
+    CDocTestConfig.MAX_OUTPUT_BYTES = args.cdt_max_output_bytes
+    CDocTestConfig.MAX_OUTPUT_LINES = args.cdt_max_output_lines
+    cdoctest = CDocTest()
+    cdoctest.admission = MemoryAdmission(os.cpu_count() or 1, args.cdt_worker_memory * 1024 * 1024)
+    worker = Worker(cdoctest, args.host, args.listen, args.verbose, args.token)
+    print('cdoctest worker listening on', args.host + ':' + str(worker.port))
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.server_close()
+
+
+class RemoteWorker:
+    # connection of the coordinator to one worker
+    def __init__(self, address, token=None):
+        self.address = address
+        self.token = token
+        self.lost = None
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        self._sock = socket.create_connection(parse_address(self.address), timeout=LOST_SECONDS)
+        self._file = self._sock.makefile('rwb')
+        _send(self._file, {'token': self.token})
+        reply = _receive(self._file)
+        if not reply.get('ok'):
+            raise PermissionError('worker refused the token: ' + str(reply.get('error')))
+
+    def connect(self):
+        # retried on its own, a worker which is not reached has not taken a test
+        attempt = 0
+        while self._file is None:
+            try:
+                self._connect()
+            except (OSError, ValueError) as e:
+                self.close()
+                attempt += 1
+                if attempt >= CONNECT_ATTEMPTS or isinstance(e, PermissionError):
+                    raise
+                time.sleep(CONNECT_RETRY_SECONDS)
+        return self._file
+
+    def run(self, message):
+        f = self.connect()
+        _send(f, message)
+        while True:
+            reply = _receive(f)
+            if not reply.get('heartbeat'):
+                return reply
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+
+class RemoteRunner:
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, cdoctest, addresses, verbose=False, token=None):
+        self.cdoctest = cdoctest
+        token = default_token(token)
+        self.workers = [RemoteWorker(address, token) for address in addresses]
+        self.verbose = verbose
+        self.completed = 0
+        self.reassigned = 0
+        self._condition = threading.Condition()
+        self._next_id = 0
+        self._running = 0
+
+    def _lose(self, worker, e):
+        worker.lost = str(e) or type(e).__name__
+        worker.close()
+        print('worker', worker.address, 'lost:', worker.lost)
+
+    def _work(self, worker, jobs):
+        try:
+            worker.connect()
+        except (OSError, ValueError) as e:
+            self._lose(worker, e)
+            return
+        while worker.lost is None:
+            with self._condition:
+                # a test of a lost worker may come back while others still run
+                while len(jobs) == 0 and self._running > 0:
+                    self._condition.wait()
+                if len(jobs) == 0:
+                    return
+                node, message, attempts = jobs.pop(0)
+                self._next_id += 1
+                message = dict(message, id=self._next_id)
+                self._running += 1
+            try:
+                reply = worker.run(message)
+            except (OSError, ValueError) as e:
+                self._lose(worker, e)
+                with self._condition:
+                    if attempts + 1 < self.MAX_ATTEMPTS:
+                        self.reassigned += 1
+                        jobs.append((node, message, attempts + 1))
+                    else:
+                        node.test.crash('not run, ' + str(attempts + 1) + ' workers were lost running it')
+                    self._running -= 1
+                    self._condition.notify_all()
+                return
+            apply_result(node.test, reply)
+            with self._condition:
+                self.completed += 1
+                self._running -= 1
+                self._condition.notify_all()
+            if self.verbose:
+                print(node.full_path(), 'pass' if node.test.is_pass else 'fail', 'on', worker.address)
+
+    def run(self, local_target_lib, cdt_target_lib_dir, merged_node, name=None, header_extension='.h'):
+        if isinstance(local_target_lib, str):
+            local_target_lib = [local_target_lib]
+        header = None if name is None else name + '.' + header_extension
+        jobs = []
+        for node in merged_node:
+            if node.test.reused is not None:
+                continue
+            missing = self.cdoctest.missing_exports(node)
+            if len(missing) > 0:
+                node.test.crash('not run, no library exports ' + ', '.join(missing))
+                continue
+            jobs.append((node, job_message(None, node, local_target_lib, cdt_target_lib_dir, header, Shell.env), 0))
+        threads = [threading.Thread(target=self._work, args=(worker, jobs))
+                   for worker in self.workers if worker.lost is None]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for node, _, _ in jobs:
+            node.test.crash('not run, no worker left')
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from clang_repl_kernel import Shell
+
+
+class ReplPool:
+    # started REPLs with the libraries and standard headers loaded, keyed by library set. The REPL of the
+    # next test is prepared in the background while the current one runs. A REPL still runs one test only,
+    # doctests of different tests would clash in one REPL.
+    # Shell.env is read when a REPL starts, so per test environment (ex. LLVM_PROFILE_FILE) can not be used.
+    # With a MemoryAdmission a REPL is only prepared when there is memory for it next to the running test.
+    def __init__(self, cdoctest):
+        self.cdoctest = cdoctest
+        self._lock = threading.Lock()
+        self._warm = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _start(self, libs, lib_dirs, wait=True):
+        # None without wait when the admission has no slot for it
+        shell = self.cdoctest.new_shell(wait=wait)
+        if shell is None:
+            return None
+        try:
+            self.cdoctest.load_libs(libs, lib_dirs, shell)
+        except BaseException:
+            self.cdoctest.stop_shell(shell)
+            raise
+        return shell
+
+    def _stop(self, future):
+        try:
+            self.cdoctest.stop_shell(future.result())
+        except Exception:
+            pass
+
+    @staticmethod
+    def _key(libs, lib_dirs):
+        return tuple(libs), tuple(lib_dirs), Shell.env.get('CPLUS_INCLUDE_PATH')
+
+    def warm(self, libs, lib_dirs):
+        # starts a REPL of the library set in the background unless one is ready, ex) while tests are discovered
+        libs = list(libs)
+        lib_dirs = list(lib_dirs)
+        key = self._key(libs, lib_dirs)
+        with self._lock:
+            if key not in self._warm:
+                self._warm[key] = self._executor.submit(self._start, libs, lib_dirs, False)
+
+    def take_shell(self, libs, lib_dirs):
+        libs = list(libs)
+        lib_dirs = list(lib_dirs)
+        key = self._key(libs, lib_dirs)
+        with self._lock:
+            future = self._warm.pop(key, None)
+            # libraries are tested one set after another, REPLs of other sets are not used again
+            others = list(self._warm.values())
+            self._warm.clear()
+        for other in others:
+            self._executor.submit(self._stop, other)
+        shell = None if future is None else future.result()
+        if shell is None:
+            shell = self._start(libs, lib_dirs)
+        # the next REPL is prepared once this one holds its admission slot
+        with self._lock:
+            if key not in self._warm:
+                self._warm[key] = self._executor.submit(self._start, libs, lib_dirs, False)
+        return shell
+
+    def clear(self):
+        # stops the prepared REPLs, ex) when another REPL waits for their memory
+        with self._lock:
+            warm = list(self._warm.values())
+            self._warm.clear()
+        for future in warm:
+            self._stop(future)
+
+    def close(self):
+        self.clear()
+        self._executor.shutdown()
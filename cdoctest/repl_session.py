@@ -0,0 +1,188 @@
+import asyncio
+import os
+
+from clang_repl_kernel import ClangReplConfig, Shell, WinShell, BashShell
+from clang_repl_kernel.kernel import workarounds
+
+
+class ReplSessionError(Exception):
+    def __init__(self, message, returncode=None, output=''):
+        super().__init__(message)
+        self.returncode = returncode
+        self.output = output
+
+
+class AsyncReplSession:
+    # asyncio driver of one clang-repl process, same prompt protocol as clang_repl_kernel.Shell
+    # but without blocking the thread, so one event loop can drive many sessions.
+    #   async with AsyncReplSession() as session:
+    #       await session.execute('%lib sample.so')
+    #       output = await session.execute('%<< fac(5);', print)
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, program=None, args=None, env=None, banner_name=ClangReplConfig.BANNER_NAME, init=True):
+        self.program = program
+        self.args = [] if args is None else list(args)
+        self.env = env
+        self.banner = (banner_name + '> ').encode('utf-8')
+        self.banner_cont = (banner_name + '...   ').encode('utf-8')
+        self.init = init
+        self.process = None
+        self._buffer = b''
+        self._lock = None
+
+    @property
+    def pid(self):
+        return None if self.process is None else self.process.pid
+
+    @property
+    def returncode(self):
+        return None if self.process is None else self.process.returncode
+
+    def _resolve_program(self):
+        shell = WinShell(None) if os.name == 'nt' else BashShell(None)
+        program, _ = shell.prog()
+        return program
+
+    def _env(self):
+        env = dict(Shell.env if self.env is None else self.env)
+        # same PATH handling as Shell._run
+        program_path = os.path.abspath(str(os.path.dirname(self.program)) + os.pathsep + os.getcwd() + os.pathsep)
+        if env.get('PATH') is not None and not env['PATH'].startswith(program_path):
+            env['PATH'] = program_path + env['PATH']
+        return env
+
+    async def start(self):
+        self._lock = asyncio.Lock()
+        if self.program is None:
+            self.program = self._resolve_program()
+        env = self._env()
+        self.process = await asyncio.create_subprocess_exec(
+            self.program, *self.args,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            env=env)
+        await self._read_until_prompt(None)
+        if self.init:
+            await self._init_repl()
+        return self
+
+    async def _init_repl(self):
+        for dylib in ClangReplConfig.DLIB:
+            await self.execute('%lib ' + dylib)
+        for header in ClangReplConfig.HEADERS:
+            await self.execute('#include <' + header + '>')
+        accumulated_line = ''
+        for line in workarounds[ClangReplConfig.PLATFORM_NAME_ENUM.value].splitlines():
+            if line.endswith('\\'):
+                accumulated_line += line[:-1]
+                continue
+            accumulated_line += line
+            await self.execute(accumulated_line)
+            accumulated_line = ''
+
+    async def _fill(self):
+        data = await self.process.stdout.read(self.READ_SIZE)
+        if len(data) == 0:
+            output = self._buffer.decode('utf-8', errors='replace')
+            self._buffer = b''
+            returncode = await self.process.wait()
+            raise ReplSessionError('clang-repl exited with ' + str(returncode), returncode, output)
+        self._buffer += data
+
+    async def _read_until_prompt(self, send, allow_cont=False):
+        # emits complete lines as they arrive, returns the prompt which ended the output
+        while True:
+            while b'\n' in self._buffer:
+                line, self._buffer = self._buffer.split(b'\n', 1)
+                if send is not None:
+                    send(line.rstrip(b'\r').decode('utf-8', errors='replace'))
+            for prompt in ([self.banner, self.banner_cont] if allow_cont else [self.banner]):
+                if self._buffer.endswith(prompt):
+                    rest = self._buffer[:-len(prompt)]
+                    self._buffer = b''
+                    if len(rest) > 0 and send is not None:
+                        send(rest.decode('utf-8', errors='replace'))
+                    return prompt
+            await self._fill()
+
+    async def execute(self, command, send=None):
+        # send(line) is called for every output line while the command runs; the whole output is returned
+        if self.process is None:
+            raise ReplSessionError('session is not started')
+        lines = [line for line in command.splitlines() if len(line) > 0]
+        if len(lines) == 0:
+            return ''
+        output = []
+
+        def collect(line):
+            output.append(line)
+            if send is not None:
+                send(line)
+
+        async with self._lock:
+            for line in lines[:-1]:
+                if not line.strip().startswith('#') and not line.rstrip().endswith('\\'):
+                    line = line.rstrip() + '\\'
+                await self._write(line)
+                await self._read_until_prompt(collect, True)
+            last = lines[-1]
+            if last.rstrip().endswith('\\'):
+                last = last.rstrip()[:-1]
+            await self._write(last)
+            await self._read_until_prompt(collect)
+        return '\n'.join(output)
+
+    async def stream(self, command):
+        # async iterator over the output lines of a command
+        queue = asyncio.Queue()
+        done = object()
+
+        async def run():
+            try:
+                await self.execute(command, queue.put_nowait)
+            finally:
+                queue.put_nowait(done)
+
+        task = asyncio.ensure_future(run())
+        try:
+            while True:
+                line = await queue.get()
+                if line is done:
+                    break
+                yield line
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _write(self, line):
+        try:
+            self.process.stdin.write((line + '\n').encode('utf-8'))
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            returncode = await self.process.wait()
+            raise ReplSessionError('clang-repl pipe is closed: ' + str(e), returncode)
+
+    async def close(self, timeout=10):
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+
+from clang_repl_kernel import Shell, WinShell, BashShell
+
+from .fingerprint import file_digest
+
+
+def default_cache_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'cdoctest', 'results')
+
+
+def repl_version():
+    shell = WinShell(None) if os.name == 'nt' else BashShell(None)
+    try:
+        program, _ = shell.prog()
+        out = subprocess.run([program, '--version'], capture_output=True, timeout=60).stdout
+        return program + '\n' + out.decode('utf-8', errors='replace')
+    except Exception:
+        return 'unknown'
+
+
+INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]', re.MULTILINE)
+
+
+def include_dirs():
+    # the directories the REPL searches for an include, as it runs in the working directory
+    dirs = [os.getcwd()]
+    for key in ['CPLUS_INCLUDE_PATH', 'CPATH']:
+        dirs += [path for path in (Shell.env.get(key) or '').split(os.pathsep) if path != '']
+    return dirs
+
+
+def find_include(name, dirs):
+    for path in dirs:
+        file = os.path.join(path, name)
+        if os.path.isfile(file):
+            return os.path.realpath(file)
+    return None
+
+
+def included_files(files, dirs):
+    # the files and every header they include, transitively. '#include "..."' is searched next to the
+    # including file first. Includes not found in dirs (system headers) are left to the REPL version.
+    found = set()
+    pending = [os.path.realpath(file) for file in files if file is not None]
+    while pending:
+        file = pending.pop()
+        if file in found:
+            continue
+        found.add(file)
+        try:
+            with open(file, 'r', errors='replace') as f:
+                text = f.read()
+        except OSError:
+            continue
+        for quote, name in INCLUDE_PATTERN.findall(text):
+            header = find_include(name, ([os.path.dirname(file)] if quote == '"' else []) + dirs)
+            if header is not None and header not in found:
+                pending.append(header)
+    return sorted(found)
+
+
+class ResultCache:
+    # content addressed cache of passing doctest results. The key covers the test commands and expected
+    # outputs, the tested file with every header it includes, the include and library search paths, every
+    # loaded library and the clang-repl version. Headers reached only through macros or system include
+    # directories are not followed. Entries are evicted least recently used first.
+    VERSION = 2
+    REUSED = 'cached'
+    ENV_KEYS = ['CPLUS_INCLUDE_PATH', 'CPATH', 'LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH']
+
+    def __init__(self, cache_dir=None, max_bytes=64 * 1024 * 1024, libs=None, version=None):
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self.max_bytes = max_bytes
+        self._libs = [lib for lib in libs or [] if lib is not None]
+        self._version = version
+        self._base_digest = None
+        self._keys = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def base_digest(self):
+        if self._base_digest is None:
+            digest = hashlib.sha256()
+            digest.update(str(self.VERSION).encode('utf-8'))
+            digest.update((repl_version() if self._version is None else self._version).encode('utf-8'))
+            for lib in sorted(self._libs):
+                digest.update(b'\0' + os.path.basename(lib).encode('utf-8') + b'\0')
+                digest.update(file_digest(lib).encode('utf-8') if os.path.isfile(lib) else b'missing')
+            self._base_digest = digest.hexdigest()
+        return self._base_digest
+
+    def key(self, node, files_digest):
+        digest = hashlib.sha256()
+        digest.update(self.base_digest().encode('utf-8'))
+        digest.update(files_digest.encode('utf-8'))
+        digest.update(node.rel_full_path().encode('utf-8'))
+        for test in node.test.tests:
+            digest.update(b'\1' + test.cmd.encode('utf-8'))
+            for output in test.outputs:
+                digest.update(b'\2' + output.encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def tested_files(target_file, header):
+        # the target file and the header the REPL includes for it, with their includes
+        dirs = include_dirs()
+        return included_files([target_file, None if header is None else find_include(header, dirs)], dirs)
+
+    @classmethod
+    def files_digest(cls, files):
+        digest = hashlib.sha256()
+        for key in cls.ENV_KEYS:
+            digest.update(b'\0' + key.encode('utf-8') + b'=' + (Shell.env.get(key) or '').encode('utf-8'))
+        for file in files:
+            digest.update(b'\0' + os.path.basename(file).encode('utf-8') + b'\0')
+            digest.update(file_digest(file).encode('utf-8') if os.path.isfile(file) else b'missing')
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def apply(self, nodes, files):
+        # marks every node with a cached pass as reused, 'files' are the tested files, see tested_files()
+        files_digest = self.files_digest(files)
+        for node in nodes:
+            if node.test.reused is not None:
+                continue
+            key = self.key(node, files_digest)
+            self._keys[id(node)] = key
+            path = self._entry_path(key)
+            try:
+                with open(path, 'r') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self.misses += 1
+                continue
+            if len(entry.get('tests', [])) != len(node.test.tests):
+                self.misses += 1
+                continue
+            node.test.reuse(self.REUSED)
+            for test, cached in zip(node.test.tests, entry['tests']):
+                test.actual = cached['actual']
+                test.output_result = [True] * len(test.outputs)
+            os.utime(path)  # mtime is the LRU clock
+            self.hits += 1
+
+    def update(self, nodes):
+        for node in nodes:
+            key = self._keys.pop(id(node), None)
+            if key is None or node.test.reused is not None or not node.test.is_pass:
+                continue
+            path = self._entry_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'test': node.rel_full_path(),
+                           'tests': [{'cmd': test.cmd, 'actual': list(test.outputs)} for test in node.test.tests]}, f)
+            os.replace(tmp_path, path)
+
+    def prune(self):
+        entries = []
+        total = 0
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,86 @@
+import copy
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from .admission import MemoryAdmission
+from .c_doctest import ReplSupervisor
+
+# runs every test node 'repeat' times on up to 'concurrent' REPL workers, as many as MemoryAdmission lets
+# start, to find flaky tests and noisy timings.
+# Every run gets a copy of the TestCase, the node keeps a failing run if there is one, else the last run,
+# with the pass count and the wall time distribution added to its metrics.
+
+
+def percentile(values, q):
+    # nearest rank percentile of sorted values
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+class StressRunner:
+    def __init__(self, cdoctest, repeat=1, concurrent=1, admission=None):
+        self.cdoctest = cdoctest
+        self.repeat = repeat
+        self.concurrent = concurrent
+        if admission is None:
+            admission = cdoctest.admission if cdoctest.admission is not None else MemoryAdmission(concurrent)
+        # the REPL of every run takes its slot in CDocTest.new_shell
+        self.admission = cdoctest.admission = admission
+        self.crashes = 0
+        self._local = threading.local()
+
+    def _supervisor(self):
+        # one supervisor per worker thread, its REPL setup crash count is per worker
+        supervisor = getattr(self._local, 'supervisor', None)
+        if supervisor is None:
+            supervisor = self._local.supervisor = ReplSupervisor(self.cdoctest)
+        return supervisor
+
+    def _run_once(self, node, local_target_lib, cdt_target_lib_dir, header):
+        run = SimpleNamespace(test=copy.deepcopy(node.test), full_path=node.full_path, id_token=getattr(node, 'id_token', None))
+        run.test.reset()
+        supervisor = self._supervisor()
+        crashes = supervisor.crashes
+        supervisor.run(run, local_target_lib, cdt_target_lib_dir, header)
+        return run.test, supervisor.crashes - crashes
+
+    def run(self, local_target_lib, cdt_target_lib_dir, merged_node, name=None, header_extension='.h'):
+        if isinstance(local_target_lib, str):
+            local_target_lib = [local_target_lib]
+        header = None if name is None else name + '.' + header_extension
+        nodes = [node for node in merged_node if node.test.reused is None]
+        jobs = [(node, i) for node in nodes for i in range(self.repeat)]
+        with ThreadPoolExecutor(max_workers=self.concurrent) as executor:
+            results = list(executor.map(lambda job: self._run_once(job[0], local_target_lib, cdt_target_lib_dir, header),
+                                        jobs))
+        runs = {}
+        for (node, _), (test_case, crashes) in zip(jobs, results):
+            runs.setdefault(id(node), []).append(test_case)
+            self.crashes += crashes
+        for node in nodes:
+            test_cases = runs[id(node)]
+            kept = next((test_case for test_case in test_cases if not test_case.is_pass), test_cases[-1])
+            walls = sorted(test_case.metrics['wall'] for test_case in test_cases if 'wall' in test_case.metrics)
+            metrics = dict(kept.metrics, runs=len(test_cases),
+                           passes=len([test_case for test_case in test_cases if test_case.is_pass]))
+            if len(walls) > 0:
+                metrics.update(wall_p50=percentile(walls, 0.5), wall_p95=percentile(walls, 0.95), wall_max=walls[-1])
+            kept.metrics = metrics
+            node.test = kept
+
+
+def stress_table(nodes):
+    # pass rate and wall time distribution of the nodes run several times, flaky ones first, as lines
+    nodes = list({id(node): node for node in nodes if 'runs' in node.test.metrics}.values())
+    if len(nodes) == 0:
+        return []
+    nodes.sort(key=lambda node: (node.test.metrics['passes'] / node.test.metrics['runs'],
+                                 -node.test.metrics.get('wall_p95', 0)))
+    lines = ['%10s %10s %10s %10s  %s' % ('passed', 'p50 s', 'p95 s', 'max s', 'test')]
+    for node in nodes:
+        metrics = node.test.metrics
+        times = ['%.3f' % metrics[key] if key in metrics else '-' for key in ['wall_p50', 'wall_p95', 'wall_max']]
+        lines.append('%10s %10s %10s %10s  %s' % tuple([str(metrics['passes']) + '/' + str(metrics['runs'])] + times
+                                                       + [node.full_path()]))
+    return lines
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from cdoctest import CDocTest, ReplPool
+from cdoctest import c_doctest
+from cdoctest.admission import MemoryAdmission, cgroup_available
+from cdoctest.allocs import AllocCounter
+import pytest
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+MB = 1024 * 1024
+
+
+def test_capacity_follows_memory():
+    available = [3000 * MB]
+    admission = MemoryAdmission(8, worker_bytes=800 * MB, reserve_bytes=500 * MB, available=lambda: available[0])
+    assert admission.capacity() == 3
+    admission.acquire()
+    # the running worker already took memory, it still counts as one of the three
+    available[0] = 2200 * MB
+    assert admission.capacity() == 3
+    # a measured worker makes the estimate
+    admission.release(300 * MB)
+    available[0] = 3000 * MB
+    assert admission.capacity() == 8
+    # memory taken by something else while workers run
+    admission.acquire()
+    available[0] = 1000 * MB
+    assert admission.capacity() == 2
+    available[0] = 100 * MB
+    assert admission.capacity() == 1
+
+
+def test_tests_wait_for_memory():
+    admission = MemoryAdmission(4, worker_bytes=1000 * MB, reserve_bytes=0, available=lambda: 2500 * MB)
+    admission.WAIT_SECONDS = 0.01
+    running = []
+    most = []
+
+    def worker():
+        admission.acquire()
+        running.append(1)
+        most.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+        admission.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(most) == 2 and admission.effective == 2 and admission.waits > 0
+
+
+def test_cgroup(tmp_path):
+    assert cgroup_available(str(tmp_path)) is None
+    (tmp_path / 'memory.max').write_text('max\n')
+    (tmp_path / 'memory.current').write_text('100\n')
+    assert cgroup_available(str(tmp_path)) is None
+    (tmp_path / 'memory.max').write_text('1000\n')
+    assert cgroup_available(str(tmp_path)) == 900
+
+
+def test_acquire_without_wait():
+    admission = MemoryAdmission(1, worker_bytes=100 * MB, reserve_bytes=0, available=lambda: 1000 * MB)
+    assert admission.acquire(wait=False)
+    assert not admission.acquire(wait=False)
+    admission.release()
+    assert admission.acquire(wait=False) and admission.running == 1
+
+
+
+@pytest.mark.parametrize('slots', [1, 2])
+def test_run_verify_admits_every_repl(slots):
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    cdoctest.admission = MemoryAdmission(slots, worker_bytes=100 * MB, reserve_bytes=0, available=lambda: slots * 100 * MB)
+    nodes = []
+    for i in range(4):
+        test_case = c_doctest.TestCase('case' + str(i), [])
+        test_case.init(['>>> echo ' + str(i), str(i)])
+        nodes.append(SimpleNamespace(test=test_case, full_path=lambda: 'case'))
+    if AllocCounter.library() is not None:
+        # started next to the pool, which may hold the only slot
+        nodes[2].test.init(['>>> %allocs f() == 0'])
+    pool = ReplPool(cdoctest)
+    try:
+        cdoctest.run_verify([], [], [], nodes, pool=pool)
+    finally:
+        pool.close()
+    assert all(n.test.tests[0].is_pass for n in nodes if n is not nodes[2])
+    # the REPL prepared by the pool counts as a worker
+    assert cdoctest.admission.effective == slots and cdoctest.admission.running == 0
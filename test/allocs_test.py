@@ -0,0 +1,101 @@
+import asyncio
+import os
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+from cdoctest import CDocTest
+from cdoctest import c_doctest
+from cdoctest.allocs import AllocCounter, AllocsDirective
+import pytest
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+needs_counter = pytest.mark.skipif(AllocCounter.library() is None, reason=str(AllocCounter.error()))
+
+program = '''
+#include <cstdio>
+#include <string>
+#include <vector>
+extern "C" long long cdoctest_alloc_count();
+extern "C" long long cdoctest_alloc_bytes();
+int main() {
+    long long count = cdoctest_alloc_count(), bytes = cdoctest_alloc_bytes();
+    int *one = new int(1);
+    std::vector<int> ten(10);
+    std::printf("%lld %lld\\n", cdoctest_alloc_count() - count, cdoctest_alloc_bytes() - bytes);
+    delete one;
+    return 0;
+}
+'''
+
+
+def test_parse():
+    assert AllocsDirective.parse('%bench f()') is None
+    allocs = AllocsDirective.parse('%allocs parse(buf) == 0')
+    assert allocs.expr == 'parse(buf)' and allocs.op == '==' and allocs.limit == 0
+    allocs = AllocsDirective.parse('%allocs v.push_back(1);')
+    assert allocs.expr == 'v.push_back(1)' and allocs.limit is None
+
+
+def test_expectation():
+    test = c_doctest.Test('%allocs f() == 0', '%allocs f() == 0', [])
+    test.verify(['cdoctest_allocs 0 0'])
+    assert test.is_pass and test.directive_result == {'allocs': 0, 'bytes': 0, 'limit': 0}
+    test = c_doctest.Test('%allocs f() <= 1', '%allocs f() <= 1', [])
+    test.verify(['cdoctest_allocs 2 48'])
+    assert not test.is_pass and test.directive_failure == '2 allocations is not <= 1'
+
+
+@needs_counter
+@pytest.mark.skipif(shutil.which('g++') is None, reason='needs g++')
+def test_counter_counts_new(tmp_path):
+    (tmp_path / 'main.cpp').write_text(program)
+    subprocess.run(['g++', '-o', str(tmp_path / 'main'), str(tmp_path / 'main.cpp'), AllocCounter.library()], check=True)
+    output = subprocess.run([str(tmp_path / 'main')], stdout=subprocess.PIPE, universal_newlines=True, check=True,
+                            env=AllocCounter.preload(os.environ)).stdout
+    assert output.split() == ['2', str(4 + 10 * 4)]
+
+
+@needs_counter
+@pytest.mark.skipif(shutil.which('g++') is None, reason='needs g++')
+def test_source_counts(tmp_path):
+    # the C++ sent to the REPL, compiled as a global of a program run with the counter preloaded
+    test = c_doctest.Test('%allocs new int[250] == 0', '%allocs new int[250] == 0', [])
+    (tmp_path / 'allocs.cpp').write_text('#include <cstdio>\n' + '\n'.join(test.directive.commands())
+                                         + '\nint main() { return 0; }\n')
+    subprocess.run(['g++', '-std=c++20', '-o', str(tmp_path / 'allocs'), str(tmp_path / 'allocs.cpp'),
+                    AllocCounter.library()], check=True)
+    output = subprocess.run([str(tmp_path / 'allocs')], stdout=subprocess.PIPE, universal_newlines=True, check=True,
+                            env=AllocCounter.preload(os.environ)).stdout
+    test.verify(output.splitlines())
+    assert test.directive_result == {'allocs': 1, 'bytes': 1000, 'limit': 0}
+    assert not test.is_pass and test.directive_failure == '1 allocations is not == 0'
+
+
+@needs_counter
+def test_run_preloads_counter():
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    test_case = c_doctest.TestCase('case', [])
+    test_case.init(['>>> env LD_PRELOAD', AllocCounter.library(), '>>> %allocs f() == 0'])
+    plain = c_doctest.TestCase('plain', [])
+    plain.init(['>>> env LD_PRELOAD'])
+    nodes = [SimpleNamespace(test=test_case, full_path=lambda: 'case'), SimpleNamespace(test=plain, full_path=lambda: 'plain')]
+    cdoctest.run_verify([], [], [], nodes)
+    assert test_case.tests[0].is_pass and plain.is_pass
+    # the REPL does not run C++, see test_source_counts
+    assert test_case.tests[1].directive_failure.startswith('nothing counted')
+
+
+@needs_counter
+def test_async_run_preloads_counter():
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    test_case = c_doctest.TestCase('case', [])
+    test_case.init(['>>> env LD_PRELOAD', AllocCounter.library(), '>>> %allocs f() == 0'])
+    plain = c_doctest.TestCase('plain', [])
+    plain.init(['>>> env LD_PRELOAD', ''])
+    nodes = [SimpleNamespace(test=test_case, full_path=lambda: 'case'), SimpleNamespace(test=plain, full_path=lambda: 'plain')]
+    asyncio.run(cdoctest.run_verify_async([], [], [], nodes))
+    assert test_case.tests[0].is_pass and plain.is_pass
@@ -0,0 +1,107 @@
+import shutil
+from types import SimpleNamespace
+
+from clang_repl_kernel import Shell
+
+from cdoctest import CDocTest, AotRunner
+from cdoctest import c_doctest
+from cdoctest.aot import statement
+import pytest
+
+
+def node(lines, name='case'):
+    test_case = c_doctest.TestCase(name, [])
+    test_case.init(lines)
+    return SimpleNamespace(test=test_case, full_path=lambda: name)
+
+
+def test_statement():
+    assert statement('%<< fac(5);') == 'std::cout << (fac(5)) << std::endl;'
+    assert statement('test::Fac fac;') == 'test::Fac fac;'
+    assert statement('for (int i = 0; i < 2; ++i) { f(i); }') == 'for (int i = 0; i < 2; ++i) { f(i); }'
+    # REPL only
+    assert statement('#include <vector>') is None
+    assert statement('%lib sample.so') is None
+    assert statement('int twice(int n) { return n * 2; }') is None
+    assert statement('template <class T> T id(T t) { return t; }') is None
+    assert statement('1 + 1') is None
+    # name of the test
+    assert statement('//fac') == '//fac'
+
+
+def test_apply_maps_output_and_crash():
+    nodes = [node(['>>> int x = 2;', '>>> %<< x * 3;', '6']), node(['>>> crash();', '>>> %<< 1;', '1'])]
+    table = [(0, nodes[0]), (3, nodes[1])]
+    output = '\n\x1ecdoctest 0 0\n\n\x1ecdoctest 0 1\n6\n\n\x1ecdoctest 3 0\nlast words\n'
+    assert AotRunner.apply(table, 0, output, -11) == 2
+    assert nodes[0].test.is_pass
+    crashed, rest = nodes[1].test.tests
+    assert crashed.crashed == 'killed by signal 11 (SIGSEGV)' and crashed.crash_output == ['last words']
+    assert rest.aborted == 'not run, test binary killed by signal 11 (SIGSEGV)' and not nodes[1].test.is_pass
+
+
+def test_apply_maps_test_process_exit():
+    nodes = [node(['>>> crash();', '>>> %<< 1;', '1']), node(['>>> %<< 2;', '2'])]
+    table = [(0, nodes[0]), (1, nodes[1])]
+    output = '\n\x1ecdoctest 0 0\nlast words\n\x1ecdoctest_exit 0 -11\n\n\x1ecdoctest 1 0\n2\n\n\x1ecdoctest -1 0\n'
+    assert AotRunner.apply(table, 0, output, 0) == 2
+    crashed, rest = nodes[0].test.tests
+    assert crashed.crashed == 'killed by signal 11 (SIGSEGV)' and crashed.crash_output == ['last words']
+    assert rest.aborted == 'not run, test process killed by signal 11 (SIGSEGV)' and not nodes[0].test.is_pass
+    assert nodes[1].test.is_pass
+
+
+@pytest.mark.skipif(shutil.which('g++') is None and shutil.which('clang++') is None, reason='needs a C++ compiler')
+def test_run(tmp_path):
+    nodes = [node(['>>> int x = 2;', '>>> %<< x * 3;', '6'], 'pass'),
+             node(['>>> int *p = nullptr;', '>>> *p = 1;', '>>> %<< 1;', '1'], 'crash'),
+             node(['>>> std::printf("%d\\n", 7);', '8'], 'fail'),
+             node(['>>> #include <vector>'], 'repl'),
+             node(['>>> undeclared();'], 'broken')]
+    runner = AotRunner(CDocTest(), str(tmp_path))
+    runner.run([], [], [(nodes, None)])
+    assert [n.full_path() for n in runner.compiled] == ['pass', 'crash', 'fail']
+    assert [n.full_path() for n in runner.fallback] == ['repl', 'broken']
+    assert nodes[0].test.is_pass
+    assert nodes[1].test.tests[1].crashed is not None and not nodes[1].test.is_pass
+    assert not nodes[2].test.is_pass and nodes[2].test.tests[0].actual == ['7']
+    assert nodes[3].test.is_pass is None
+
+
+@pytest.mark.skipif(shutil.which('g++') is None and shutil.which('clang++') is None, reason='needs a C++ compiler')
+def test_run_isolates_tests(tmp_path, monkeypatch):
+    (tmp_path / 'counter.h').write_text('#pragma once\ninline int counter = 0;\n')
+    monkeypatch.setitem(Shell.env, 'CPLUS_INCLUDE_PATH', str(tmp_path))
+    # global state of a test is not seen by the next one
+    nodes = [node(['>>> //first', '>>> %<< ++counter;', '1'], 'first'),
+             node(['>>> %<< ++counter;', '1'], 'second'),
+             node(['>>> std::exit(3);'], 'exits'),
+             node(['>>> %<< ++counter;', '1'], 'after')]
+    runner = AotRunner(CDocTest(), str(tmp_path / 'work'))
+    runner.run([], [], [(nodes, 'counter.h')])
+    assert runner.compiled == nodes
+    assert nodes[0].test.is_pass and nodes[1].test.is_pass and nodes[3].test.is_pass
+    assert nodes[2].test.tests[0].crashed == 'exited with code 3'
+
+
+@pytest.mark.skipif(shutil.which('g++') is None and shutil.which('clang++') is None, reason='needs a C++ compiler')
+def test_run_compiles_like_the_repl(tmp_path, monkeypatch):
+    include_dir = tmp_path / 'include'
+    include_dir.mkdir()
+    (include_dir / 'twice.h').write_text('#pragma once\ninline int twice(int n) { return n * 2; }\n')
+    monkeypatch.setitem(Shell.env, 'CPLUS_INCLUDE_PATH', str(include_dir))
+    # C++20 and the tested header from the include path
+    nodes = [node(['>>> %<< (std::string("abc").starts_with("ab") ? twice(2) : 0);', '4'])]
+    runner = AotRunner(CDocTest(), str(tmp_path / 'work'))
+    runner.run([], [], [(nodes, 'twice.h')])
+    assert runner.compiled == nodes and nodes[0].test.is_pass
+
+
+@pytest.mark.skipif(shutil.which('g++') is None and shutil.which('clang++') is None, reason='needs a C++ compiler')
+def test_link_failure_is_reported(tmp_path, capsys):
+    nodes = [node(['>>> int x = 1;'], 'linked'), node(['>>> int undefined_function();', '>>> undefined_function();'], 'used')]
+    runner = AotRunner(CDocTest(), str(tmp_path))
+    runner.run([], [], [(nodes, None)])
+    assert runner.compiled == [] and runner.fallback == nodes
+    assert runner.not_compiled == 0 and runner.not_linked == 2
+    assert 'aot: linking failed, running 2 compiled tests in the REPL' in capsys.readouterr().out
@@ -0,0 +1,73 @@
+import os
+import shutil
+import subprocess
+
+from cdoctest import CDocTest
+from cdoctest import c_doctest
+from cdoctest.bench import BenchDirective
+import pytest
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+COMPILER = next((shutil.which(cxx) for cxx in ['clang++', 'g++'] if shutil.which(cxx) is not None), None)
+
+
+def test_parse():
+    assert BenchDirective.parse('fac(20)') is None
+    bench = BenchDirective.parse('%bench fac(20);')
+    assert bench.expr == 'fac(20)' and bench.limit_ns is None
+    bench = BenchDirective.parse('%bench fac(20) < 50ns')
+    assert bench.expr == 'fac(20)' and bench.op == '<' and bench.limit_ns == 50
+    bench = BenchDirective.parse('%bench a < b ? f(1) : f(2) <= 1.5us')
+    assert bench.expr == 'a < b ? f(1) : f(2)' and bench.op == '<=' and bench.limit_ns == 1500
+    with pytest.raises(AssertionError):
+        BenchDirective.parse('%bench')
+
+
+def test_threshold():
+    test = c_doctest.Test('%bench fac(20) < 11.5ns', '%bench fac(20) < 11.5ns', [])
+    test.verify(['cdoctest_bench 64 10.0 12.0 11.0'])
+    assert test.is_pass
+    assert test.directive_result['median_ns'] == 11.0 and test.directive_result['min_ns'] == 10.0
+    assert test.directive_result['iterations'] == 64 and test.directive_result['samples'] == 3
+    test = c_doctest.Test('%bench fac(20) < 10ns', '%bench fac(20) < 10ns', [])
+    test.verify(['cdoctest_bench 64 10.0 12.0 11.0'])
+    assert not test.is_pass and test.directive_failure == 'median 11.0ns is not < 10.0ns'
+    test = c_doctest.Test('%bench fac(20)', '%bench fac(20)', [])
+    test.verify(['error: use of undeclared identifier'])
+    assert not test.is_pass and test.directive_failure == 'nothing measured'
+
+
+@pytest.mark.skipif(COMPILER is None, reason='needs a C++ compiler')
+def test_source_measures(tmp_path):
+    # the C++ sent to the REPL, compiled as a global of a program
+    test = c_doctest.Test('%bench fac(20) < 1s', '%bench fac(20) < 1s', [])
+    test.directive.SAMPLE_NS = 100 * 1000
+    test.directive.SAMPLES = 3
+    (tmp_path / 'bench.cpp').write_text('#include <cstdio>\n'
+                                        'long long fac(int n) { return n <= 1 ? 1 : n * fac(n - 1); }\n'
+                                        + '\n'.join(test.directive.commands()) + '\nint main() { return 0; }\n')
+    subprocess.run([COMPILER, '-std=c++20', '-o', str(tmp_path / 'bench'), str(tmp_path / 'bench.cpp')], check=True)
+    output = subprocess.run([str(tmp_path / 'bench')], stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True).stdout
+    test.verify(output.splitlines())
+    result = test.directive_result
+    assert test.is_pass and result['samples'] == 3 and result['iterations'] >= 1
+    assert 0 < result['min_ns'] <= result['median_ns'] < 1e9
+
+
+def test_run():
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    test_case = c_doctest.TestCase('case', [])
+    test_case.init(['>>> echo 1', '1', '>>> %bench fac(20) < 20ns', '>>> echo 2', '2'])
+    shell = cdoctest.new_shell()
+    try:
+        test_case.run(shell)
+    finally:
+        cdoctest.stop_shell(shell)
+    # the REPL does not run C++, the measurement is missing
+    bench = test_case.tests[1]
+    assert test_case.tests[0].is_pass and test_case.tests[2].is_pass
+    assert not bench.is_pass and bench.directive_failure == 'nothing measured'
+    test_case.reset()
+    assert bench.directive_result is None and bench.directive.samples == []
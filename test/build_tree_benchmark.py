@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import time
+
+from cdoctest import CDocTest
+from cdoctest.c_doctest import Node
+
+# compares cursor tree construction over the whole translation unit with the main file only one
+#   python test/build_tree_benchmark.py [source file]
+
+sample = '''
+#include "bench_decls.h"
+namespace test {
+/**
+>>> fac(5)
+120
+*/
+int fac(int n);
+class Fac {
+public:
+    /**
+    >>> Fac().fac(5)
+    120
+    */
+    int fac(int n);
+};
+}
+'''
+
+
+def write_decls(path, count):
+    # stands in for a large included header, std headers are parsed the same way
+    with open(path, 'w') as f:
+        f.write('#pragma once\n')
+        for i in range(count):
+            f.write('namespace ns%d { struct S%d { int m(int); }; int f%d(int); }\n' % (i, i, i))
+
+
+def count(node):
+    return 1 + sum(count(child) for child in node.children)
+
+
+def bench(cdoctest, src_path, main_file_only, repeat):
+    best = None
+    for _ in range(repeat):
+        Node.node_map = {}
+        start = time.perf_counter()
+        root = Node.build_tree(cdoctest.wrapptedRootCursor, src_path, main_file_only)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count(root), len(Node.node_map), best
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+        with open(file_name, 'r') as f:
+            text = f.read()
+    else:
+        os.chdir(tempfile.mkdtemp())
+        file_name = 'sample.cpp'
+        text = sample
+        write_decls('bench_decls.h', 2000)
+    src_path = os.path.dirname(os.path.realpath(file_name))
+    cdoctest = CDocTest()
+    cdoctest.parse(text, file_name, src_path)
+    for main_file_only in [False, True]:
+        nodes, mapped, elapsed = bench(cdoctest, src_path, main_file_only, 3)
+        print('main file only' if main_file_only else 'whole unit    ', 'nodes:', nodes, 'node_map:', mapped,
+              'time: %.3f ms' % (elapsed * 1000))
@@ -3,9 +3,12 @@ import os
 import subprocess
 import sys
 import runpy
+import time
+from types import SimpleNamespace
 
 from cdoctest import CMakeApi
 from cdoctest import CDocTest
+from cdoctest.cmake_api import TargetGraph
 
 is_built = True
 cmake_abs_dir = None
@@ -141,3 +144,51 @@ class CMakeAPITest(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
+
+
+def fake_target(name, type_value, dependencies=(), sources=()):
+    codemodel_target = SimpleNamespace(id=name + '::@1', name=name, nameOnDisk='lib' + name + '.so', type=SimpleNamespace(value=type_value),
+                                       dependencies=[SimpleNamespace(id=dependency) for dependency in dependencies],
+                                       sources=[SimpleNamespace(path=source) for source in sources])
+    return SimpleNamespace(name=name, target=codemodel_target)
+
+
+class TargetGraphTest(unittest.TestCase):
+
+    def test_shared_libs_load_order(self):
+        # app -> left, right -> base (diamond), left -> static
+        targets = [fake_target("app", "EXECUTABLE", ["left::@1", "right::@1"], ["app.cpp"]),
+                   fake_target("left", "SHARED_LIBRARY", ["base::@1", "static::@1"], ["left.cpp", "common.cpp"]),
+                   fake_target("right", "SHARED_LIBRARY", ["base::@1"], ["right.cpp", "common.cpp"]),
+                   fake_target("base", "SHARED_LIBRARY", [], ["base.cpp"]),
+                   fake_target("static", "STATIC_LIBRARY", [], ["static.cpp"])]
+        graph = TargetGraph(targets, "/src")
+        self.assertEqual([lib.name for lib in graph.get_shared_libs(graph.get_target("app"))], ["base", "left", "right"])
+        self.assertEqual([lib.name for lib in graph.get_shared_libs(graph.get_target("right"))], ["base", "right"])
+        self.assertEqual([target.name for target in graph.get_targets_of_source("/src/common.cpp")], ["left", "right"])
+        self.assertEqual(graph.get_targets_of_source("/src/none.cpp"), [])
+
+    def test_deep_diamonds(self):
+        # every level depends on both targets of the level below, 2^levels paths without memoization
+        levels = 200
+        targets = [fake_target("a0", "SHARED_LIBRARY"), fake_target("b0", "SHARED_LIBRARY")]
+        for level in range(1, levels):
+            below = ["a" + str(level - 1) + "::@1", "b" + str(level - 1) + "::@1"]
+            targets += [fake_target("a" + str(level), "SHARED_LIBRARY", below),
+                        fake_target("b" + str(level), "SHARED_LIBRARY", below)]
+        start = time.perf_counter()
+        graph = TargetGraph(targets, "/src")
+        libs = graph.get_shared_libs(graph.get_target("a" + str(levels - 1)))
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(len(libs), 2 * levels - 1)
+        self.assertEqual([lib.name for lib in libs[:3]], ["a0", "b0", "a1"])
+
+    def test_match_targets(self):
+        api = CMakeApi.__new__(CMakeApi)
+        api._targets = [fake_target("app", "EXECUTABLE"), fake_target("core", "SHARED_LIBRARY"),
+                        fake_target("core_ext", "SHARED_LIBRARY"), fake_target("static", "STATIC_LIBRARY")]
+        api.graph = TargetGraph(api._targets, "/src")
+        self.assertEqual(api.match_targets(["all"]), ["app", "core", "core_ext"])
+        self.assertEqual(api.match_targets(["core"]), ["core"])
+        self.assertEqual(api.match_targets(["core.*", "app"]), ["app", "core", "core_ext"])
+        self.assertEqual(api.match_targets(["none"]), [])
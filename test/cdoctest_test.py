@@ -1,6 +1,8 @@
 import os
 
-from cdoctest import CDocTest
+from cdoctest import CDocTest, CDocTestConfig
+from cdoctest.c_doctest import OutputMatcher
+from cdoctest import c_doctest
 from clang_repl_kernel import ClangReplConfig, Shell
 import platform
 import pytest
@@ -472,3 +474,119 @@ def test_run_one_tc_verify(cdoctest):
         for test in merged_node[i].test.tests:
             assert test.is_pass is True
 
+
+
+class LoopShell:
+    # stands in for clang_repl_kernel.Shell, prints 'count' lines for every command
+    def __init__(self, count):
+        self.count = count
+        self.sent = 0
+        self.killed = False
+        self.process = self
+
+    def kill(self):
+        self.killed = True
+
+    def poll(self):
+        return None
+
+    def do_execute(self, cmd, send):
+        for i in range(self.count):
+            self.sent += 1
+            send(str(i))
+
+
+def test_output_matcher():
+    matcher = OutputMatcher(['1', '2'])
+    matcher.feed('1\n2')
+    assert matcher.finish() is True
+    matcher = OutputMatcher(['1', '2'])
+    matcher.feed('1')
+    assert matcher.finish() is False
+    assert matcher.output_result == [True, False]
+    matcher = OutputMatcher(['1'])
+    matcher.feed('1\n2')
+    assert matcher.finish() is False
+    assert matcher.output_result == [True]
+
+
+def test_output_matcher_spill(tmp_path):
+    matcher = OutputMatcher([], memory_bytes=10)
+    for i in range(10):
+        matcher.feed_line('line' + str(i))
+    matcher.finish()
+    assert matcher.lines == ['line0']
+    with open(matcher.spill_path) as f:
+        assert f.read().splitlines() == ['line' + str(i) for i in range(10)]
+    os.remove(matcher.spill_path)
+
+
+def test_runaway_output_aborted():
+    old_max_lines = CDocTestConfig.MAX_OUTPUT_LINES
+    CDocTestConfig.MAX_OUTPUT_LINES = 100
+    try:
+        test_case = c_doctest.TestCase('runaway', [])
+        test_case.init(['>>> while (true) puts("0");', '0', '>>> %<< 1;', '1'])
+        shell = LoopShell(1000000)
+        test_case.run(shell)
+    finally:
+        CDocTestConfig.MAX_OUTPUT_LINES = old_max_lines
+    assert shell.killed
+    assert shell.sent == 101
+    assert test_case.is_pass is False
+    assert test_case.tests[0].aborted is not None
+    assert test_case.tests[1].aborted.startswith('not run')
+    assert test_case.tests[0].actual[:2] == ['0', '1']
+
+
+def test_build_tree_main_file_only(cdoctest, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'included.h').write_text('namespace inc { struct S { int m(int); }; int f(int); }\n')
+    file_content = """
+#include "included.h"
+namespace test {
+int fac(int n);
+}
+"""
+    src_path = str(tmp_path)
+    cdoctest.parse(file_content, str(tmp_path / 'dummy.cpp'), src_path)
+    root = c_doctest.Node.build_tree(cdoctest.wrapptedRootCursor, src_path)
+    assert [child.id_token.spelling for child in root.children] == ['test']
+    root = c_doctest.Node.build_tree(cdoctest.wrapptedRootCursor, src_path, main_file_only=False)
+    assert [child.id_token.spelling for child in root.children] == ['inc', 'test']
+
+
+def test_single_file_parse(cdoctest, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'fac.h').write_text('namespace test { class Fac { public: int fac(int n); }; }\n')
+    header = """
+#include <string>
+#include "missing.h"
+namespace test {
+/**
+>>> fac("5")
+120
+*/
+Result fac(const std::string& n);
+}
+"""
+    source = """
+#include "fac.h"
+namespace test {
+/**
+>>> test::Fac().fac(5)
+120
+*/
+int Fac::fac(int n) { return n; }
+}
+"""
+    src_path = str(tmp_path)
+    try:
+        for text, name, expected in [(header, 'a.h', ['a.h::test::fac']), (source, 'fac.cpp', ['fac.cpp::test::fac'])]:
+            for single_file_parse in [False, True]:
+                cdoctest.single_file_parse = single_file_parse
+                tests_nodes = []
+                cdoctest.parse_result_test_node(text, tests_nodes, str(tmp_path / name), src_path)
+                assert [node.rel_full_path() for node in tests_nodes] == expected
+    finally:
+        cdoctest.single_file_parse = False
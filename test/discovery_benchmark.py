@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+import time
+
+from cdoctest import CDocTest
+
+# compares test discovery with and without following #include
+#   python test/discovery_benchmark.py [source or header files]
+
+sample = '''
+#pragma once
+#include <iostream>
+#include <vector>
+#include <map>
+#include <string>
+#include <memory>
+namespace test {
+/**
+>>> fac(5)
+120
+*/
+std::vector<int> fac(const std::string& n);
+class Fac {
+public:
+    /**
+    >>> Fac().fac(5)
+    120
+    */
+    std::unique_ptr<int> fac(std::map<int, int> n);
+};
+}
+'''
+
+
+def discover(cdoctest, text, file_name, src_path, single_file_parse, repeat):
+    cdoctest.single_file_parse = single_file_parse
+    best = None
+    for _ in range(repeat):
+        tests_nodes = []
+        start = time.perf_counter()
+        cdoctest.parse_result_test_node(text, tests_nodes, file_name, src_path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return [node.rel_full_path() for node in cdoctest.merge_comments(tests_nodes, None)], best
+
+
+if __name__ == '__main__':
+    files = sys.argv[1:]
+    if len(files) == 0:
+        os.chdir(tempfile.mkdtemp())
+        with open('sample.h', 'w') as f:
+            f.write(sample)
+        files = ['sample.h']
+    cdoctest = CDocTest()
+    total = {False: 0, True: 0}
+    for file_name in files:
+        with open(file_name, 'r') as f:
+            text = f.read()
+        src_path = os.path.dirname(os.path.realpath(file_name))
+        tests, full_time = discover(cdoctest, text, file_name, src_path, False, 3)
+        single_tests, single_time = discover(cdoctest, text, file_name, src_path, True, 3)
+        total[False] += full_time
+        total[True] += single_time
+        print(file_name, 'tests:', len(tests), 'full: %.1f ms' % (full_time * 1000),
+              'single file: %.1f ms' % (single_time * 1000), 'same tests' if tests == single_tests else
+              'different tests: ' + str(sorted(set(tests) ^ set(single_tests))))
+    print('total full: %.1f ms single file: %.1f ms' % (total[False] * 1000, total[True] * 1000))
@@ -0,0 +1,102 @@
+import os
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+from cdoctest import CDocTest, SymbolIndex
+from cdoctest import c_doctest
+from cdoctest import elf_index
+from cdoctest.elf_index import declared_symbols, read_dynamic
+import pytest
+
+needs_gxx = pytest.mark.skipif(shutil.which('g++') is None, reason='needs g++')
+
+header = '''
+int base();
+inline int twice(int n) { return n * 2; }
+class Shape {
+public:
+    Shape();
+    virtual int area() = 0;
+    int sides() const;
+    int inline_sides() const { return 4; }
+    static int count;
+};
+template <class T> T id(T t);
+'''
+
+
+@pytest.fixture
+def libs(tmp_path):
+    (tmp_path / 'base.cpp').write_text('int base() { return 1; }\nint hidden_helper() { return 2; }\n')
+    (tmp_path / 'left.cpp').write_text('int base();\nint left() { return base() + 1; }\n')
+    subprocess.run(['g++', '-shared', '-fPIC', '-o', str(tmp_path / 'libbase.so'),
+                    str(tmp_path / 'base.cpp')], check=True)
+    subprocess.run(['g++', '-shared', '-fPIC', '-o', str(tmp_path / 'libleft.so'), str(tmp_path / 'left.cpp'),
+                    '-L' + str(tmp_path), '-lbase'], check=True)
+    return str(tmp_path / 'libleft.so'), str(tmp_path / 'libbase.so')
+
+
+@needs_gxx
+def test_read_dynamic(libs):
+    left, base = libs
+    dynamic = read_dynamic(base)
+    assert '_Z4basev' in dynamic['symbols'] and '_Z13hidden_helperv' in dynamic['symbols']
+    dynamic = read_dynamic(left)
+    assert '_Z4leftv' in dynamic['symbols'] and '_Z4basev' not in dynamic['symbols']
+
+
+@needs_gxx
+def test_missing(libs, tmp_path, monkeypatch):
+    left, base = libs
+    index = SymbolIndex([left, base], str(tmp_path / 'cache'))
+    assert index.exports['_Z4leftv'] == left and index.exports['_Z4basev'] == base
+    assert index.missing(['_Z4leftv', '_Z4basev']) == []
+    assert index.missing(['_Z4basev', '_Z7missingv']) == ['_Z7missingv']
+    # read again from the cache
+    monkeypatch.setattr(elf_index, 'read_dynamic', None)
+    assert SymbolIndex([left, base], str(tmp_path / 'cache')).missing(['_Z4leftv', '_Z7missingv']) == ['_Z7missingv']
+
+
+def parse(tmp_path):
+    (tmp_path / 'shape.h').write_text(header)
+    cdoctest = CDocTest()
+    cdoctest.parse(header, str(tmp_path / 'shape.h'), str(tmp_path))
+    cursors = {}
+    for cursor in cdoctest.tu.cursor.walk_preorder():
+        if cursor.location.file is not None:
+            # the class, not its constructor
+            cursors.setdefault(cursor.spelling, cursor)
+    return cdoctest, cursors
+
+
+def test_declared_symbols(tmp_path):
+    _, cursors = parse(tmp_path)
+    assert declared_symbols(cursors['base']) == ['_Z4basev']
+    assert declared_symbols(cursors['twice']) == []
+    assert declared_symbols(cursors['id']) == []
+    assert declared_symbols(cursors['Shape']) == ['_ZN5ShapeC1Ev', '_ZNK5Shape5sidesEv', '_ZN5Shape5countE']
+
+
+def test_missing_symbol_fails_without_repl(tmp_path):
+    cdoctest, cursors = parse(tmp_path)
+    cdoctest.repl_binary = str(tmp_path / 'no_repl')
+    cdoctest.symbol_index = SimpleNamespace(missing=lambda symbols: symbols)
+    test_case = c_doctest.TestCase('case', [])
+    test_case.init(['>>> %<< base();', '1'])
+    node = SimpleNamespace(test=test_case, full_path=lambda: 'base', id_token=cursors['base'])
+    cdoctest.run_verify([], [], [], [node])
+    assert not test_case.is_pass
+    assert test_case.tests[0].crashed == 'not run, no library exports _Z4basev'
+
+
+@needs_gxx
+def test_missing_exports(libs, tmp_path):
+    cdoctest, cursors = parse(tmp_path)
+    left, base = libs
+    cdoctest.symbol_index = SymbolIndex([left, base], str(tmp_path / 'cache'))
+    assert cdoctest.missing_exports(SimpleNamespace(id_token=cursors['base'])) == []
+    assert cdoctest.missing_exports(SimpleNamespace(id_token=cursors['twice'])) == []
+    assert cdoctest.missing_exports(SimpleNamespace(id_token=None)) == []
+    assert cdoctest.missing_exports(SimpleNamespace(id_token=cursors['Shape'])) == \
+        ['_ZN5ShapeC1Ev', '_ZNK5Shape5sidesEv', '_ZN5Shape5countE']
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Minimal stand-in for clang-repl, speaks the same prompt protocol.
+# Commands: 'echo <text>' prints text ('\n' escapes allowed), 'spam <n>' prints n lines,
+# 'sleep <seconds>', 'alloc <MB>' keeps MB of memory, 'burn <seconds>' uses CPU, 'crash' or '%lib crash<anything>' raises SIGSEGV, 'exit <code>',
+# 'count <dir>' prints how often it ran on the directory, 'env <name>' prints an environment variable,
+# 'args' prints every command line argument on a line.
+# Anything else, ex) the C++ of '%bench' and '%allocs', prints nothing.
+import os
+import signal
+import sys
+import time
+
+BANNER = 'clang-repl> '
+BANNER_CONT = 'clang-repl...   '
+kept = []
+
+
+def execute(command):
+    command = command.strip()
+    if command.startswith('echo '):
+        sys.stdout.write(command[5:].replace('\\n', '\n') + '\n')
+    elif command.startswith('spam '):
+        for i in range(int(command[5:])):
+            sys.stdout.write('line ' + str(i) + '\n')
+    elif command.startswith('sleep '):
+        time.sleep(float(command[6:]))
+    elif command.startswith('alloc '):
+        kept.append(b'x' * int(float(command[6:]) * 1024 * 1024))
+    elif command.startswith('burn '):
+        end = time.process_time() + float(command[5:])
+        while time.process_time() < end:
+            pass
+    elif command == 'crash' or command.startswith('%lib crash'):
+        sys.stdout.flush()
+        os.kill(os.getpid(), signal.SIGSEGV)
+    elif command.startswith('count '):
+        count = 1
+        while True:
+            try:
+                os.close(os.open(os.path.join(command[6:], str(count)), os.O_CREAT | os.O_EXCL))
+                break
+            except FileExistsError:
+                count += 1
+        sys.stdout.write(str(count) + '\n')
+    elif command.startswith('env '):
+        sys.stdout.write(os.environ.get(command[4:], '') + '\n')
+    elif command == 'args':
+        sys.stdout.write(''.join(arg + '\n' for arg in sys.argv[1:]))
+    elif command.startswith('exit '):
+        sys.stdout.flush()
+        os._exit(int(command[5:]))
+
+
+def main():
+    sys.stdout.write(BANNER)
+    sys.stdout.flush()
+    accumulated = ''
+    for line in sys.stdin:
+        line = line.rstrip('\n')
+        if line.endswith('\\'):
+            accumulated += line[:-1] + '\n'
+            sys.stdout.write(BANNER_CONT)
+        else:
+            for command in (accumulated + line).split('\n'):
+                execute(command)
+            accumulated = ''
+            sys.stdout.write(BANNER)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import time
+
+from cdoctest import FileWalker, IgnoreRules
+import pytest
+
+
+def write(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'a.h'), '/**\n>>> fac(5)\n120\n*/\nint fac(int n);\n')
+    write(os.path.join(root, 'a.cpp'), '/**\n>>> fac(5)\n120\n*/\n')
+    # not parsed for tests without '>>>'
+    write(os.path.join(root, 'b.cpp'), '/**\nclang-repl> fac(5)\n120\n*/\n')
+    write(os.path.join(root, 'no_test.h'), 'int no_test();\n')
+    write(os.path.join(root, 'readme.txt'), '>>> not c\n')
+    write(os.path.join(root, 'sub', 'b.h'), '>>> b()\n')
+    write(os.path.join(root, 'sub', 'gen', 'c.h'), '>>> c()\n')
+    write(os.path.join(root, 'build', 'd.h'), '>>> d()\n')
+    write(os.path.join(root, '.git', 'e.h'), '>>> e()\n')
+    return root
+
+
+def rel(root, files):
+    return sorted(os.path.relpath(file, root).replace(os.sep, '/') for file in files)
+
+
+def test_walk_filters_extension_and_marker(tree):
+    walker = FileWalker(tree, ['cpp', 'c', 'h'], use_ignore_file=False)
+    assert rel(tree, walker.walk()) == ['a.cpp', 'a.h', 'build/d.h', 'sub/b.h', 'sub/gen/c.h']
+
+
+def test_walk_exclude_and_ignore_file(tree):
+    write(os.path.join(tree, '.gitignore'), '# comment\nbuild/\n')
+    write(os.path.join(tree, 'sub', '.gitignore'), 'gen\n')
+    walker = FileWalker(tree, ['cpp', 'h'], exclude_patterns=['*.cpp'])
+    assert rel(tree, walker.walk()) == ['a.h', 'sub/b.h']
+
+
+def test_walk_multiple_roots(tree):
+    walker = FileWalker([os.path.join(tree, 'sub'), os.path.join(tree, 'build')], ['h'])
+    assert rel(tree, walker.walk()) == ['build/d.h', 'sub/b.h', 'sub/gen/c.h']
+
+
+def test_walk_stopped_early(tmp_path):
+    root = str(tmp_path)
+    for i in range(50):
+        write(os.path.join(root, 'd' + str(i), 'sub', 'a.h'), '>>> a()\n')
+    walker = FileWalker(root, ['h'], max_workers=2)
+    scan_dir = walker._scan_dir
+    closed = False
+    late = []
+
+    def slow_scan_dir(root, rel_dir, rules, submit, found):
+        if closed:
+            late.append(rel_dir)
+        time.sleep(0.01)
+        scan_dir(root, rel_dir, rules, submit, found)
+
+    walker._scan_dir = slow_scan_dir
+    walk = walker.walk()
+    assert next(walk).endswith('a.h')
+    walk.close()
+    closed = True
+    assert list(walk) == []
+    time.sleep(0.5)
+    # directories waiting for a worker are cancelled, only the ones taken by a worker already may start
+    assert len(late) <= 2
+
+
+def test_has_marker_across_chunks(tmp_path):
+    path = str(tmp_path / 'big.h')
+    walker = FileWalker(str(tmp_path), ['h'])
+    write(path, ' ' * (FileWalker.CHUNK_SIZE - 1) + '>>> fac(5)\n')
+    assert walker.has_marker(path)
+    write(path, ' ' * (FileWalker.CHUNK_SIZE * 2))
+    assert not walker.has_marker(path)
+
+
+def test_ignore_rules():
+    rules = IgnoreRules(['*.o', '/top.h', 'out/', 'lib/**/gen.h', '!keep.o'])
+    assert rules.match('x.o', False) is True
+    assert rules.match('a/b/x.o', False) is True
+    assert rules.match('keep.o', False) is False
+    assert rules.match('top.h', False) is True
+    assert rules.match('a/top.h', False) is None
+    assert rules.match('out', True) is True
+    assert rules.match('out', False) is None
+    assert rules.match('lib/gen.h', False) is True
+    assert rules.match('lib/a/b/gen.h', False) is True
+    assert IgnoreRules(['gen'], 'sub').match('sub/gen', True) is True
+    assert IgnoreRules(['gen'], 'sub').match('gen', True) is None
@@ -0,0 +1,91 @@
+import os
+
+from cdoctest import CDocTest, Fingerprinter, FingerprintStore
+import pytest
+
+
+@pytest.fixture(scope='session')
+def cdoctest():
+    return CDocTest()
+
+
+h_file_content = """
+#pragma once
+namespace test {
+struct Base {
+    int base_value() { return 1; }
+};
+/**
+>>> test::Fac fac;
+>>> %<< fac.fac(5);
+120
+*/
+class Fac : public Base {
+public:
+    int fac(int n);
+};
+/**
+>>> %<< test::other(1);
+1
+*/
+int other(int n);
+}
+"""
+
+
+def fingerprints(cdoctest, content, libs=None):
+    nodes = []
+    cdoctest.parse_result_test_node(content, nodes, 'sample.h', os.getcwd())
+    fingerprinter = Fingerprinter(libs)
+    return {node.rel_full_path(): fingerprinter.fingerprint(node) for node in cdoctest.merge_comments(nodes, None)}
+
+
+def test_fingerprint_stable_and_whitespace_insensitive(cdoctest):
+    first = fingerprints(cdoctest, h_file_content)
+    assert len(first) == 2
+    assert first == fingerprints(cdoctest, h_file_content)
+    assert first == fingerprints(cdoctest, h_file_content.replace('int fac(int n);', 'int   fac( int n );'))
+
+
+def test_fingerprint_changes_only_affected_test(cdoctest):
+    first = fingerprints(cdoctest, h_file_content)
+    # referenced base class changed, only the class test is affected
+    second = fingerprints(cdoctest, h_file_content.replace('return 1;', 'return 2;'))
+    changed = [key for key in first if first[key] != second[key]]
+    assert changed == ['sample.h::test::Fac::class']
+    # doc comment changed
+    third = fingerprints(cdoctest, h_file_content.replace('test::other(1);\n1', 'test::other(2);\n2'))
+    changed = [key for key in first if first[key] != third[key]]
+    assert changed == ['sample.h::test::other']
+
+
+def test_fingerprint_library_bytes(cdoctest, tmp_path):
+    lib = tmp_path / 'libsample.so'
+    lib.write_bytes(b'first')
+    first = fingerprints(cdoctest, h_file_content, [str(lib)])
+    lib.write_bytes(b'second')
+    second = fingerprints(cdoctest, h_file_content, [str(lib)])
+    assert all(first[key] != second[key] for key in first)
+
+
+def test_fingerprint_store_skips_unchanged_passes(cdoctest, tmp_path):
+    path = str(tmp_path / 'fingerprint.json')
+
+    def run(content, passed):
+        nodes = []
+        cdoctest.parse_result_test_node(content, nodes, 'sample.h', os.getcwd())
+        nodes = cdoctest.merge_comments(nodes, None)
+        store = FingerprintStore(path, Fingerprinter())
+        store.skip_unchanged(nodes)
+        for node in nodes:
+            if node.test.reused is None:
+                node.test.is_pass = passed
+        store.update(nodes)
+        store.save()
+        return [node.test.reused for node in nodes]
+
+    assert run(h_file_content, False) == [None, None]
+    assert run(h_file_content, True) == [None, None]
+    assert run(h_file_content, True) == [FingerprintStore.REUSED, FingerprintStore.REUSED]
+    assert run(h_file_content.replace('test::other(1);\n1', 'test::other(2);\n2'), True) \
+        == [FingerprintStore.REUSED, None]
@@ -0,0 +1,30 @@
+import os
+
+from cdoctest import HeaderIndex
+
+
+def write(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('')
+
+
+def test_header_index(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    for file in ['src/a.cpp', 'src/a.h', 'src/b.cpp', 'src/c.cpp', 'inc1/b.h', 'inc2/b.h', 'inc2/c.h']:
+        write(os.path.join(root, file))
+    os.makedirs(os.path.join(root, 'inc1', 'b.hpp'))
+
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: scanned.append(path) or scandir(path))
+
+    index = HeaderIndex([os.path.join(root, 'inc1'), os.path.join(root, 'inc2'), os.path.join(root, 'missing')])
+    src = os.path.join(root, 'src')
+    assert index.header_of(os.path.join(src, 'a.cpp'), 'h') == os.path.join(src, 'a.h')
+    # first include directory wins
+    assert index.header_of(os.path.join(src, 'b.cpp'), 'h') == os.path.join(root, 'inc1', 'b.h')
+    assert index.header_of(os.path.join(src, 'c.cpp'), 'h') == os.path.join(root, 'inc2', 'c.h')
+    assert index.header_of(os.path.join(src, 'd.cpp'), 'h') is None
+    assert index.find('b.hpp') is None
+    assert sorted(scanned) == sorted([src] + index.include_dirs)
@@ -0,0 +1,59 @@
+import os
+
+from cdoctest import CDocTest, HeaderMap
+from cdoctest.header_map import read_header_map, write_header_map
+
+
+def write(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_write_read(tmp_path):
+    entries = {'a.h': '/inc/a.h', 'sub/b.h': '/inc/sub/b.h'}
+    entries.update({'many' + str(i) + '.h': '/inc/many' + str(i) + '.h' for i in range(100)})
+    write_header_map(str(tmp_path / 'x.hmap'), entries)
+    assert read_header_map(str(tmp_path / 'x.hmap')) == entries
+
+
+def test_search_path(tmp_path):
+    root = str(tmp_path)
+    for file in ['inc1/a.h', 'inc1/sub/b.h', 'inc2/a.h', 'inc2/c.h', 'big/1.h', 'big/2.h', 'big/3.h', 'big/4.h', 'inc3/d.h']:
+        write(os.path.join(root, file))
+    dirs = [os.path.join(root, name) for name in ['inc1', 'inc2', 'missing', 'big', 'inc3']]
+    header_map = HeaderMap(os.path.join(root, 'cache'), max_files=3)
+    search_path = header_map.search_path(dirs)
+    # the big directory stays between the maps, in its place
+    assert len(search_path) == 3 and search_path[1] == dirs[3]
+    first = read_header_map(search_path[0])
+    assert first == {'a.h': os.path.join(root, 'inc1', 'a.h'), 'sub/b.h': os.path.join(root, 'inc1', 'sub', 'b.h'),
+                     'c.h': os.path.join(root, 'inc2', 'c.h')}
+    assert read_header_map(search_path[2]) == {'d.h': os.path.join(root, 'inc3', 'd.h')}
+    assert header_map.built == 1 and header_map.headers == 4
+
+    assert HeaderMap(os.path.join(root, 'cache'), max_files=3).search_path(dirs) == search_path
+    # a new header is seen
+    write(os.path.join(root, 'inc1', 'sub', 'e.h'))
+    again = HeaderMap(os.path.join(root, 'cache'), max_files=3)
+    assert 'sub/e.h' in read_header_map(again.search_path(dirs)[0]) and again.built == 1
+
+
+def test_case_collision_is_not_mapped(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'inc1', 'A.h'))
+    write(os.path.join(root, 'inc2', 'a.h'))
+    dirs = [os.path.join(root, 'inc1'), os.path.join(root, 'inc2')]
+    search_path = HeaderMap(os.path.join(root, 'cache')).search_path(dirs)
+    assert search_path[1] == dirs[1] and read_header_map(search_path[0]) == {'A.h': os.path.join(root, 'inc1', 'A.h')}
+
+
+def test_libclang_reads_header_map(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'inc', 'lib', 'mapped.h'), 'int from_map();\n')
+    cdoctest = CDocTest()
+    cdoctest.header_maps = HeaderMap(os.path.join(root, 'cache')).search_path([os.path.join(root, 'inc')])
+    text = '#include "lib/mapped.h"\n#include <lib/mapped.h>\nint user();\n'
+    cdoctest.parse(text, os.path.join(root, 'user.h'), root)
+    assert [str(diagnostic) for diagnostic in cdoctest.tu.diagnostics] == []
+    assert 'from_map' in [cursor.spelling for cursor in cdoctest.tu.cursor.get_children()]
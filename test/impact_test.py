@@ -0,0 +1,80 @@
+import os
+from types import SimpleNamespace
+
+from cdoctest import ImpactMap, ChangeSet, CoverageCollector, select_affected
+
+
+DIFF = """diff --git a/src/fac.cpp b/src/fac.cpp
+index 1111111..2222222 100644
+--- a/src/fac.cpp
++++ b/src/fac.cpp
+@@ -10,3 +10,4 @@ int fac(int n) {
+     return 1;
++    // changed
+ }
+@@ -40,2 +41,0 @@ int other() {
+diff --git a/src/old.cpp b/src/old.cpp
+deleted file mode 100644
+--- a/src/old.cpp
++++ /dev/null
+@@ -1,3 +0,0 @@
+"""
+
+
+def test_change_set_from_diff():
+    changes = ChangeSet.from_diff(DIFF)
+    assert changes.files['src/fac.cpp'] == [(10, 13), (41, 41)]
+    assert changes.files['src/old.cpp'] is None
+    assert changes.touches('/work/src/fac.cpp', 12, 20)
+    assert not changes.touches('/work/src/fac.cpp', 20, 30)
+    assert changes.touches('/work/src/old.cpp', 100, 200)
+    assert not changes.touches('/work/src/other.cpp', 1, 100)
+
+
+def test_change_set_parse_files_and_base_path(tmp_path):
+    changes = ChangeSet.parse('src/a.h;src/b.cpp')
+    assert changes.touches(os.path.join(str(tmp_path), 'src', 'a.h'), 1, 1, str(tmp_path))
+    assert not changes.touches(os.path.join(str(tmp_path), 'src', 'c.h'), 1, 1, str(tmp_path))
+    diff_file = tmp_path / 'change.diff'
+    diff_file.write_text(DIFF)
+    assert 'src/fac.cpp' in ChangeSet.parse(str(diff_file)).files
+
+
+def test_impact_map_save_load(tmp_path):
+    path = str(tmp_path / 'impact.json')
+    impact_map = ImpactMap(path)
+    impact_map.record('a.h::fac', [{'name': '_Z3faci', 'file': '/work/src/fac.cpp', 'start': 9, 'end': 12}])
+    impact_map.save()
+    loaded = ImpactMap(path)
+    assert 'a.h::fac' in loaded
+    changes = ChangeSet.from_diff(DIFF)
+    assert loaded.is_affected('a.h::fac', changes)
+    assert loaded.is_affected('unknown', changes)
+    assert not loaded.is_affected('a.h::fac', ChangeSet.from_files(['src/other.cpp']))
+
+
+def test_covered_functions():
+    export = {'data': [{'functions': [
+        {'name': '_Z3faci', 'count': 3, 'filenames': ['/work/src/fac.cpp'],
+         'regions': [[9, 17, 12, 2, 3, 0, 0, 0], [10, 5, 10, 20, 0, 0, 0, 0]]},
+        {'name': '_Z5otherv', 'count': 0, 'filenames': ['/work/src/fac.cpp'],
+         'regions': [[40, 1, 42, 2, 0, 0, 0, 0]]},
+    ]}]}
+    assert CoverageCollector.covered_functions(export) == \
+        [{'name': '_Z3faci', 'file': '/work/src/fac.cpp', 'start': 9, 'end': 12}]
+
+
+def test_select_affected():
+    def node(test_id, file, start, end):
+        extent = SimpleNamespace(start=SimpleNamespace(line=start), end=SimpleNamespace(line=end))
+        return SimpleNamespace(rel_full_path=lambda: test_id, file_node=SimpleNamespace(spelling=file),
+                               comment_token=SimpleNamespace(extent=extent), id_token=SimpleNamespace(extent=extent))
+
+    impact_map = ImpactMap()
+    impact_map.record('fac.h::fac', [{'name': '_Z3faci', 'file': '/work/src/fac.cpp', 'start': 9, 'end': 12}])
+    impact_map.record('fac.h::other', [])
+    impact_map.record('doc.h::doc', [])
+    nodes = [node('fac.h::fac', '/work/fac.h', 1, 5), node('fac.h::other', '/work/fac.h', 7, 9),
+             node('doc.h::doc', '/work/src/doc.h', 1, 5)]
+    selected = select_affected(nodes, impact_map, ChangeSet.parse('src/fac.cpp;src/doc.h'), '/work')
+    assert [n.rel_full_path() for n in selected] == ['fac.h::fac', 'doc.h::doc']
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import shlex
+import sys
+
+from cdoctest import CDocTest, PreambleCache
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+
+def fake_compiler(tmp_path, fails=False):
+    # writes the file after '-o' like clang++ would
+    compiler = tmp_path / 'fake_clangxx'
+    compiler.write_text('#!' + sys.executable + '\n'
+                        'import sys\n'
+                        + ('sys.exit("error: bad flag")\n' if fails else '') +
+                        'open(sys.argv[sys.argv.index("-o") + 1], "w").write("pch")\n')
+    compiler.chmod(0o755)
+    return str(compiler)
+
+
+def test_hit_after_build(tmp_path):
+    cache = PreambleCache(str(tmp_path / 'cache'), fake_compiler(tmp_path))
+    first = cache.args(FAKE_REPL, dict(os.environ))
+    assert '-include-pch' in first and cache.misses == 1 and cache.hits == 0
+    assert cache.args(FAKE_REPL, dict(os.environ)) == first and cache.hits == 1 and cache.saved > 0
+    # a later run finds the precompiled header on disk
+    cache = PreambleCache(str(tmp_path / 'cache'), fake_compiler(tmp_path))
+    assert cache.args(FAKE_REPL, dict(os.environ)) == first and cache.hits == 1 and cache.misses == 0
+    # another include path is another preamble
+    assert cache.args(FAKE_REPL, dict(os.environ, CPLUS_INCLUDE_PATH='/x')) != first and cache.misses == 1
+
+
+def test_failed_build_is_not_used(tmp_path):
+    cache = PreambleCache(str(tmp_path / 'cache'), fake_compiler(tmp_path, fails=True))
+    assert cache.args(FAKE_REPL, dict(os.environ)) == [] and cache.misses == 1
+
+
+def test_repl_starts_with_pch(tmp_path):
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    cdoctest.preamble_cache = PreambleCache(str(tmp_path / 'cache'), fake_compiler(tmp_path))
+    shell = cdoctest.new_shell()
+    try:
+        assert '-include-pch' in shell.program_with_args
+    finally:
+        cdoctest.stop_shell(shell)
+
+
+def test_pch_path_with_space(tmp_path):
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    cdoctest.preamble_cache = PreambleCache(str(tmp_path / 'pre amble'), fake_compiler(tmp_path))
+
+    async def repl_args():
+        session = await cdoctest.start_session([], [])
+        try:
+            return (await session.execute('args')).splitlines()
+        finally:
+            await session.close()
+
+    args = asyncio.run(repl_args())
+    pch = args[-1]
+    assert args[-2:] == ['-Xcc', pch] and ' ' in pch and os.path.isfile(pch)
+    # the sync REPL gets the same arguments through its shell command line
+    shell = cdoctest.new_shell()
+    try:
+        assert shlex.split(shell.program_with_args)[-4:] == ['-Xcc', '-include-pch', '-Xcc', pch]
+    finally:
+        cdoctest.stop_shell(shell)
@@ -0,0 +1,68 @@
+import os
+import time
+from types import SimpleNamespace
+
+from cdoctest import CDocTest, Pipeline, ReplPool
+import pytest
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+
+def discover(target_file):
+    time.sleep(0.2)
+    return '/abs/' + target_file, [SimpleNamespace(test=SimpleNamespace(is_pass=None))]
+
+
+def job(done):
+    def run(abs_target_file, merged_node):
+        time.sleep(0.2)
+        merged_node[0].test.is_pass = True
+        done.append(abs_target_file)
+    return run
+
+
+def test_discovery_overlaps_runs():
+    files = ['a.h', 'b.h', 'c.h', 'd.h']
+    sequential = Pipeline(discover)
+    done = []
+    sequential.run_sequential(iter(files), job(done))
+    assert done == ['/abs/' + name for name in files]
+    pipelined = Pipeline(discover, test_queue_size=1)
+    done = []
+    pipelined.run(iter(files), job(done))
+    assert done == ['/abs/' + name for name in files]
+    assert pipelined.total < sequential.total * 0.8
+    assert 0.35 < pipelined.first_result < pipelined.total
+    assert pipelined.waited < sequential.waited
+
+
+def test_discovery_error_is_raised():
+    def failing(target_file):
+        raise ValueError(target_file)
+    with pytest.raises(ValueError):
+        Pipeline(failing).run(iter(['a.h']), job([]))
+
+
+def test_pool_warm():
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    started = []
+    new_shell = cdoctest.new_shell
+
+    def counting_new_shell(*args, **kwargs):
+        started.append(1)
+        return new_shell(*args, **kwargs)
+
+    cdoctest.new_shell = counting_new_shell
+    pool = ReplPool(cdoctest)
+    try:
+        pool.warm([], [])
+        pool.warm([], [])
+        time.sleep(0.5)
+        shell = pool.take_shell([], [])
+        # the warm REPL is taken, the one of the next test is being prepared
+        assert len(started) >= 1 and shell.process.poll() is None
+        cdoctest.stop_shell(shell)
+    finally:
+        pool.close()
+    assert len(started) == 2
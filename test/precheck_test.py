@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from clang_repl_kernel import Shell
+
+from cdoctest import CDocTest, SyntaxPrecheck
+from cdoctest import c_doctest
+import pytest
+
+
+def node(lines, name):
+    test_case = c_doctest.TestCase(name, [])
+    test_case.init(lines)
+    return SimpleNamespace(test=test_case, full_path=lambda: name)
+
+
+@pytest.fixture
+def precheck(tmp_path, monkeypatch):
+    # the standard headers may not be found by the libclang of the python bindings
+    monkeypatch.setattr(SyntaxPrecheck, 'HEADERS', [])
+    monkeypatch.setattr(Shell, 'env', {'CPLUS_INCLUDE_PATH': str(tmp_path)})
+    (tmp_path / 'fac.h').write_text('int fac(int n);\n')
+    (tmp_path / 'broken.h').write_text('int fac(int n)\n')
+    return SyntaxPrecheck(CDocTest(), jobs=4)
+
+
+def test_source_lines(precheck):
+    source, lines = precheck.source('fac.h', ['#include "other.h"', '%<< fac(3)', 'int x = fac(1);', 'fac(x)'])
+    source = source.split('\n')
+    assert source[lines[0] - 1] == '#include "other.h"'
+    assert source[lines[1] - 1] == 'std::cout << (fac(3)) << std::endl;'
+    assert source[lines[2] - 1] == 'int x = fac(1);'
+    assert source[lines[3] - 1] == '(void)(fac(x));'
+    assert precheck.source('fac.h', ['%lib libfac.so'])[0] is None
+
+
+def test_compile_errors_are_not_run(precheck):
+    nodes = [node(['>>> int x = fac(3);', '>>> fac(x);'], 'good'),
+             node(['>>> int x = fac(3);', '>>> fca(x);', '>>> x = 1;'], 'typo'),
+             node(['>>> %lib libfac.so', '>>> fca(1);'], 'repl_only')]
+    rejected = precheck.run(nodes, 'fac', 'h')
+    assert rejected == [nodes[1]]
+    assert nodes[0].test.reused is None and nodes[2].test.reused is None
+    typo = nodes[1].test
+    assert typo.reused == 'does not compile' and typo.is_pass is False
+    assert typo.tests[0].diagnostics == [] and typo.tests[2].diagnostics == []
+    assert typo.tests[1].diagnostics == ["error: use of undeclared identifier 'fca'"]
+    assert typo.tests[1].aborted == 'not run, 1 compile errors'
+    assert precheck.checked == 2 and precheck.rejected == 1
+    # the next run checks the tests again
+    typo.reset()
+    assert typo.tests[1].diagnostics == []
+
+
+def test_typo_in_expression_is_not_run(precheck):
+    # the REPL prints the value of an expression without ';'
+    nodes = [node(['>>> fac(5)', '120'], 'good'), node(['>>> fca(5)', '120'], 'typo')]
+    assert precheck.run(nodes, 'fac', 'h') == [nodes[1]]
+    assert nodes[0].test.reused is None
+    assert nodes[1].test.tests[0].diagnostics == ["error: use of undeclared identifier 'fca'"]
+
+
+def test_broken_header_is_not_checked(precheck):
+    nodes = [node(['>>> fca(1);'], 'typo')]
+    assert precheck.run(nodes, 'broken', 'h') == []
+    assert nodes[0].test.reused is None and precheck.checked == 0
@@ -0,0 +1,60 @@
+import os
+
+from cdoctest.allocs import AllocCounter
+import pytest
+
+pytest_plugins = ['pytester']
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+sample_h = """
+#pragma once
+namespace test {
+/**
+>>> echo 120
+120
+*/
+int fac(int n);
+/**
+>>> echo 120
+121
+*/
+int fac2(int n);
+}
+"""
+
+
+def test_collect_and_run(pytester):
+    pytester.makefile('.h', sample=sample_h)
+    pytester.makefile('.h', no_test='int no_test();\n')
+    result = pytester.runpytest('-p', 'cdoctest.pytest_plugin', '--cdoctest', '--cdoctest-repl=' + FAKE_REPL,
+                                '--collect-only', '-q')
+    result.stdout.fnmatch_lines(['sample.h::test::fac', 'sample.h::test::fac2'])
+    assert 'no_test.h' not in result.stdout.str()
+
+    result = pytester.runpytest('-p', 'cdoctest.pytest_plugin', '--cdoctest', '--cdoctest-repl=' + FAKE_REPL)
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["expected: ['121']", "actual:   ['120']"])
+
+    result = pytester.runpytest('-p', 'cdoctest.pytest_plugin', '--cdoctest', '--cdoctest-repl=' + FAKE_REPL, '--lf')
+    result.assert_outcomes(failed=1)
+
+
+def test_not_collected_without_option(pytester):
+    pytester.makefile('.h', sample=sample_h)
+    result = pytester.runpytest('-p', 'cdoctest.pytest_plugin')
+    result.assert_outcomes()
+
+
+@pytest.mark.skipif(AllocCounter.library() is None, reason=str(AllocCounter.error()))
+def test_allocs_preload_counter(pytester):
+    pytester.makefile('.h', sample="""
+/**
+>>> env LD_PRELOAD
+""" + AllocCounter.library() + """
+>>> %allocs f() == 0
+*/
+int f();
+""")
+    result = pytester.runpytest('-p', 'cdoctest.pytest_plugin', '--cdoctest', '--cdoctest-repl=' + FAKE_REPL)
+    result.stdout.fnmatch_lines(['>>> env LD_PRELOAD pass'])
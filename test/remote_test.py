@@ -0,0 +1,134 @@
+import os
+import socket
+import threading
+from types import SimpleNamespace
+
+from cdoctest import CDocTest, RemoteRunner, Worker
+from cdoctest import c_doctest
+from cdoctest import remote
+import pytest
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+TOKEN = 'secret'
+
+
+def node(lines, name):
+    test_case = c_doctest.TestCase(name, [])
+    test_case.init(lines)
+    return SimpleNamespace(test=test_case, full_path=lambda: name)
+
+
+@pytest.fixture
+def cdoctest():
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    return cdoctest
+
+
+@pytest.fixture
+def workers(cdoctest):
+    started = []
+
+    def start():
+        worker = Worker(cdoctest, 'localhost', 0, token=TOKEN)
+        threading.Thread(target=worker.serve_forever, daemon=True).start()
+        started.append(worker)
+        return worker
+
+    yield start
+    for worker in started:
+        worker.shutdown()
+        worker.server_close()
+
+
+def vanishing_worker():
+    # takes a test and disappears without an answer
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    server.listen()
+
+    def serve():
+        connection, _ = server.accept()
+        f = connection.makefile('rwb')
+        f.readline()
+        f.write(b'{"ok": true}\n')
+        f.flush()
+        f.readline()
+        f.close()
+        connection.close()
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return 'localhost:' + str(server.getsockname()[1])
+
+
+def test_tests_run_on_workers(cdoctest, workers):
+    first, second = workers(), workers()
+    nodes = [node(['>>> sleep 0.2', '>>> echo ' + str(i), str(i)], 'pass' + str(i)) for i in range(4)] \
+        + [node(['>>> echo 1', '2'], 'fail'), node(['>>> echo 1', '1', '>>> crash', '>>> echo 2', '2'], 'crash')]
+    runner = RemoteRunner(cdoctest, ['localhost:' + str(first.port), 'localhost:' + str(second.port)], token=TOKEN)
+    runner.run([], [], nodes)
+    runner.close()
+    assert [n.test.is_pass for n in nodes] == [True] * 4 + [False, False]
+    assert nodes[4].test.tests[0].actual == ['1'] and nodes[4].test.tests[0].output_result == [False]
+    crashed = nodes[5].test.tests
+    assert crashed[1].crashed == 'killed by signal 11 (SIGSEGV)'
+    assert crashed[2].aborted == 'not run, REPL killed by signal 11 (SIGSEGV)'
+    assert 'wall' in nodes[0].test.metrics
+    assert first.jobs + second.jobs == 6 and first.jobs > 0 and second.jobs > 0
+    assert runner.completed == 6 and runner.reassigned == 0
+
+
+def test_lost_worker_test_is_reassigned(cdoctest, workers):
+    worker = workers()
+    nodes = [node(['>>> echo ' + str(i), str(i)], 'test' + str(i)) for i in range(3)]
+    runner = RemoteRunner(cdoctest, [vanishing_worker(), 'localhost:' + str(worker.port)], token=TOKEN)
+    runner.run([], [], nodes)
+    assert all(n.test.is_pass for n in nodes)
+    assert runner.reassigned == 1 and runner.workers[0].lost is not None and runner.workers[1].lost is None
+    assert worker.jobs == 3
+
+
+def test_no_worker_left(cdoctest):
+    nodes = [node(['>>> echo 1', '1'], 'test')]
+    RemoteRunner(cdoctest, [vanishing_worker()], token=TOKEN).run([], [], nodes)
+    assert not nodes[0].test.is_pass and nodes[0].test.tests[0].crashed == 'not run, no worker left'
+
+
+def test_heartbeat_keeps_long_test(cdoctest, workers, monkeypatch):
+    monkeypatch.setattr(remote, 'HEARTBEAT_SECONDS', 0.1)
+    monkeypatch.setattr(remote, 'LOST_SECONDS', 0.5)
+    worker = workers()
+    nodes = [node(['>>> sleep 1.2', '>>> echo 1', '1'], 'slow')]
+    runner = RemoteRunner(cdoctest, ['localhost:' + str(worker.port)], token=TOKEN)
+    runner.run([], [], nodes)
+    assert nodes[0].test.is_pass and runner.reassigned == 0
+
+
+def test_worker_needs_token(cdoctest, monkeypatch):
+    monkeypatch.delenv(remote.TOKEN_ENV, raising=False)
+    with pytest.raises(Exception):
+        Worker(cdoctest, 'localhost', 0)
+
+
+def test_wrong_token_is_refused(cdoctest, workers):
+    worker = workers()
+    nodes = [node(['>>> echo 1', '1'], 'test')]
+    runner = RemoteRunner(cdoctest, ['localhost:' + str(worker.port)], token='wrong')
+    runner.run([], [], nodes)
+    assert worker.jobs == 0 and 'token' in runner.workers[0].lost
+    assert nodes[0].test.tests[0].crashed == 'not run, no worker left'
+
+
+def test_unreachable_worker_does_not_use_attempts(cdoctest, workers, monkeypatch):
+    monkeypatch.setattr(remote, 'CONNECT_RETRY_SECONDS', 0.01)
+    closed = socket.socket()
+    closed.bind(('localhost', 0))
+    address = 'localhost:' + str(closed.getsockname()[1])
+    closed.close()
+    worker = workers()
+    nodes = [node(['>>> echo ' + str(i), str(i)], 'test' + str(i)) for i in range(3)]
+    runner = RemoteRunner(cdoctest, [address, address, address, 'localhost:' + str(worker.port)], token=TOKEN)
+    runner.run([], [], nodes)
+    assert all(n.test.is_pass for n in nodes) and runner.reassigned == 0
+    assert all(w.lost is not None for w in runner.workers[:3])
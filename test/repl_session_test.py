@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from cdoctest import CDocTest, AsyncReplSession, ReplSessionError
+from cdoctest import c_doctest
+import pytest
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+
+def fake_session():
+    return AsyncReplSession(sys.executable, [FAKE_REPL], env=os.environ.copy(), init=False)
+
+
+@pytest.fixture(scope='session')
+def cdoctest():
+    return CDocTest()
+
+
+def test_execute_and_stream():
+    async def main():
+        lines = []
+        async with fake_session() as session:
+            assert await session.execute('echo 120') == '120'
+            assert await session.execute('noop') == ''
+            assert await session.execute('echo a\\nb', lines.append) == 'a\nb'
+            assert await session.execute('echo first\necho second') == 'first\nsecond'
+            streamed = [line async for line in session.stream('spam 3')]
+        assert lines == ['a', 'b']
+        assert streamed == ['line 0', 'line 1', 'line 2']
+
+    asyncio.run(main())
+
+
+def test_process_death():
+    async def main():
+        async with fake_session() as session:
+            with pytest.raises(ReplSessionError) as error:
+                await session.execute('exit 3')
+            assert error.value.returncode == 3
+
+    asyncio.run(main())
+
+
+def test_sessions_run_concurrently():
+    async def main():
+        sessions = [fake_session() for _ in range(8)]
+        await asyncio.gather(*[session.start() for session in sessions])
+        start = time.monotonic()
+        await asyncio.gather(*[session.execute('sleep 0.5') for session in sessions])
+        elapsed = time.monotonic() - start
+        await asyncio.gather(*[session.close() for session in sessions])
+        return elapsed
+
+    assert asyncio.run(main()) < 8 * 0.5 / 2
+
+
+def test_run_verify_async(cdoctest):
+    def node(lines):
+        test_case = c_doctest.TestCase('case', [])
+        test_case.init(lines)
+        return SimpleNamespace(test=test_case, full_path=lambda: 'case')
+
+    nodes = [node(['>>> echo 120', '120']), node(['>>> echo 120', '121']), node(['>>> noop', '>>> echo 1', '1'])]
+    asyncio.run(cdoctest.run_verify_async([], [], [], nodes, concurrency=2, session_factory=fake_session))
+    assert [n.test.is_pass for n in nodes] == [True, False, True]
+
+
+def test_run_async_aborts_runaway_output():
+    async def main():
+        test_case = c_doctest.TestCase('runaway', [])
+        test_case.init(['>>> spam 1000000', 'line 0'])
+        async with fake_session() as session:
+            await test_case.run_async(session)
+            await session.process.wait()
+        return test_case
+
+    old_max_lines = c_doctest.CDocTestConfig.MAX_OUTPUT_LINES
+    c_doctest.CDocTestConfig.MAX_OUTPUT_LINES = 100
+    try:
+        test_case = asyncio.run(main())
+    finally:
+        c_doctest.CDocTestConfig.MAX_OUTPUT_LINES = old_max_lines
+    assert test_case.is_pass is False
+    assert test_case.tests[0].aborted is not None
+
+
+def test_run_verify_async_starts_repl_binary():
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    test_case = c_doctest.TestCase('case', [])
+    test_case.init(['>>> echo 1', '1'])
+    nodes = [SimpleNamespace(test=test_case, full_path=lambda: 'case')]
+    asyncio.run(cdoctest.run_verify_async([], [], [], nodes))
+    assert test_case.is_pass
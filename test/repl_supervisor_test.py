@@ -0,0 +1,82 @@
+import os
+from types import SimpleNamespace
+
+from cdoctest import CDocTest, CDocTestConfig
+from cdoctest import c_doctest
+from cdoctest.proc_stats import metrics_table
+import pytest
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+
+@pytest.fixture(scope='session')
+def cdoctest():
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    return cdoctest
+
+
+def node(lines):
+    test_case = c_doctest.TestCase('case', [])
+    test_case.init(lines)
+    return SimpleNamespace(test=test_case, full_path=lambda: 'case')
+
+
+def test_describe_exit():
+    assert c_doctest.describe_exit(-11) == 'killed by signal 11 (SIGSEGV)'
+    assert c_doctest.describe_exit(139) == 'killed by signal 11 (SIGSEGV)'
+    assert c_doctest.describe_exit(3) == 'exited with code 3'
+
+
+def test_crash_is_isolated(cdoctest):
+    nodes = [node(['>>> echo 1', '1']),
+             node(['>>> echo before', 'before', '>>> crash', '>>> echo 2', '2']),
+             node(['>>> echo 3', '3'])]
+    cdoctest.run_verify([], [], [], nodes)
+    assert [n.test.is_pass for n in nodes] == [True, False, True]
+    crashed = nodes[1].test.tests
+    assert crashed[0].is_pass and crashed[0].crashed is None
+    assert crashed[1].crashed == 'killed by signal 11 (SIGSEGV)'
+    assert crashed[2].aborted == 'not run, REPL killed by signal 11 (SIGSEGV)'
+    assert cdoctest.crashes == 1
+
+
+def test_setup_crashes_are_bounded(cdoctest, tmp_path):
+    (tmp_path / 'crash.so').write_text('')
+    started = []
+    new_shell = cdoctest.new_shell
+
+    def counting_new_shell(*args, **kwargs):
+        started.append(1)
+        return new_shell(*args, **kwargs)
+
+    cdoctest.new_shell = counting_new_shell
+    try:
+        nodes = [node(['>>> echo 1', '1']) for _ in range(CDocTestConfig.MAX_SETUP_CRASHES + 3)]
+        cdoctest.run_verify(['crash.so'], [str(tmp_path)], [], nodes)
+    finally:
+        del cdoctest.new_shell
+    assert len(started) == CDocTestConfig.MAX_SETUP_CRASHES
+    assert all(n.test.is_pass is False for n in nodes)
+    assert nodes[0].test.tests[0].crashed.endswith('before the test started')
+    assert nodes[-1].test.tests[0].crashed.startswith('not run, 3 REPLs in a row died')
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='needs /proc')
+def test_metrics(cdoctest):
+    nodes = [node(['>>> sleep 0.2', '>>> echo 1', '1']),
+             node(['>>> alloc 64', '>>> burn 0.3', '>>> echo 2', '2']),
+             node(['>>> crash'])]
+    cdoctest.run_verify([], [], [], nodes)
+    slow, heavy, crashed = [n.test.metrics for n in nodes]
+    assert slow['wall'] >= 0.2 and slow['first_output'] >= 0.2 and slow['startup'] > 0
+    assert slow['cpu_user'] < 0.2
+    assert heavy['rss_growth'] >= 60 * 1024 * 1024 and heavy['peak_rss'] >= heavy['rss_growth']
+    assert heavy['cpu_user'] + heavy['cpu_system'] >= 0.25
+    # the REPL is gone, only times are known
+    assert 'wall' in crashed and 'cpu_user' not in crashed
+    lines = metrics_table(nodes, 1)
+    assert lines[0] == 'top 1 slowest tests:' and lines[2].endswith('case')
+    assert lines[3] == 'top 1 heaviest tests:'
+    nodes[0].test.reset()
+    assert nodes[0].test.metrics == {}
@@ -0,0 +1,95 @@
+import os
+import time
+from types import SimpleNamespace
+
+from clang_repl_kernel import Shell
+
+from cdoctest import ResultCache
+from cdoctest import c_doctest
+
+
+def make_nodes(expected='120'):
+    nodes = []
+    for name in ['a.h::fac', 'a.h::fac2']:
+        test_case = c_doctest.TestCase(name, [])
+        test_case.init(['>>> %<< fac(5);', expected])
+        nodes.append(SimpleNamespace(test=test_case, rel_full_path=lambda name=name: name))
+    return nodes
+
+
+def run(cache, files, nodes, passed=True):
+    cache.apply(nodes, files)
+    for node in nodes:
+        if node.test.reused is None:
+            node.test.is_pass = passed
+            for test in node.test.tests:
+                test.is_pass = passed
+    cache.update(nodes)
+    return [node.test.reused for node in nodes]
+
+
+def test_result_cache_hit_and_invalidation(tmp_path):
+    header = tmp_path / 'a.h'
+    header.write_text('int fac(int n);\n')
+    lib = tmp_path / 'liba.so'
+    lib.write_bytes(b'lib')
+    cache_dir = str(tmp_path / 'cache')
+
+    def cache(version='18.1'):
+        return ResultCache(cache_dir, libs=[str(lib)], version=version)
+
+    assert run(cache(), [str(header)], make_nodes(), passed=False) == [None, None]
+    assert run(cache(), [str(header)], make_nodes()) == [None, None]
+    nodes = make_nodes()
+    assert run(cache(), [str(header)], nodes) == [ResultCache.REUSED, ResultCache.REUSED]
+    assert nodes[0].test.is_pass and nodes[0].test.tests[0].is_pass
+    assert nodes[0].test.tests[0].actual == ['120']
+    # expected output, header, library and clang-repl version are all part of the key
+    assert run(cache(), [str(header)], make_nodes('121')) == [None, None]
+    assert run(cache('19.1'), [str(header)], make_nodes()) == [None, None]
+    header.write_text('int fac(long n);\n')
+    assert run(cache(), [str(header)], make_nodes()) == [None, None]
+    lib.write_bytes(b'lib2')
+    assert run(cache(), [str(header)], make_nodes()) == [None, None]
+
+
+def test_result_cache_prune_lru(tmp_path):
+    header = tmp_path / 'a.h'
+    header.write_text('')
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=1, version='1')
+    run(cache, [str(header)], make_nodes('1'))
+    entries = sorted(os.path.join(root, file) for root, _, files in os.walk(cache.cache_dir) for file in files)
+    assert len(entries) == 2
+    size = max(os.path.getsize(entry) for entry in entries)
+    cache.max_bytes = size
+    old = time.time() - 100
+    os.utime(entries[0], (old, old))
+    cache.prune()
+    assert [os.path.exists(entry) for entry in entries] == [False, True]
+
+
+def test_result_cache_follows_include_path_header(tmp_path, monkeypatch):
+    # src/sample.cpp is tested through include/sample.h found by CPLUS_INCLUDE_PATH, which includes detail.h
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'include').mkdir()
+    source = tmp_path / 'src' / 'sample.cpp'
+    source.write_text('#include "sample.h"\nint fac(int n) { return n; }\n')
+    (tmp_path / 'include' / 'sample.h').write_text('#include <detail.h>\nint fac(int n);\n')
+    detail = tmp_path / 'include' / 'detail.h'
+    detail.write_text('#define FAC 1\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(Shell.env, 'CPLUS_INCLUDE_PATH', str(tmp_path / 'include'))
+    cache = ResultCache(str(tmp_path / 'cache'), version='1')
+
+    def files():
+        return ResultCache.tested_files(str(source), 'sample.h')
+
+    assert files() == sorted(os.path.realpath(str(file)) for file in
+                             [source, tmp_path / 'include' / 'sample.h', detail])
+    assert run(cache, files(), make_nodes()) == [None, None]
+    assert run(cache, files(), make_nodes()) == [ResultCache.REUSED, ResultCache.REUSED]
+    detail.write_text('#define FAC 2\n')
+    assert run(cache, files(), make_nodes()) == [None, None]
+    assert run(cache, files(), make_nodes()) == [ResultCache.REUSED, ResultCache.REUSED]
+    monkeypatch.setitem(Shell.env, 'LD_LIBRARY_PATH', str(tmp_path))
+    assert run(cache, files(), make_nodes()) == [None, None]
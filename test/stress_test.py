@@ -0,0 +1,35 @@
+import os
+from types import SimpleNamespace
+
+from cdoctest import CDocTest, StressRunner
+from cdoctest import c_doctest
+from cdoctest.stress import percentile, stress_table
+
+FAKE_REPL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_clang_repl.py')
+
+
+def node(lines, name):
+    test_case = c_doctest.TestCase(name, [])
+    test_case.init(lines)
+    return SimpleNamespace(test=test_case, full_path=lambda: name)
+
+
+def test_percentile():
+    values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    assert percentile(values, 0.5) == 5 and percentile(values, 0.95) == 10 and percentile([3], 0.95) == 3
+
+
+def test_repeat_finds_flaky_test(tmp_path):
+    cdoctest = CDocTest()
+    cdoctest.repl_binary = FAKE_REPL
+    # prints 1 on its first run only
+    nodes = [node(['>>> echo 1', '1'], 'stable'), node(['>>> count ' + str(tmp_path), '1'], 'flaky')]
+    StressRunner(cdoctest, repeat=4, concurrent=3).run([], [], nodes)
+    stable, flaky = [n.test for n in nodes]
+    assert stable.is_pass and stable.metrics['runs'] == 4 and stable.metrics['passes'] == 4
+    assert stable.metrics['wall_p50'] <= stable.metrics['wall_p95'] <= stable.metrics['wall_max']
+    # a failing run is kept for the report
+    assert not flaky.is_pass and flaky.metrics['passes'] == 1
+    lines = stress_table(nodes)
+    assert lines[1].split()[0] == '1/4' and lines[1].endswith('flaky')
+    assert lines[2].split()[0] == '4/4'